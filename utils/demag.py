@@ -0,0 +1,270 @@
+# oommf-python
+# Copyright (C) 2016 University of Southampton
+#
+# CONTACT: h.fangohr@soton.ac.uk
+
+'''
+In-process computation of the demagnetising field on a Mesh, as an
+alternative to init.oommf_demag. The demagnetising tensor of the mesh is
+computed with the formulas of Newell, Williams and Dunlop (J. Geophys. Res.
+98, 9551, 1993) and the field is obtained by FFT convolution over the zero
+padded mesh. Example:
+
+  from demag import Demag
+  demag = Demag(mesh)
+  H = demag.field(m, Ms)
+
+The Fourier transform of the tensor is cached in memory and the tensor is
+cached on disk (in DEMAG_CACHE_DIR), keyed by the number of cells, the cell
+size and the periodicity of the mesh. After the first evaluation, computing
+the field only costs the forward and inverse FFT of the magnetisation. Both
+caches are limited in size (MEMORY_CACHE_BYTES and DISK_CACHE_BYTES) and
+drop the least recently used tensors first.
+'''
+
+from __future__ import division
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+from mesh import MeshField
+from resultcache import MemoCache, ResultCache
+
+__all__ = ["DEMAG_CACHE_DIR", "demag_tensor", "Demag", "demag"]
+
+MU0 = 4e-7 * np.pi
+
+DEMAG_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".oommf_calculator",
+                               "demag")
+
+# Newell's formulas lose precision at large distances (because of
+# cancellations) and are replaced by the tensor of a point dipole for the
+# offsets larger than this number of (largest) cell sizes. The relative
+# difference between the two is about 1e-6 at this distance
+DIPOLE_RADIUS = 40
+
+# Maximum size in bytes of the Fourier transforms of the tensors kept in
+# memory (about 14 * 8 bytes per cell each) and of the tensors kept on disk
+MEMORY_CACHE_BYTES = 1 << 29
+DISK_CACHE_BYTES = 1 << 32
+
+_memory_cache = MemoCache(max_bytes=MEMORY_CACHE_BYTES)
+
+# The disk caches, by directory
+_disk_caches = {}
+_disk_caches_lock = threading.Lock()
+
+
+def _asinh_ratio(a, b):
+    """asinh(a / b), with 0 where b is 0."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(b > 0, np.arcsinh(a / np.where(b > 0, b, 1)), 0.0)
+
+
+def _atan_ratio(a, b):
+    """atan(a / b), with 0 where b is 0."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(b != 0, np.arctan(a / np.where(b != 0, b, 1)), 0.0)
+
+
+def _newell_f(x, y, z):
+    x2, y2, z2 = x * x, y * y, z * z
+    r = np.sqrt(x2 + y2 + z2)
+    return (0.5 * y * (z2 - x2) * _asinh_ratio(y, np.sqrt(x2 + z2)) +
+            0.5 * z * (y2 - x2) * _asinh_ratio(z, np.sqrt(x2 + y2)) -
+            x * y * z * _atan_ratio(y * z, x * r) +
+            (2 * x2 - y2 - z2) * r / 6)
+
+
+def _newell_g(x, y, z):
+    x2, y2, z2 = x * x, y * y, z * z
+    r = np.sqrt(x2 + y2 + z2)
+    return (x * y * z * _asinh_ratio(z, np.sqrt(x2 + y2)) +
+            y * (3 * z2 - y2) * _asinh_ratio(x, np.sqrt(y2 + z2)) / 6 +
+            x * (3 * z2 - x2) * _asinh_ratio(y, np.sqrt(x2 + z2)) / 6 -
+            z * z2 * _atan_ratio(x * y, z * r) / 6 -
+            z * y2 * _atan_ratio(x * z, y * r) / 2 -
+            z * x2 * _atan_ratio(y * z, x * r) / 2 -
+            x * y * r / 3)
+
+
+def _newell_component(fn, ranges, cell_size):
+    """Return the tensor component obtained from the function 'fn' (f for
+    the diagonal, g for the off-diagonal components) for the offsets
+    i * cell_size[0], j * cell_size[1], k * cell_size[2], where i, j, k
+    span the given ranges of integers."""
+    # Evaluate fn on the offsets extended by one cell in each direction and
+    # apply the 27 point finite difference stencil with shifted slices
+    axes = [np.arange(r[0] - 1, r[-1] + 2) * h
+            for r, h in zip(ranges, cell_size)]
+    x, y, z = np.meshgrid(*axes, indexing="ij", sparse=True)
+    values = fn(x, y, z)
+    shape = [len(r) for r in ranges]
+    res = np.zeros(shape)
+    for di in (-1, 0, 1):
+        for dj in (-1, 0, 1):
+            for dk in (-1, 0, 1):
+                order = abs(di) + abs(dj) + abs(dk)
+                weight = 8 * (-0.5) ** order
+                res += weight * values[1 + di:1 + di + shape[0],
+                                       1 + dj:1 + dj + shape[1],
+                                       1 + dk:1 + dk + shape[2]]
+    return res / (4 * np.pi * np.prod(cell_size))
+
+
+def _tensor_for_offsets(ranges, cell_size):
+    """Return the 6 components (xx, yy, zz, xy, xz, yz) of the tensor for
+    the offsets spanned by 'ranges', see _newell_component."""
+    perms = {"xx": (0, 1, 2), "yy": (1, 2, 0), "zz": (2, 0, 1),
+             "xy": (0, 1, 2), "xz": (0, 2, 1), "yz": (1, 2, 0)}
+    components = []
+    for name in ["xx", "yy", "zz", "xy", "xz", "yz"]:
+        p = perms[name]
+        fn = _newell_f if name[0] == name[1] else _newell_g
+        c = _newell_component(fn, [ranges[i] for i in p],
+                              [cell_size[i] for i in p])
+        # Back to the x, y, z order of the axes
+        components.append(np.transpose(c, np.argsort(p)))
+    components = np.array(components)
+
+    r = np.meshgrid(*[np.asarray(rng) * h
+                      for rng, h in zip(ranges, cell_size)],
+                    indexing="ij", sparse=True)
+    r2 = r[0] ** 2 + r[1] ** 2 + r[2] ** 2
+    far = r2 > (DIPOLE_RADIUS * max(cell_size)) ** 2
+    if np.any(far):
+        # The values at the origin (nan) are never used
+        with np.errstate(divide="ignore", invalid="ignore"):
+            factor = np.prod(cell_size) / (4 * np.pi * r2 ** 2.5)
+            for c, (i, j) in enumerate([(0, 0), (1, 1), (2, 2),
+                                        (0, 1), (0, 2), (1, 2)]):
+                dipole = factor * ((i == j) * r2 - 3 * r[i] * r[j])
+                components[c][far] = \
+                    np.broadcast_to(dipole, components[c].shape)[far]
+    return components
+
+
+def demag_tensor(mesh_size, cell_size, periodic=(False, False, False),
+                 images=8):
+    """Return the demagnetising tensor of a mesh as an array of shape
+    (6, px, py, pz) with the components xx, yy, zz, xy, xz, yz, ready for
+    the FFT convolution over a mesh padded to px, py, pz cells: each
+    component contains the tensor for the offset i along x at index i for
+    i >= 0 and at index px + i for i < 0 (and the same for y and z). Along
+    periodic directions the mesh is not padded and the tensor includes the
+    contributions of 'images' periodic images on each side."""
+    ranges = []
+    for n, p in zip(mesh_size, periodic):
+        if p:
+            ranges.append(np.arange(-(images + 1) * n + 1, (images + 1) * n))
+        else:
+            ranges.append(np.arange(-n + 1, n))
+    tensor = _tensor_for_offsets(ranges, np.asarray(cell_size, dtype=float))
+
+    padded = _padded_shape(mesh_size, periodic)
+    for axis, (r, size) in enumerate(zip(ranges, padded)):
+        # Fold the offsets on the padded mesh (summing the periodic images)
+        idx = r % size
+        folded = np.zeros(tensor.shape[:axis + 1] + (size,) +
+                          tensor.shape[axis + 2:])
+        np.add.at(folded, (slice(None),) * (axis + 1) + (idx,), tensor)
+        tensor = folded
+    return tensor
+
+
+def _padded_shape(mesh_size, periodic):
+    return tuple(n if p else (2 * n if n > 1 else 1)
+                 for n, p in zip(mesh_size, periodic))
+
+
+def _cache_key(mesh_size, cell_size, periodic, images):
+    key = "%s|%s|%s|%d" % (",".join("%d" % n for n in mesh_size),
+                           ",".join("%.17g" % h for h in cell_size),
+                           ",".join("%d" % bool(p) for p in periodic),
+                           images if any(periodic) else 0)
+    return hashlib.sha1(key.encode("ascii")).hexdigest()
+
+
+def _get_disk_cache(cache_dir):
+    with _disk_caches_lock:
+        if cache_dir not in _disk_caches:
+            _disk_caches[cache_dir] = ResultCache(cache_dir,
+                                                  max_bytes=DISK_CACHE_BYTES)
+        return _disk_caches[cache_dir]
+
+
+def _get_tensor_fft(mesh_size, cell_size, periodic, images, cache_dir):
+    key = _cache_key(mesh_size, cell_size, periodic, images)
+    arrays = _memory_cache.get(key)
+    if arrays is not None:
+        return arrays["tensor_fft"]
+    disk_cache = None if cache_dir is None else _get_disk_cache(cache_dir)
+    arrays = None if disk_cache is None else disk_cache.get(key)
+    if arrays is not None:
+        tensor = arrays["tensor"]
+    else:
+        tensor = demag_tensor(mesh_size, cell_size, periodic, images)
+        if disk_cache is not None:
+            disk_cache.put(key, {"tensor": tensor})
+    arrays = {"tensor_fft": np.fft.rfftn(tensor, axes=(1, 2, 3))}
+    return _memory_cache.put(key, arrays)["tensor_fft"]
+
+
+class Demag(object):
+
+    """Demagnetising field calculator for a given mesh. 'periodic' gives,
+    for each of the x, y, z directions, whether the mesh is periodic, and
+    'images' the number of periodic images included on each side. If
+    'cache_dir' is None, the tensor is not cached on disk."""
+
+    def __init__(self, mesh, periodic=(False, False, False), images=8,
+                 cache_dir=DEMAG_CACHE_DIR):
+        self.mesh = mesh
+        self.periodic = tuple(bool(p) for p in periodic)
+        self.images = images
+        self.cache_dir = cache_dir
+        self._tensor_fft = None
+
+    def _get_tensor_fft(self):
+        if self._tensor_fft is None:
+            self._tensor_fft = _get_tensor_fft(
+                tuple(self.mesh.mesh_size), tuple(self.mesh.cell_size),
+                self.periodic, self.images, self.cache_dir)
+        return self._tensor_fft
+
+    def field(self, s0, Ms, energy=False):
+        """Return the demagnetising field (A/m) for the normalised
+        magnetisation 's0' and saturation magnetisation 'Ms' (a number or a
+        MeshField with dims (1,)). With energy=True also return the energy
+        density (J/m^3)."""
+        assert type(s0) is MeshField and s0.dims == (3,)
+        assert tuple(s0.mesh.mesh_size) == tuple(self.mesh.mesh_size)
+        n_fft = self._get_tensor_fft()
+        padded = _padded_shape(self.mesh.mesh_size, self.periodic)
+        if isinstance(Ms, MeshField):
+            m = s0.xyz_view() * Ms.xyz_view()
+        else:
+            m = s0.xyz_view() * Ms
+
+        m_fft = np.fft.rfftn(m, s=padded, axes=(1, 2, 3))
+        xx, yy, zz, xy, xz, yz = n_fft
+        h_fft = np.array([xx * m_fft[0] + xy * m_fft[1] + xz * m_fft[2],
+                          xy * m_fft[0] + yy * m_fft[1] + yz * m_fft[2],
+                          xz * m_fft[0] + yz * m_fft[1] + zz * m_fft[2]])
+        h = np.fft.irfftn(h_fft, s=padded, axes=(1, 2, 3))
+        nx, ny, nz = self.mesh.mesh_size
+        h = -h[:, :nx, :ny, :nz]
+        field = self.mesh.field_from_xyz_array(h)
+        if not energy:
+            return field
+        e = -0.5 * MU0 * np.sum(m * h, axis=0)
+        return field, self.mesh.field_from_xyz_array(e[np.newaxis])
+
+
+def demag(s0, Ms, periodic=(False, False, False), energy=False,
+          cache_dir=DEMAG_CACHE_DIR):
+    """Demagnetising field, computed as in init.oommf_demag. See Demag."""
+    return Demag(s0.mesh, periodic=periodic,
+                 cache_dir=cache_dir).field(s0, Ms, energy=energy)
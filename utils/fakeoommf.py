@@ -0,0 +1,142 @@
+# oommf-python
+# Copyright (C) 2016 University of Southampton
+#
+# CONTACT: h.fangohr@soton.ac.uk
+
+'''
+A stand-in for OOMMF, for testing the code which runs it without OOMMF
+installed. It understands the problems written by oommf_calculator:
+
+  python fakeoommf.py boxsi [-threads N] problem.mif
+
+reads the basename of the problem and the outputs scheduled in the MIF file
+and writes one OVF file for each of them, as OOMMF would after one step.
+The magnetisation (Oxs_TimeDriver::Spin) is the initial one, read from
+<basename>-start.omf, and all the other fields are zero.
+
+  python fakeoommf.py worker [script]
+
+stands in for the OOMMF worker of oommfpool.py (oommfworker.tcl, which is
+given as 'script' and ignored), speaking the same protocol. A problem whose
+MIF file contains "fakeoommf: fail", "fakeoommf: crash" or "fakeoommf:
+hang" respectively fails, makes the worker exit or never completes. If the
+environment variable FAKEOOMMF_LOG is set, a line is appended to that file
+for each problem run, by both commands.
+'''
+
+from __future__ import print_function, unicode_literals
+import os
+import re
+import shlex
+import shutil
+import sys
+import time
+
+from ovf import OVFFile, OVF10
+
+__all__ = ["fake_boxsi", "fake_worker", "main"]
+
+
+def _log(*words):
+    if os.environ.get("FAKEOOMMF_LOG"):
+        with open(os.environ["FAKEOOMMF_LOG"], "a") as f:
+            f.write(" ".join(str(w) for w in words) + "\n")
+
+
+def _write_output(start, output, filename):
+    # Writes the given output as OOMMF would after one step from 'start'
+    if output == "Oxs_TimeDriver::Spin":
+        shutil.copy(start, filename)
+    else:
+        field = OVFFile(start).get_field()
+        field.field_data[...] = 0
+        ovf_file = OVFFile()
+        ovf_file.new(field, version=OVF10, data_type="binary8")
+        ovf_file.write(filename)
+
+
+def _start_file(mif, mif_filename):
+    # The initial magnetisation, relative to the directory of the MIF file
+    start = re.search(r"^\s*file\s+(\S+)", mif, re.M).group(1)
+    return os.path.join(os.path.dirname(os.path.abspath(mif_filename)),
+                        start)
+
+
+def fake_boxsi(mif_filename, threads=None):
+    with open(mif_filename) as f:
+        mif = f.read()
+    _log("boxsi", threads, mif_filename)
+    basename = re.search(r"^\s*basename\s+(\S+)", mif, re.M).group(1)
+    start = _start_file(mif, mif_filename)
+    for output in re.findall(r"^\s*Schedule\s+(\S+)\s+archive", mif, re.M):
+        owner, name = output.split("::")
+        filename = "%s-%s-%s-00-0000000" % (basename, owner, name)
+        extension = ".omf" if output == "Oxs_TimeDriver::Spin" else ".ohf"
+        _write_output(start, output, filename + extension)
+
+
+def _fake_run(mif_filename, threads, outputs):
+    with open(mif_filename) as f:
+        mif = f.read()
+    _log("worker", threads, mif_filename)
+    if "fakeoommf: crash" in mif:
+        os._exit(3)
+    if "fakeoommf: hang" in mif:
+        time.sleep(3600)
+    if "fakeoommf: fail" in mif:
+        raise ValueError("Failed as requested by %s" % mif_filename)
+    start = _start_file(mif, mif_filename)
+    for output, filename in zip(outputs[::2], outputs[1::2]):
+        _write_output(start, output, filename)
+
+
+def fake_worker(stdin=None, stdout=None):
+    """Serve the requests of oommfpool.WorkerPool (see oommfworker.tcl)."""
+    stdin = sys.stdin if stdin is None else stdin
+    stdout = sys.stdout if stdout is None else stdout
+
+    def reply(*words):
+        stdout.write("oommfworker: %s\n" % " ".join(words))
+        stdout.flush()
+
+    # Lines which are not replies are ignored by the pool
+    print("Fake Oxs shell", file=stdout)
+    reply("ready")
+    for line in iter(stdin.readline, ""):
+        words = shlex.split(str(line))
+        if len(words) == 0:
+            continue
+        if words[0] == "run":
+            try:
+                _fake_run(words[1], int(words[2]), words[3:])
+            except Exception as ex:
+                reply("error", str(ex).replace("\n", " "))
+            else:
+                reply("done")
+        elif words[0] == "ping":
+            reply("pong")
+        elif words[0] == "exit":
+            break
+        else:
+            reply("error", "Unknown request %s" % words[0])
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) >= 1 and argv[0] == "worker":
+        fake_worker()
+        return 0
+    if len(argv) < 2 or argv[0] != "boxsi":
+        print("usage: python fakeoommf.py boxsi [-threads N] problem.mif\n"
+              "       python fakeoommf.py worker [script]", file=sys.stderr)
+        return 2
+    threads = None
+    if "-threads" in argv[1:-1]:
+        threads = int(argv[argv.index("-threads") + 1])
+    fake_boxsi(argv[-1], threads=threads)
+    print("Boxsi run end.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+# oommf-python
+# Copyright (C) 2016 University of Southampton
+#
+# CONTACT: h.fangohr@soton.ac.uk
+
+'''
+In-process computation of the local micromagnetic field terms with numpy.
+The functions mirror those in init.py, which compute the same fields by
+running OOMMF, and follow the same conventions: 's0' (or 'm0') is the
+normalised magnetisation, a MeshField with dims (3,), 'Ms' is the saturation
+magnetisation (A/m) and the fields are returned as MeshField objects in A/m.
+With energy=True, the functions also return the energy density (J/m^3) as a
+MeshField with dims (1,).
+
+The exchange field uses the same six-neighbour discretisation of OOMMF's
+Oxs_UniformExchange, with Neumann boundary conditions by default.
+'''
+
+from __future__ import division
+import numpy as np
+
+from mesh import MeshField
+
+__all__ = ["MU0", "uniform_exchange", "fixed_zeeman", "uniaxial_anisotropy",
+           "cubic_anisotropy", "dmdt"]
+
+MU0 = 4e-7 * np.pi
+
+
+def _check_magnetisation(s0):
+    assert type(s0) is MeshField and s0.dims == (3,)
+
+
+def _result(s0, field, energy_density, energy):
+    field = MeshField(s0.mesh, field, (3,))
+    if not energy:
+        return field
+    energy_density = MeshField(s0.mesh, energy_density.reshape((1, -1)),
+                               (1,))
+    return field, energy_density
+
+
+def _unit_vector(v):
+    v = np.asarray(v, dtype=float)
+    return v / np.sqrt(np.dot(v, v))
+
+
+def uniform_exchange(s0, Ms, A, boundary="neumann", energy=False):
+    """Exchange field H = 2 A / (mu0 Ms) Laplacian(m), where the Laplacian
+    is computed with the given boundary conditions (see
+    MeshField.laplacian)."""
+    _check_magnetisation(s0)
+    field = s0.laplacian(boundary=boundary).flat
+    field *= 2 * A / (MU0 * Ms)
+    e = -0.5 * MU0 * Ms * np.sum(s0.flat * field, axis=0)
+    return _result(s0, field, e, energy)
+
+
+def fixed_zeeman(s0, Ms, H, energy=False):
+    """Zeeman field, equal to the applied field 'H' (a vector or a MeshField
+    with dims (3,))."""
+    _check_magnetisation(s0)
+    if isinstance(H, MeshField):
+        field = H.flat.copy()
+    else:
+        field = np.empty(s0.flat.shape)
+        field[...] = np.reshape(np.asarray(H, dtype=float), (3, 1))
+    e = -MU0 * Ms * np.sum(s0.flat * field, axis=0)
+    return _result(s0, field, e, energy)
+
+
+def uniaxial_anisotropy(m0, Ms, K1, axis, energy=False):
+    """Uniaxial anisotropy field H = 2 K1 / (mu0 Ms) (m.u) u. As in OOMMF's
+    Oxs_UniaxialAnisotropy, the energy density is K1 (1 - (m.u)^2) for
+    K1 > 0 and -K1 (m.u)^2 otherwise, so that it is never negative."""
+    _check_magnetisation(m0)
+    u = _unit_vector(axis)
+    mu = np.dot(u, m0.flat)
+    field = (2 * K1 / (MU0 * Ms)) * u[:, np.newaxis] * mu
+    if K1 > 0:
+        e = K1 * (1 - mu * mu)
+    else:
+        e = -K1 * mu * mu
+    return _result(m0, field, e, energy)
+
+
+def cubic_anisotropy(m0, Ms, u1, u2, K1, K2=0, K3=0, energy=False):
+    """Cubic anisotropy with axes u1, u2 and u3 = u1 x u2, as computed by
+    Southampton_CubicAnisotropy8. With a_i = m.u_i, the energy density is
+
+      K1 (a1^2 a2^2 + a2^2 a3^2 + a3^2 a1^2) + K2 a1^2 a2^2 a3^2
+        + K3 (a1^4 a2^4 + a2^4 a3^4 + a3^4 a1^4)
+
+    and the field is -1/(mu0 Ms) times its derivative with respect to m."""
+    _check_magnetisation(m0)
+    u1 = _unit_vector(u1)
+    u2 = _unit_vector(u2)
+    axes = np.array([u1, u2, np.cross(u1, u2)])
+    a = np.dot(axes, m0.flat)
+    a2 = a * a
+    a4 = a2 * a2
+    field = np.zeros(m0.flat.shape)
+    for i in range(3):
+        j, k = (i + 1) % 3, (i + 2) % 3
+        de_da = (2 * K1 * a[i] * (a2[j] + a2[k]) +
+                 2 * K2 * a[i] * a2[j] * a2[k] +
+                 4 * K3 * a[i] * a2[i] * (a4[j] + a4[k]))
+        field -= axes[i][:, np.newaxis] * de_da
+    field *= 1 / (MU0 * Ms)
+    e = (K1 * (a2[0] * a2[1] + a2[1] * a2[2] + a2[2] * a2[0]) +
+         K2 * a2[0] * a2[1] * a2[2] +
+         K3 * (a4[0] * a4[1] + a4[1] * a4[2] + a4[2] * a4[0]))
+    return _result(m0, field, e, energy)
+
+
+def dmdt(s0, Ms, A, H, alpha, gamma_G):
+    """Right hand side of the Landau-Lifshitz-Gilbert equation for the
+    applied field 'H' only, as in init.oommf_dmdt (where 'A' is not used
+    either):
+
+      dm/dt = -gamma_G / (1 + alpha^2) (m x H + alpha m x (m x H))
+    """
+    field = fixed_zeeman(s0, Ms, H).flat
+    m = s0.flat
+    mxh = np.cross(m, field, axis=0)
+    mxmxh = np.cross(m, mxh, axis=0)
+    res = (-gamma_G / (1 + alpha * alpha)) * (mxh + alpha * mxmxh)
+    return MeshField(s0.mesh, np.ascontiguousarray(res), (3,))
@@ -1,6 +1,16 @@
+import os
 from oommf_calculator import calculate_oommf_fields
 import numpy as np
 from mesh import MeshField
+import field_engine
+import demag as demag_engine
+
+# The functions without the 'oommf_' prefix compute the same fields either
+# in-process with numpy (engine="numpy", see field_engine.py and demag.py) or
+# by running OOMMF (engine="oommf"). The default engine can be set with the
+# environment variable OOMMF_PYTHON_ENGINE
+ENGINES = ("numpy", "oommf")
+ENGINE = os.environ.get("OOMMF_PYTHON_ENGINE", "numpy")
 
 
 def mesh_spec(mesh):
@@ -129,3 +139,41 @@ def oommf_dmdt(s0, Ms, A, H, alpha, gamma_G):
     assert np.max(np.abs(s_field.flat - s0.flat)) < 1e-14
 
     return field
+
+
+def _select_engine(engine, numpy_fn, oommf_fn):
+    if engine is None:
+        engine = ENGINE
+    if engine not in ENGINES:
+        raise ValueError("Invalid engine '%s': expected one of %s."
+                         % (engine, ", ".join(ENGINES)))
+    return numpy_fn if engine == "numpy" else oommf_fn
+
+
+def demag(s0, Ms, engine=None):
+    return _select_engine(engine, demag_engine.demag, oommf_demag)(s0, Ms)
+
+
+def uniform_exchange(s0, Ms, A, engine=None):
+    return _select_engine(engine, field_engine.uniform_exchange,
+                          oommf_uniform_exchange)(s0, Ms, A)
+
+
+def uniaxial_anisotropy(m0, Ms, K1, axis, engine=None):
+    return _select_engine(engine, field_engine.uniaxial_anisotropy,
+                          oommf_uniaxial_anisotropy)(m0, Ms, K1, axis)
+
+
+def cubic_anisotropy(m0, Ms, u1, u2, K1, K2=0, K3=0, engine=None):
+    return _select_engine(engine, field_engine.cubic_anisotropy,
+                          oommf_cubic_anisotropy)(m0, Ms, u1, u2, K1, K2, K3)
+
+
+def fixed_zeeman(s0, Ms, H, engine=None):
+    return _select_engine(engine, field_engine.fixed_zeeman,
+                          oommf_fixed_zeeman)(s0, Ms, H)
+
+
+def dmdt(s0, Ms, A, H, alpha, gamma_G, engine=None):
+    return _select_engine(engine, field_engine.dmdt,
+                          oommf_dmdt)(s0, Ms, A, H, alpha, gamma_G)
@@ -16,6 +16,7 @@ import numpy
 import collections
 
 from functools import reduce
+import itertools
 import sys
 py_ver = sys.version_info[0]
 __all__ = ["first_difference", "parse_lattice_spec",
@@ -125,19 +126,53 @@ class Lattice(object):
     nodes = property(get_shape)
 
     def get_positions(self, flat=False):
-        slices = []
-        for xstart, xend, num_xs in self.min_max_num_list:
-            if num_xs > 1:
-                dx = (xend - xstart) / float(num_xs - 1)
-                s = slice(xstart, xend + 0.5 * dx, dx)
-            else:
-                s = slice(xstart, xend + 1.0, xstart + 0.5)
-            slices.append(s)
-        ps = numpy.lib.index_tricks.mgrid.__getitem__(slices)
+        """Return an array with the positions of all the points in the
+        lattice. For a lattice with shape (n0, n1, ..., nk) the array has
+        shape (nk, n0, ..., n(k-1), dim), or (n0*n1*...*nk, dim) if 'flat'
+        is True (with the last dimension varying fastest). See
+        'get_coordinates' and 'iter_positions' for alternatives which do not
+        store all the positions in memory."""
+        coords = self.get_coordinates()
+        ps = numpy.empty([self.dim] + self.nodes)
+        for i, coord in enumerate(coords):
+            ps[i] = coord
         if flat:
             ps.shape = (ps.shape[0], -1)
         return ps.swapaxes(0, -1)
 
+    def get_broadcast_axes(self):
+        """Return the arrays of 'get_axes' reshaped so that they broadcast to
+        the shape of the lattice: for a 3D lattice, the arrays have shapes
+        (nx, 1, 1), (1, ny, 1) and (1, 1, nz)."""
+        axes = self.get_axes()
+        return [axis.reshape([-1 if i == j else 1 for j in range(self.dim)])
+                for i, axis in enumerate(axes)]
+
+    def get_coordinates(self):
+        """Return a list containing, for each dimension, an array with the
+        shape of the lattice containing the corresponding coordinate of each
+        point. The arrays are read-only broadcast views of the arrays of
+        'get_axes', so that they take no memory."""
+        return numpy.broadcast_arrays(*self.get_broadcast_axes())
+
+    def iter_positions(self, chunk_size=1 << 16):
+        """Iterate over the points of the lattice in chunks of at most
+        'chunk_size' points, following the order of the lattice. For each
+        chunk, yield a tuple (start, stop, positions), where 'start' and
+        'stop' delimit the range of the flat indices of the points of the
+        chunk and 'positions' is an array of shape (stop - start, dim)."""
+        axes = self.get_axes()
+        shape = self.nodes
+        num_points = self.get_num_points()
+        for start in range(0, num_points, chunk_size):
+            stop = min(num_points, start + chunk_size)
+            idx = numpy.unravel_index(numpy.arange(start, stop), shape,
+                                      order=self.order)
+            positions = numpy.empty((stop - start, self.dim))
+            for i, axis in enumerate(axes):
+                positions[:, i] = axis[idx[i]]
+            yield (start, stop, positions)
+
     def _get_stepsizes(self, scale=1.0):
         return [(scale * (mx - mn) / (ns - 1) if ns > 1 else (mx - mn))
                 for mn, mx, ns in self.min_max_num_list]
@@ -189,6 +224,65 @@ class Lattice(object):
                 pos.append(x_min)
         return pos
 
+    def _check_last_axis(self, a, dtype):
+        a = numpy.asarray(a, dtype=dtype)
+        if a.ndim == 0 or a.shape[-1] != self.dim:
+            raise ValueError("Expected an array with shape (..., %d), but "
+                             "got %s." % (self.dim, a.shape))
+        return a
+
+    def get_closest_array(self, positions, clamp=True, return_mask=False):
+        """Vectorized version of 'get_closest': 'positions' is an array of
+        shape (..., dim) and the result is an integer array with the same
+        shape containing the indices of the closest points. If 'clamp' is
+        True, the indices of the positions outside the lattice are clamped
+        to the nearest point on the boundary. If 'return_mask' is True, also
+        return a boolean array of shape (...) which is False for positions
+        whose closest point would lie outside the lattice."""
+        positions = self._check_last_axis(positions, float)
+        idx = numpy.zeros(positions.shape, dtype=int)
+        inside = numpy.ones(positions.shape[:-1], dtype=bool)
+        for i, (x_min, x_max, x_num) in enumerate(self.min_max_num_list):
+            if x_min < x_max:
+                idx_i = numpy.round((x_num - 1) * (positions[..., i] - x_min)
+                                    / (x_max - x_min)).astype(int)
+                inside &= (idx_i >= 0) & (idx_i < x_num)
+                if clamp:
+                    numpy.clip(idx_i, 0, x_num - 1, out=idx_i)
+                idx[..., i] = idx_i
+        return (idx, inside) if return_mask else idx
+
+    def get_pos_from_idx_array(self, idx):
+        """Vectorized version of 'get_pos_from_idx': 'idx' is an array of
+        shape (..., dim) of indices and the result is an array with the same
+        shape containing the corresponding positions."""
+        idx = self._check_last_axis(idx, None)
+        pos = numpy.empty(idx.shape, dtype=float)
+        for i, (x_min, x_max, x_num) in enumerate(self.min_max_num_list):
+            if x_num > 1:
+                delta_x = (x_max - x_min) / float(x_num - 1)
+                pos[..., i] = x_min + delta_x * idx[..., i]
+            else:
+                pos[..., i] = x_min
+        return pos
+
+    def get_flat_idx(self, idx, mode="raise"):
+        """Convert an array of shape (..., dim) of indices to the
+        corresponding indices in the flattened lattice, following the order
+        of the lattice ("C" or "F"). 'mode' is passed to
+        'numpy.ravel_multi_index' and determines how indices outside the
+        lattice are treated ("raise", "clip" or "wrap")."""
+        idx = self._check_last_axis(idx, int)
+        return numpy.ravel_multi_index(tuple(numpy.rollaxis(idx, -1)),
+                                       self.nodes, mode=mode,
+                                       order=self.order)
+
+    def get_idx_from_flat(self, flat_idx):
+        """Inverse of 'get_flat_idx': return the array of shape (..., dim) of
+        the indices corresponding to the given flat indices."""
+        idx = numpy.unravel_index(flat_idx, self.nodes, order=self.order)
+        return numpy.stack(idx, axis=-1)
+
     def scale(self, factors):
         """Scale the Lattice object by the given factor. If factors is a list
         than it is interpreted as a list of factors, one for each corresponding
@@ -206,6 +300,20 @@ class Lattice(object):
                 mn, mx, nm = self.min_max_num_list[i]
                 self.min_max_num_list[i] = (mn * f, mx * f, nm)
 
+    def get_axes(self):
+        """Return a list containing, for each dimension, a 1-D array with the
+        coordinates of the points of the lattice along that dimension. These
+        are the positions visited by the method 'foreach'."""
+        axes = []
+        for x_min, x_max, num_steps in self.min_max_num_list:
+            x_min += self.reduction
+            x_max -= self.reduction
+            if num_steps > 1:
+                axes.append(numpy.linspace(x_min, x_max, num_steps))
+            else:
+                axes.append(numpy.array([x_min], dtype=float))
+        return axes
+
     def _foreach(self, nr_idx, idx, pos, fn, fastest_idx, idx_order):
         if nr_idx == fastest_idx:
             fn(idx, pos)
@@ -242,6 +350,33 @@ class Lattice(object):
             self._foreach(self.dim - 1, idx, pos, fn, -1, -1)
 
 
+def _interpolation_taps(u, n, order):
+    """Return the list of (indices, weights) pairs needed to interpolate
+    along one direction with 'n' points at the fractional indices 'u' (a 1-D
+    array). 'order' is "nearest", "linear" or "cubic" (Catmull-Rom spline).
+    Fractional indices outside [0, n - 1] are clamped and the neighbours
+    beyond the boundary are replaced by the boundary points."""
+    u = numpy.clip(u, 0, n - 1)
+    if order == "nearest":
+        return [(numpy.round(u).astype(int), numpy.ones(u.shape))]
+
+    i0 = numpy.clip(numpy.floor(u).astype(int), 0, max(n - 2, 0))
+    t = u - i0
+    if order == "linear":
+        return [(i0, 1.0 - t), (numpy.minimum(i0 + 1, n - 1), t)]
+    elif order == "cubic":
+        t2 = t * t
+        t3 = t2 * t
+        weights = [-0.5 * t3 + t2 - 0.5 * t,
+                   1.5 * t3 - 2.5 * t2 + 1.0,
+                   -1.5 * t3 + 2.0 * t2 + 0.5 * t,
+                   0.5 * t3 - 0.5 * t2]
+        return [(numpy.clip(i0 + k - 1, 0, n - 1), w)
+                for k, w in enumerate(weights)]
+    raise ValueError("Invalid interpolation order '%s': expected 'nearest', "
+                     "'linear' or 'cubic'." % order)
+
+
 class FieldLattice(object):
 
     def __init__(self, lattice, dim=3, order="F",
@@ -261,13 +396,130 @@ class FieldLattice(object):
             self.field_data = \
                 numpy.ndarray(dtype=float, shape=shape, order=order)
 
-    def set(self, setter):
+    def set(self, setter, mode="point"):
+        """Set the field by calling the function 'setter', which computes the
+        field from the positions of the points of the lattice. 'mode'
+        determines how the positions are passed:
+
+          - "point": 'setter(pos)' is called for each point, where 'pos' is
+            a list with the position of the point, and returns the list of
+            the components of the field at that point;
+
+          - "axes": 'setter(x, y, ...)' is called once, where x, y, ... are
+            the arrays of 'Lattice.get_axes' shaped so that they broadcast
+            to the shape of the lattice (e.g. x has shape (nx, 1, 1));
+
+          - "grid": 'setter(pos)' is called once, where 'pos' is an array of
+            shape (dim, nx, ny, ...) containing the positions of all the
+            points.
+
+        In the "axes" and "grid" modes 'setter' returns a sequence of
+        'field_dim' components, each broadcastable to the shape of the
+        lattice (e.g. an array of shape (field_dim, nx, ny, ...)).
+        """
         all_components = [slice(None)]
-        if self.lattice.order == 'C':
-            def fn(idx, pos):
-                self.field_data[idx + all_components] = setter(pos)
+        if mode == "point":
+            if self.lattice.order == 'C':
+                def fn(idx, pos):
+                    self.field_data[tuple(idx + all_components)] = \
+                        setter(pos)
+            else:
+                def fn(idx, pos):
+                    self.field_data[tuple(all_components + idx)] = \
+                        setter(pos)
+
+            self.lattice.foreach(fn)
+            return
+
+        axes = self.lattice.get_broadcast_axes()
+        if mode == "axes":
+            value = setter(*axes)
+        elif mode == "grid":
+            value = setter(numpy.array(numpy.broadcast_arrays(*axes)))
         else:
-            def fn(idx, pos):
-                self.field_data[all_components + idx] = setter(pos)
-
-        self.lattice.foreach(fn)
+            raise ValueError("Invalid mode '%s': expected 'point', 'axes' or "
+                             "'grid'." % mode)
+
+        if len(value) != self.field_dim:
+            raise ValueError("The setter returned %d components, but the "
+                             "field has %d." % (len(value), self.field_dim))
+        all_nodes = [slice(None)] * self.lattice.dim
+        for i in range(self.field_dim):
+            idx = self.lattice._combine_idx(all_nodes, [i])
+            self.field_data[tuple(idx)] = value[i]
+
+    def _get_fractional_idx(self, x, i):
+        """Return the fractional indices of the coordinates 'x' along the
+        direction 'i' of the lattice."""
+        x_min, x_max, x_num = self.lattice.min_max_num_list[i]
+        if x_num > 1 and x_min < x_max:
+            return (x - x_min) * ((x_num - 1) / float(x_max - x_min))
+        return numpy.zeros(numpy.shape(x))
+
+    def interpolate(self, points, order="linear", chunk_size=1 << 16):
+        """Interpolate the field at the given points, an array of shape
+        (..., dim), and return an array of shape (..., field_dim). 'order'
+        is "nearest", "linear" (bilinear, trilinear, ... depending on the
+        dimension of the lattice) or "cubic" (Catmull-Rom spline). Points
+        outside the lattice take the value of the closest boundary point.
+        The points are processed in chunks of at most 'chunk_size'."""
+        lattice = self.lattice
+        points = lattice._check_last_axis(points, float)
+        out_shape = points.shape[:-1] + (self.field_dim,)
+        points = points.reshape((-1, lattice.dim))
+        out = numpy.empty((len(points), self.field_dim),
+                          dtype=numpy.result_type(self.field_data, float))
+        nodes = lattice.nodes
+        for start in range(0, len(points), chunk_size):
+            chunk = points[start:start + chunk_size]
+            taps = []
+            for i in range(lattice.dim):
+                u = self._get_fractional_idx(chunk[:, i], i)
+                taps.append(_interpolation_taps(u, nodes[i], order))
+            result = numpy.zeros((len(chunk), self.field_dim),
+                                 dtype=out.dtype)
+            for corner in itertools.product(*taps):
+                idx = tuple(i for i, _ in corner)
+                weight = reduce(lambda x, y: x * y, [w for _, w in corner])
+                if lattice.order == "F":
+                    values = self.field_data[(slice(None),) + idx].T
+                else:
+                    values = self.field_data[idx]
+                result += weight[:, numpy.newaxis] * values
+            out[start:start + len(chunk)] = result
+        return out.reshape(out_shape)
+
+    def resample(self, lattice, order="linear"):
+        """Return a new FieldLattice obtained by interpolating this field
+        (see 'interpolate') at the points of the given lattice (a Lattice
+        object or a specification accepted by Lattice). The interpolation is
+        done one direction at a time, which is much cheaper than
+        interpolating at each point of the new lattice."""
+        if not isinstance(lattice, Lattice):
+            lattice = Lattice(lattice, order=self.lattice.order)
+        if lattice.dim != self.lattice.dim:
+            raise ValueError("Cannot resample a field defined over a %dD "
+                             "lattice onto a %dD lattice."
+                             % (self.lattice.dim, lattice.dim))
+        data = self.field_data
+        first_axis = 1 if self.lattice.order == "F" else 0
+        nodes = self.lattice.nodes
+        for i, x in enumerate(lattice.get_axes()):
+            axis = first_axis + i
+            shape = [1] * data.ndim
+            shape[axis] = -1
+            taps = _interpolation_taps(self._get_fractional_idx(x, i),
+                                       nodes[i], order)
+            new_data = 0.0
+            for idx, weight in taps:
+                new_data = new_data + (numpy.take(data, idx, axis=axis) *
+                                       weight.reshape(shape))
+            data = new_data
+
+        if lattice.order != self.lattice.order:
+            if lattice.order == "F":
+                data = numpy.rollaxis(data, -1)
+            else:
+                data = numpy.rollaxis(data, 0, data.ndim)
+        return FieldLattice(lattice, dim=self.field_dim,
+                            data=numpy.array(data, order=lattice.order))
@@ -7,6 +7,8 @@
 
 import numpy as np
 
+import lattice
+
 __all__ = ["Mesh", "MeshField"]
 
 # A scalar/vector/tensor field on a mesh
@@ -26,13 +28,23 @@ class MeshField(object):
         self.dims = dims
         self.mesh = mesh
 
-    def to_xyz_array(self):
+    # Returns a view of the data with the mesh axes in XYZ order, i.e. with
+    # shape dims + mesh_size. No data is copied: the array order of the mesh
+    # is carried by the strides of the view, which is not contiguous unless
+    # array_order is XYZ
+    def xyz_view(self):
         n = len(self.dims)
-        tmp = np.transpose(self.nonflat,
-                           axes=np.append(
-                               np.arange(n), n + np.argsort(self.mesh.array_order)))
+        axes = np.append(np.arange(n), n + np.argsort(self.mesh.array_order))
+        return np.transpose(self.nonflat, axes=axes)
+
+    # Returns a FieldLattice sharing the data of this (vector) field
+    def to_field_lattice(self):
+        assert len(self.dims) == 1
+        return lattice.FieldLattice(self.mesh.get_lattice_spec(),
+                                    dim=self.dims[0], data=self.xyz_view())
 
-        return np.ascontiguousarray(tmp)
+    def to_xyz_array(self):
+        return np.ascontiguousarray(self.xyz_view())
 
     # Only implemented for vector fields, i.e. len(dims) == 1
     def subfield(self, a, b):
@@ -42,6 +54,75 @@ class MeshField(object):
     def copy(self):
         return MeshField(self.mesh, self.flat.copy(), self.dims)
 
+    # Finite-difference operators. The derivatives are central differences
+    # computed with the neighbour indices cached by the mesh. 'boundary' is
+    # "neumann" (ghost cells equal to the boundary cells, i.e. zero normal
+    # derivative) or "periodic", or a tuple with one of them for each of
+    # the x, y, z directions
+
+    # Returns a field with dims (3,) + self.dims, where the first index is
+    # the direction of the derivative
+    def gradient(self, boundary="neumann"):
+        boundary = _check_boundary(boundary)
+        f = self.flat
+        res = np.zeros((3,) + f.shape, dtype=np.result_type(f, float))
+        for axis in range(3):
+            if self.mesh.mesh_size[axis] == 1:
+                continue
+            nb_p = self.mesh.get_neighbours(axis, 1, boundary[axis])
+            nb_m = self.mesh.get_neighbours(axis, -1, boundary[axis])
+            res[axis] = f[..., nb_p]
+            res[axis] -= f[..., nb_m]
+            res[axis] *= 0.5 / self.mesh.cell_size[axis]
+        return MeshField(self.mesh, res, (3,) + self.dims)
+
+    def laplacian(self, boundary="neumann"):
+        boundary = _check_boundary(boundary)
+        f = self.flat
+        res = np.zeros(f.shape, dtype=np.result_type(f, float))
+        for axis in range(3):
+            if self.mesh.mesh_size[axis] == 1:
+                continue
+            nb_p = self.mesh.get_neighbours(axis, 1, boundary[axis])
+            nb_m = self.mesh.get_neighbours(axis, -1, boundary[axis])
+            d2 = f[..., nb_p] + f[..., nb_m]
+            d2 -= 2 * f
+            d2 *= 1.0 / self.mesh.cell_size[axis] ** 2
+            res += d2
+        return MeshField(self.mesh, res, self.dims)
+
+    # Only implemented for vector fields with 3 components. Returns a field
+    # with dims (1,)
+    def divergence(self, boundary="neumann"):
+        assert self.dims == (3,)
+        boundary = _check_boundary(boundary)
+        f = self.flat
+        res = np.zeros((1, f.shape[-1]), dtype=np.result_type(f, float))
+        for axis in range(3):
+            if self.mesh.mesh_size[axis] == 1:
+                continue
+            nb_p = self.mesh.get_neighbours(axis, 1, boundary[axis])
+            nb_m = self.mesh.get_neighbours(axis, -1, boundary[axis])
+            res[0] += (f[axis, nb_p] - f[axis, nb_m]) * \
+                (0.5 / self.mesh.cell_size[axis])
+        return MeshField(self.mesh, res, (1,))
+
+
+BOUNDARY_CONDITIONS = ("neumann", "periodic")
+
+
+def _check_boundary(boundary):
+    if isinstance(boundary, (tuple, list)):
+        boundary = tuple(boundary)
+    else:
+        boundary = (boundary,) * 3
+    if len(boundary) != 3 or any(b not in BOUNDARY_CONDITIONS
+                                 for b in boundary):
+        raise ValueError("Invalid boundary conditions %s: expected one of %s "
+                         "or a tuple of three of them."
+                         % (boundary, BOUNDARY_CONDITIONS))
+    return boundary
+
 # A 3D rectangular mesh
 
 
@@ -65,6 +146,8 @@ class Mesh(object):
         self.n = np.prod(self.mesh_size)
         self.mesh_size_ao = self.mesh_size[list(array_order)]
         self.cell_size_ao = self.cell_size[list(array_order)]
+        # Neighbour indices and boundary masks, built on first use
+        self._stencil_cache = {}
 
         # Check validity
         assert self.mesh_size.shape == (3,)
@@ -101,9 +184,17 @@ class Mesh(object):
             return False
 
     # Returns an array of the form [(x_min, x_max, x_num), (y_min, y_max,
-    # y_num), (z_min, z_max, z_num)]
+    # y_num), (z_min, z_max, z_num)] with the positions of the first and last
+    # cell centres. Following the convention of lattice.Lattice, for a
+    # single cell x_max - x_min is the cell size
     def get_lattice_spec(self):
-        return [(self.origin[i] + self.cell_size[i] * 0.5, self.origin[i] + self.cell_size[i] * 0.5 + self.cell_size[i] * self.mesh_size[i], self.mesh_size[i]) for i in range(3)]
+        spec = []
+        for i in range(3):
+            x_min = self.origin[i] + self.cell_size[i] * 0.5
+            num = self.mesh_size[i]
+            x_max = x_min + self.cell_size[i] * max(1, num - 1)
+            spec.append((x_min, x_max, num))
+        return spec
 
     def field_from_xyz_array(self, arr):
         assert arr.ndim == 4
@@ -114,6 +205,16 @@ class Mesh(object):
             np.transpose(res, axes=np.append([0], 1 + np.array(self.array_order))))
         return MeshField(self, res, arr.shape[:1])
 
+    # Returns a MeshField with the data of the given FieldLattice, which
+    # must be defined over the lattice of this mesh. Like
+    # field_from_xyz_array, the data is copied only if it does not already
+    # have the memory layout of the mesh (e.g. for a FieldLattice returned
+    # by MeshField.to_field_lattice)
+    def field_from_field_lattice(self, fl):
+        assert tuple(fl.lattice.nodes) == tuple(self.mesh_size)
+        assert fl.lattice.order == "F"
+        return self.field_from_xyz_array(fl.field_data)
+
     def new_field(self, dims):
         if type(dims) == int:
             dims = [dims]
@@ -128,20 +229,115 @@ class Mesh(object):
         a.shape = (dims, -1)
         return MeshField(self, a, [dims])
 
+    # Returns the coordinates of the cell centres (or, if integer=True, the
+    # integer coordinates of the cells) as an array of shape
+    # (3,) + mesh_size for layout="xyz", or of shape (3,) + mesh_size_ao for
+    # layout="ao", which is the layout of the data of a MeshField
+    def get_coords(self, layout="xyz", integer=False):
+        if layout == "xyz":
+            axis_pos = [0, 1, 2]
+            shape = tuple(self.mesh_size)
+        elif layout == "ao":
+            axis_pos = [list(self.array_order).index(d) for d in range(3)]
+            shape = tuple(self.mesh_size_ao)
+        else:
+            raise ValueError("Invalid layout '%s': expected 'xyz' or 'ao'."
+                             % layout)
+        res = np.empty((3,) + shape, dtype=int if integer else float)
+        for d in range(3):
+            axis_shape = [1] * 3
+            axis_shape[axis_pos[d]] = -1
+            res[d] = self._get_axis(d, integer).reshape(axis_shape)
+        return res
+
+    def get_coords_int(self, layout="xyz"):
+        return self.get_coords(layout, integer=True)
+
+    def _get_axis(self, d, integer=False):
+        i = np.arange(self.mesh_size[d])
+        if integer:
+            return i
+        return self.origin[d] + (0.5 + i) * self.cell_size[d]
+
+    # Iterates over the cells in the order of the data of a MeshField, in
+    # chunks of at most chunk_size cells. For each chunk yields
+    # (start, stop, coords), where start and stop delimit the range of flat
+    # indices and coords has shape (3, stop - start)
+    def iter_coords_chunks(self, chunk_size=1 << 16, integer=False):
+        for start in range(0, self.n, chunk_size):
+            stop = min(self.n, start + chunk_size)
+            idx = np.unravel_index(np.arange(start, stop), self.mesh_size_ao)
+            coords = np.empty((3, stop - start), dtype=int if integer
+                              else float)
+            for j, d in enumerate(self.array_order):
+                if integer:
+                    coords[d] = idx[j]
+                else:
+                    coords[d] = (self.origin[d] +
+                                 (0.5 + idx[j]) * self.cell_size[d])
+            yield start, stop, coords
+
     def iter_coords_int(self):
-        l, m, n = self.array_order
-        for i in range(self.mesh_size[l]):
-            for j in range(self.mesh_size[m]):
-                for k in range(self.mesh_size[n]):
-                    r = [-1] * 3
-                    r[l] = i
-                    r[m] = j
-                    r[n] = k
-                    yield tuple(r)
+        for _, _, coords in self.iter_coords_chunks(integer=True):
+            for r in coords.T.tolist():
+                yield tuple(r)
 
     def iter_coords(self):
-        for i in self.iter_coords_int():
-            yield([self.origin[d] + (0.5 + i[d]) * self.cell_size[d] for d in range(3)])
+        for _, _, coords in self.iter_coords_chunks():
+            for r in coords.T.tolist():
+                yield r
+
+    # Returns the array of the flat indices of the neighbours of each cell
+    # at distance 'step' along the direction 'axis' (0, 1, 2 for x, y, z).
+    # With "neumann" boundary conditions, the neighbours outside the mesh
+    # are replaced by the closest cells inside it, with "periodic" the mesh
+    # is wrapped around. The result is cached and read-only
+    def get_neighbours(self, axis, step=1, boundary="neumann"):
+        key = ("neighbours", axis, step, boundary)
+        nb = self._stencil_cache.get(key)
+        if nb is None:
+            idx = np.arange(self.n).reshape(self.mesh_size_ao)
+            a = list(self.array_order).index(axis)
+            num = self.mesh_size[axis]
+            if boundary == "periodic":
+                nb = np.take(idx, (np.arange(num) + step) % num, axis=a)
+            elif boundary == "neumann":
+                nb = np.take(idx, np.clip(np.arange(num) + step, 0, num - 1),
+                             axis=a)
+            else:
+                raise ValueError("Invalid boundary condition '%s'."
+                                 % boundary)
+            nb = nb.ravel()
+            nb.flags.writeable = False
+            self._stencil_cache[key] = nb
+        return nb
+
+    # Returns a boolean array, in flat layout, which is True for the cells
+    # on the lower (side=-1) or upper (side=1) face of the mesh normal to
+    # 'axis', or on both (side=0). With axis=None all the faces are
+    # considered. The result is cached and read-only
+    def get_boundary_mask(self, axis=None, side=0):
+        key = ("boundary", axis, side)
+        mask = self._stencil_cache.get(key)
+        if mask is None:
+            if axis is None:
+                mask = np.zeros(self.n, dtype=bool)
+                for a in range(3):
+                    mask |= self.get_boundary_mask(a, side)
+            else:
+                num = self.mesh_size[axis]
+                on_face = np.zeros(num, dtype=bool)
+                if side <= 0:
+                    on_face[0] = True
+                if side >= 0:
+                    on_face[-1] = True
+                shape = [1] * 3
+                shape[list(self.array_order).index(axis)] = num
+                mask = np.broadcast_to(on_face.reshape(shape),
+                                       self.mesh_size_ao).ravel()
+            mask.flags.writeable = False
+            self._stencil_cache[key] = mask
+        return mask
 
     endpoint = property(
         lambda self: self.origin + self.cell_size * self.mesh_size)
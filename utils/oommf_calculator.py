@@ -8,22 +8,108 @@
 import os
 import re
 import hashlib
+import multiprocessing
 import tempfile
 import numpy as np
-import cStringIO
 import sys
+import shlex
 import subprocess
 import shutil
-from contextlib import contextmanager
+import threading
 from subprocess import check_output, CalledProcessError
 
 import ovf
-import lattice
 from mesh import MeshField, Mesh
+from resultcache import ResultCache, MemoCache, hash_array
+from scheduler import Future, Scheduler
+from oommfpool import WorkerPool, WORKER_SCRIPT, oxs_worker_command
 
 CACHE_DIR = os.environ['HOME'] + "/.oommf_calculator"
 RUN_DIR = tempfile.mkdtemp(suffix='_oommf_calculator')
 
+# Maximum size of the cached results, in bytes (1 GiB by default). The
+# least recently used results are removed when it is exceeded
+if 'OOMMF_CALCULATOR_CACHE_BYTES' in os.environ:
+    CACHE_MAX_BYTES = int(os.environ['OOMMF_CALCULATOR_CACHE_BYTES'])
+else:
+    CACHE_MAX_BYTES = 1 << 30
+
+CACHE = ResultCache(os.path.join(CACHE_DIR, "results"),
+                    max_bytes=CACHE_MAX_BYTES)
+
+
+def remove_old_results(dry_run=False):
+    """Remove the results saved by earlier versions of this module, which
+    kept each result in a directory of CACHE_DIR named after its key
+    (<name>_<md5 checksum>), with index.json and index.lock next to them.
+    Their keys are computed differently now, so they are never used again,
+    nor counted in CACHE_MAX_BYTES.
+
+    Nothing is removed automatically: call this function once, when no
+    process of an earlier version is using CACHE_DIR any more. With
+    dry_run=True, nothing is removed either. Return the paths removed (or
+    to be removed)."""
+    if not os.path.isdir(CACHE_DIR):
+        return []
+    removed = []
+    for fn in sorted(os.listdir(CACHE_DIR)):
+        path = os.path.join(CACHE_DIR, fn)
+        if re.match(r"^.+_[0-9a-f]{32}(\..*)?$", fn) and os.path.isdir(path):
+            if not dry_run:
+                shutil.rmtree(path, ignore_errors=True)
+        elif fn in ("index.json", "index.lock") and os.path.isfile(path):
+            if not dry_run:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        else:
+            continue
+        removed.append(path)
+    return removed
+
+
+# The most recently used results are also kept in memory, at most
+# MEMO_MAX_ENTRIES results and MEMO_MAX_BYTES bytes (256 MiB by default), so
+# that repeating a calculation in the same process reads nothing from disk.
+# The fields returned for these results are read-only and share memory
+MEMO_MAX_ENTRIES = int(os.environ.get('OOMMF_CALCULATOR_MEMO_ENTRIES', 64))
+MEMO_MAX_BYTES = int(os.environ.get('OOMMF_CALCULATOR_MEMO_BYTES', 1 << 28))
+
+MEMO = MemoCache(max_entries=MEMO_MAX_ENTRIES, max_bytes=MEMO_MAX_BYTES)
+
+# Set OOMMF_CALCULATOR_FAST_HASH=1 to hash the input states with checksums
+# (CRC-32 and Adler-32, see resultcache.hash_array) rather than md5, which is
+# faster but not collision resistant
+FAST_HASH = os.environ.get('OOMMF_CALCULATOR_FAST_HASH', '0') not in ('', '0')
+
+# Version of the calculation, which is part of the cache key. Increase it
+# when a change to this module changes the results, so that the results
+# cached by older versions are no longer used
+CACHE_VERSION = 3
+
+# Number of OOMMF processes run at the same time by submit_oommf_fields and
+# calculate_oommf_fields_batch, and number of threads of each process. By
+# default the threads of all the processes use all the processors. See
+# set_parallelism
+PROCESSES = int(os.environ.get('OOMMF_CALCULATOR_PROCESSES', 1))
+THREADS = int(os.environ.get('OOMMF_CALCULATOR_THREADS',
+                             max(1, multiprocessing.cpu_count() // PROCESSES)))
+
+SCHEDULER = Scheduler(PROCESSES)
+
+# Set OOMMF_CALCULATOR_WORKERS=1 to run the calculations with long-lived
+# OOMMF processes (see oommfpool.py), which load OOMMF once rather than for
+# every calculation, each replaced after OOMMF_CALCULATOR_WORKER_JOBS
+# calculations. OOMMF_WORKER_COMMAND is the command of the Oxs shell, which
+# runs oommfworker.tcl; by default it is the one OOMMF uses for boxsi. See
+# use_workers
+WORKERS = os.environ.get('OOMMF_CALCULATOR_WORKERS', '0') not in ('', '0')
+WORKER_MAX_JOBS = int(os.environ.get('OOMMF_CALCULATOR_WORKER_JOBS', 100))
+
+POOL = None
+POOL_LOCK = threading.Lock()
+
 if 'OOMMF_COMMAND' in os.environ:
     OOMMF_COMMAND = os.environ['OOMMF_COMMAND']
 else:
@@ -56,25 +142,6 @@ Destination archive mmArchive:oommf_calculator
 %(fields)s
 """
 
-SOURCE = open(os.path.abspath(__file__)).read()
-
-
-@contextmanager
-def ignored(*exceptions):
-    """
-    Ignore the given exceptions within the scope of the context.
-
-    Example::
-
-       with ignored(OSError):
-           os.remove('non_existing_file.txt')
-
-    """
-    try:
-        yield
-    except exceptions:
-        pass
-
 
 def run_oommf(dir, args, **kwargs):
     try:
@@ -90,32 +157,38 @@ def run_oommf(dir, args, **kwargs):
             "Command '{0}' failed. Parameters: '{1}'."
             .format(cmd[0], " ".join(cmd[1:])))
 
-# Runs an OOMMF mif file contained in str
-# Returns a hashtable of field names mapped to arrays compatible with the
-# given mesh
-
-
-def calculate_oommf_fields(name, s0, Ms, spec=None, alpha=0., gamma_G=0.,
-                           fields=[]):
-    assert type(Ms) is float
-    assert type(s0) is MeshField and s0.dims == (3,)
-
-    # Calculate the checksum corresponding to the parameters
+def _parameters_hash(name, Ms, spec, alpha, gamma_G, fields):
+    # Returns the md5 object with the parameters of the calculation, except
+    # the magnetisation
     m = hashlib.new('md5')
     delim = "\n---\n"
-    m.update(SOURCE + delim)
+    m.update("%d%s" % (CACHE_VERSION, delim))
     m.update(name + delim)
     m.update("%25.19e%s" % (Ms, delim))
     m.update("%25.19e%s" % (alpha, delim))
     m.update("%25.19e%s" % (gamma_G, delim))
     m.update("%s%s" % (",".join(fields), delim))
     m.update(spec + delim)
-    s = cStringIO.StringIO()
-    np.save(s, s0.flat)
-    m.update(s.getvalue())
-    checksum = m.hexdigest()
-
-    # Format the simulation script
+    return m
+
+
+def _checksum(parameters_hash, s0):
+    # The mesh and the data of s0 are hashed explicitly, without serialising
+    # the data (see hash_array)
+    m = parameters_hash.copy()
+    mesh = s0.mesh
+    m.update("%s|%s|%s|%s|%s\n" % (
+        ",".join("%d" % n for n in mesh.mesh_size),
+        ",".join("%.17g" % h for h in mesh.cell_size),
+        ",".join("%.17g" % x for x in mesh.origin),
+        ",".join("%d" % i for i in mesh.array_order),
+        ",".join("%d" % d for d in s0.dims)))
+    hash_array(m, s0.flat, fast=FAST_HASH)
+    return m.hexdigest()
+
+
+def _run_calculation(name, checksum, s0, Ms, spec, alpha, gamma_G, fields):
+    # Runs OOMMF and returns the directory with the results
     basename = "%s_%s" % (name, checksum)
     tag = basename.lower()
     params = {
@@ -132,47 +205,213 @@ def calculate_oommf_fields(name, s0, Ms, spec=None, alpha=0., gamma_G=0.,
 
     # print mif
 
-    # Check if the result is already known
-    cachedir = os.path.join(CACHE_DIR, basename)
-    with ignored(OSError):
-        os.makedirs(CACHE_DIR)
-
-    if not os.path.exists(cachedir):
-        # Run the simulation
-        print "Running OOMMF simulation %s..." % basename,
-        sys.stdout.flush()
-        dir = os.path.join(RUN_DIR, basename)
-        with ignored(OSError):
-            os.makedirs(dir)
-        # Write the MIF file
-        mif_file_name = basename + ".mif"
-        mif_file = open(os.path.join(dir, mif_file_name), "w")
-        mif_file.write(mif)
-        mif_file.close()
-        # Write the starting OMF file
-        fl = lattice.FieldLattice(s0.mesh.get_lattice_spec())
-        fl.field_data = s0.flat
-
-        # Save it to file
-        m0_file = ovf.OVFFile()
-        m0_file.new(fl, version=ovf.OVF10, data_type="binary8")
-        m0_file.write(os.path.join(dir, basename + "-start.omf"))
-        # Run the OOMMF simulation
-        run_oommf(dir, ["boxsi", "-threads", "4", mif_file_name])
-        # Move the results to the cache directory
-        shutil.move(dir, cachedir)
-        print "success"
-
-    # Read the results
+    # Run the simulation
+    # Whole lines, as several simulations may run at the same time
+    print "Running OOMMF simulation %s..." % basename
+    sys.stdout.flush()
+    # A directory of its own, even if the same problem is being run
+    dir = tempfile.mkdtemp(prefix=basename + "_", dir=RUN_DIR)
+    # Write the MIF file
+    mif_file_name = basename + ".mif"
+    mif_file = open(os.path.join(dir, mif_file_name), "w")
+    mif_file.write(mif)
+    mif_file.close()
+    # Write the starting OMF file
+    fl = s0.to_field_lattice()
+
+    # Save it to file
+    m0_file = ovf.OVFFile()
+    m0_file.new(fl, version=ovf.OVF10, data_type="binary8")
+    m0_file.write(os.path.join(dir, basename + "-start.omf"))
+    # Run the OOMMF simulation
+    if WORKERS:
+        # The outputs are saved with the names boxsi would give them
+        outputs = [(f, os.path.join(dir, "%s-%s-00-0000000.ovf"
+                                    % (basename, f.replace("::", "-"))))
+                   for f in fields]
+        _get_pool().run(os.path.join(dir, mif_file_name), outputs,
+                        threads=THREADS)
+    else:
+        run_oommf(dir, ["boxsi", "-threads", str(THREADS), mif_file_name])
+    print "OOMMF simulation %s: success" % basename
+    return dir
+
+
+def _get_pool():
+    # Returns the pool of OOMMF workers, started when first needed
+    global POOL
+    with POOL_LOCK:
+        if POOL is None:
+            if 'OOMMF_WORKER_COMMAND' in os.environ:
+                command = shlex.split(os.environ['OOMMF_WORKER_COMMAND'])
+                command.append(WORKER_SCRIPT)
+            else:
+                command = oxs_worker_command(OOMMF_COMMAND)
+            POOL = WorkerPool(command, size=PROCESSES,
+                              max_jobs=WORKER_MAX_JOBS)
+        return POOL
+
+
+# Runs the calculations with long-lived OOMMF processes (enabled=True) or
+# with a new OOMMF process for each of them (enabled=False). Each long-lived
+# process is replaced after max_jobs calculations (by default
+# WORKER_MAX_JOBS). Calculations in progress are not affected
+def use_workers(enabled=True, max_jobs=None):
+    global WORKERS, WORKER_MAX_JOBS, POOL
+    WORKERS = enabled
+    if max_jobs is not None:
+        WORKER_MAX_JOBS = max_jobs
+    with POOL_LOCK:
+        pool, POOL = POOL, None
+    if pool is not None:
+        pool.close()
+
+
+def _read_results(dir, name, checksum, mesh):
     fields = {}
-    for fn in os.listdir(cachedir):
+    for fn in os.listdir(dir):
         m = re.match("^(.*)_%s-(.*)-00-0000000.o[hvm]f$" % checksum, fn)
         if m and m.group(1) == name:
-            fl = ovf.OVFFile(os.path.join(cachedir, fn)).get_field()
-            fields[m.group(2)] = s0.mesh.field_from_xyz_array(fl.field_data)
-
+            fl = ovf.OVFFile(os.path.join(dir, fn)).get_field()
+            fields[m.group(2)] = mesh.field_from_field_lattice(fl)
     return fields
 
+
+def _calculate(name, checksum, s0, Ms, spec, alpha, gamma_G, fields):
+    # Returns the fields from the memory or the disk cache or, if not there,
+    # runs OOMMF and saves them in both caches
+    key = "%s_%s" % (name, checksum)
+    arrays = MEMO.get(key)
+    if arrays is None:
+        arrays = CACHE.get(key)
+        if arrays is not None:
+            # Load the arrays in memory, rather than keeping the files open
+            arrays = MEMO.put(key, dict((field_name, np.array(a))
+                                        for field_name, a in arrays.items()))
+    if arrays is None:
+        dir = _run_calculation(name, checksum, s0, Ms, spec, alpha, gamma_G,
+                               fields)
+        results = _read_results(dir, name, checksum, s0.mesh)
+        arrays = dict((field_name, f.flat)
+                      for field_name, f in results.items())
+        CACHE.put(key, arrays)
+        arrays = MEMO.put(key, arrays)
+        shutil.rmtree(dir, ignore_errors=True)
+    return dict((field_name, s0.mesh.field_from_array(a))
+                for field_name, a in arrays.items())
+
+
+# Sets the number of OOMMF processes run at the same time and the number of
+# threads of each process (by default, so that all the processors are used).
+# The calculations in progress are completed with the previous number of
+# threads, and are still not repeated if submitted again
+def set_parallelism(processes, threads=None):
+    global PROCESSES, THREADS
+    if processes < 1:
+        raise ValueError("The number of processes must be at least 1.")
+    if threads is None:
+        threads = max(1, multiprocessing.cpu_count() // processes)
+    elif threads < 1:
+        raise ValueError("The number of threads must be at least 1.")
+    PROCESSES, THREADS = processes, threads
+    SCHEDULER.resize(processes)
+    with POOL_LOCK:
+        if POOL is not None:
+            POOL.resize(processes)
+
+
+def _submit(name, checksum, s0, Ms, spec, alpha, gamma_G, fields):
+    # Returns the Future of the calculation: completed if the result is in
+    # memory, or the Future of the identical calculation in progress, if any
+    key = "%s_%s" % (name, checksum)
+    arrays = MEMO.get(key)
+    if arrays is not None:
+        future = Future()
+        future.set_result(dict((field_name, s0.mesh.field_from_array(a))
+                               for field_name, a in arrays.items()))
+        return future
+    return SCHEDULER.submit(key, _calculate, name, checksum, s0, Ms, spec,
+                            alpha, gamma_G, fields)
+
+
+# Runs an OOMMF mif file contained in str
+# Returns a hashtable of field names mapped to arrays compatible with the
+# given mesh
+
+
+def calculate_oommf_fields(name, s0, Ms, spec=None, alpha=0., gamma_G=0.,
+                           fields=[]):
+    assert type(Ms) is float
+    assert type(s0) is MeshField and s0.dims == (3,)
+
+    # Calculate the checksum corresponding to the parameters
+    checksum = _checksum(
+        _parameters_hash(name, Ms, spec, alpha, gamma_G, fields), s0)
+    # Run as a job of the scheduler, so that identical calculations in
+    # progress (in other threads or submitted) are not repeated
+    return _submit(name, checksum, s0, Ms, spec, alpha, gamma_G,
+                   fields).result()
+
+
+# Asynchronous version of calculate_oommf_fields: returns a Future (see
+# scheduler.py) whose result() is the dictionary of the fields. Up to
+# PROCESSES calculations run at the same time, and submitting a calculation
+# identical to one in progress returns the Future of the latter. s0 is
+# copied, so it can be modified after submitting.
+def submit_oommf_fields(name, s0, Ms, spec=None, alpha=0., gamma_G=0.,
+                        fields=[]):
+    assert type(Ms) is float
+    assert type(s0) is MeshField and s0.dims == (3,)
+
+    checksum = _checksum(
+        _parameters_hash(name, Ms, spec, alpha, gamma_G, fields), s0)
+    return _submit(name, checksum, s0.copy(), Ms, spec, alpha, gamma_G,
+                   list(fields))
+
+
+def _same_mesh(a, b):
+    return (a is b or
+            (np.array_equal(a.mesh_size, b.mesh_size) and
+             np.array_equal(a.cell_size, b.cell_size) and
+             np.array_equal(a.origin, b.origin) and
+             tuple(a.array_order) == tuple(b.array_order)))
+
+
+# Batched version of calculate_oommf_fields: computes the fields for each of
+# the magnetisations in the list 'states', which must be defined over the
+# same mesh, with the same parameters. Returns a list with the dictionary of
+# the fields for each state.
+#
+# The parameters are hashed once and each distinct state is calculated only
+# once (the dictionaries of identical states share the same MeshField
+# objects), so that OOMMF runs only for the states which are neither
+# duplicated nor in the cache. Note that each of those still needs its own
+# OOMMF run: Oxs_TimeDriver only loads the magnetisation m0 at the start of
+# a problem, so different states cannot be given to different stages of a
+# single run. These runs are submitted together, so that up to PROCESSES of
+# them run at the same time.
+def calculate_oommf_fields_batch(name, states, Ms, spec=None, alpha=0.,
+                                 gamma_G=0., fields=[]):
+    assert type(Ms) is float
+    states = list(states)
+    for s0 in states:
+        assert type(s0) is MeshField and s0.dims == (3,)
+        assert _same_mesh(s0.mesh, states[0].mesh)
+
+    parameters_hash = _parameters_hash(name, Ms, spec, alpha, gamma_G,
+                                       fields)
+    futures = {}
+    checksums = []
+    for s0 in states:
+        checksum = _checksum(parameters_hash, s0)
+        checksums.append(checksum)
+        if checksum not in futures:
+            futures[checksum] = _submit(name, checksum, s0, Ms, spec, alpha,
+                                        gamma_G, fields)
+    results = dict((checksum, future.result())
+                   for checksum, future in futures.items())
+    return [dict(results[checksum]) for checksum in checksums]
+
 if __name__ == "__main__":
     spec = """set pi [expr 4*atan(1.0)]
 set mu0 [expr 4*$pi*1e-7]
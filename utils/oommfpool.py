@@ -0,0 +1,313 @@
+# oommf-python
+# Copyright (C) 2016 University of Southampton
+#
+# CONTACT: h.fangohr@soton.ac.uk
+
+'''
+This module provides WorkerPool, a pool of long-lived OOMMF processes which
+run one problem after the other, so that starting Tcl, loading Oxs and its
+extensions is done once per process rather than once per problem (as with
+"oommf boxsi problem.mif"). Example:
+
+  pool = WorkerPool(oxs_worker_command(), size=4)
+  pool.run("/tmp/run/a.mif", [("Oxs_TimeDriver::Spin", "/tmp/run/a.omf")])
+  pool.close()
+
+Each worker is the Oxs shell running oommfworker.tcl, which loads the
+problems sent on its standard input with Oxs_ProbInit, runs them with
+Oxs_Run and saves the requested outputs (see oommfworker.tcl for the
+protocol). An idle worker is checked to be alive and to answer a ping before
+it is given a problem, otherwise it is replaced. Workers are also replaced
+after 'max_jobs' problems, which bounds the effect of any leak in OOMMF.
+
+For tests, "python fakeoommf.py worker" stands in for the Oxs shell.
+'''
+
+from __future__ import unicode_literals
+import collections
+import os
+import re
+import subprocess
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+__all__ = ["OOMMFWorkerError", "WorkerPool", "WORKER_SCRIPT",
+           "oxs_worker_command"]
+
+# The Tcl script run by the workers
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "oommfworker.tcl")
+
+# Prefix of the replies of the workers, which tells them apart from any
+# other output of OOMMF
+REPLY_PREFIX = "oommfworker: "
+
+
+class OOMMFWorkerError(Exception):
+    pass
+
+
+def oxs_worker_command(oommf_command="oommf"):
+    """Return the command running the worker script with the Oxs shell, as
+    a list of arguments. It is the command which runs boxsi (printed by
+    "oommf +command boxsi"), with boxsi.tcl replaced by WORKER_SCRIPT."""
+    try:
+        output = subprocess.check_output([oommf_command, "+command", "boxsi"],
+                                         stderr=subprocess.STDOUT,
+                                         universal_newlines=True)
+    except (OSError, subprocess.CalledProcessError) as ex:
+        raise OOMMFWorkerError("Cannot find how OOMMF runs boxsi: %s" % ex)
+    for line in output.splitlines():
+        # Arguments with spaces are quoted, as for a shell
+        args = [a.strip("\"'") for a in
+                re.findall(r"\"[^\"]*\"|'[^']*'|\S+", line)]
+        for i, arg in enumerate(args):
+            if os.path.basename(arg) == "boxsi.tcl":
+                return args[:i] + [WORKER_SCRIPT]
+    raise OOMMFWorkerError("Cannot find boxsi.tcl in the command running "
+                           "boxsi: %s" % output.strip())
+
+
+def _tcl_list(words):
+    # Formats the words as a Tcl list, escaping the special characters
+    out = []
+    for word in words:
+        word = "%s" % word
+        if "\n" in word or "\r" in word:
+            raise ValueError("Newlines cannot be sent to a worker: %r"
+                             % word)
+        out.append(re.sub(r"([\\{}\[\]$\";\s])", r"\\\1", word) or "{}")
+    return " ".join(out)
+
+
+class _Worker(object):
+
+    def __init__(self, command, timeout):
+        try:
+            self.process = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                            stdout=subprocess.PIPE,
+                                            stderr=subprocess.STDOUT,
+                                            universal_newlines=True)
+        except OSError as ex:
+            raise OOMMFWorkerError("Cannot start the OOMMF worker '%s': %s"
+                                   % (" ".join(command), ex))
+        self.jobs = 0
+        # Set when the worker cannot be used any more (it exited, did not
+        # answer in time or its pipe is broken)
+        self.broken = False
+        # The replies, read by a thread of their own so that they can be
+        # waited for with a timeout, and the last lines of other output
+        self._replies = queue.Queue()
+        self._output = collections.deque(maxlen=20)
+        reader = threading.Thread(target=self._read)
+        reader.daemon = True
+        reader.start()
+        try:
+            self._expect("ready", timeout)
+        except OOMMFWorkerError:
+            self.kill()
+            raise
+
+    def _read(self):
+        for line in iter(self.process.stdout.readline, ""):
+            line = line.rstrip("\n")
+            if line.startswith(REPLY_PREFIX):
+                self._replies.put(line[len(REPLY_PREFIX):])
+            else:
+                self._output.append(line)
+        self._replies.put(None)
+
+    def _expect(self, expected, timeout):
+        # Waits for the next reply and raises OOMMFWorkerError unless it is
+        # the expected one
+        try:
+            reply = self._replies.get(timeout=timeout)
+        except queue.Empty:
+            self.broken = True
+            raise OOMMFWorkerError("The OOMMF worker did not answer in %s s."
+                                   % timeout)
+        if reply is None:
+            self.broken = True
+            self.process.wait()
+            raise OOMMFWorkerError(
+                "The OOMMF worker exited (return code %s). Output:\n%s"
+                % (self.process.returncode, "\n".join(self._output)))
+        if reply.startswith("error "):
+            raise OOMMFWorkerError("OOMMF failed: %s" % reply[6:])
+        if reply != expected:
+            self.broken = True
+            raise OOMMFWorkerError("Unexpected reply from the OOMMF worker: "
+                                   "%s" % reply)
+
+    def _send(self, words):
+        try:
+            self.process.stdin.write(_tcl_list(words) + "\n")
+            self.process.stdin.flush()
+        except (IOError, OSError, ValueError) as ex:
+            self.broken = True
+            raise OOMMFWorkerError("Lost contact with the OOMMF worker: %s"
+                                   % ex)
+
+    def is_healthy(self, timeout):
+        if self.broken or self.process.poll() is not None:
+            return False
+        try:
+            self._send(["ping"])
+            self._expect("pong", timeout)
+        except OOMMFWorkerError:
+            return False
+        return True
+
+    def run(self, mif_filename, outputs, threads, timeout):
+        self.jobs += 1
+        words = ["run", mif_filename, threads]
+        for output, filename in outputs:
+            words.extend([output, filename])
+        self._send(words)
+        self._expect("done", timeout)
+
+    def close(self):
+        try:
+            self._send(["exit"])
+            self.process.stdin.close()
+        except (OOMMFWorkerError, IOError, OSError):
+            pass
+        self.process.wait()
+
+    def kill(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        try:
+            self.process.stdin.close()
+        except (IOError, OSError):
+            pass
+
+
+class WorkerPool(object):
+
+    """Pool of at most 'size' OOMMF workers started with 'command' (a list
+    of arguments, see oxs_worker_command), each of which runs one problem at
+    a time. The workers are started when needed and replaced after
+    'max_jobs' problems (never if None). A worker which does not start
+    within 'start_timeout' seconds or does not answer a health check within
+    'health_timeout' seconds is replaced. The pool can be used from several
+    threads."""
+
+    def __init__(self, command, size=1, max_jobs=100, start_timeout=120.,
+                 health_timeout=10.):
+        if size < 1:
+            raise ValueError("size must be at least 1.")
+        self.command = list(command)
+        self.size = size
+        self.max_jobs = max_jobs
+        self.start_timeout = start_timeout
+        self.health_timeout = health_timeout
+        self.stats = {"started": 0, "recycled": 0, "replaced": 0}
+        self._condition = threading.Condition()
+        self._idle = []
+        self._num_workers = 0
+        self._closed = False
+
+    def _acquire(self):
+        with self._condition:
+            while (not self._closed and len(self._idle) == 0 and
+                   self._num_workers >= self.size):
+                self._condition.wait()
+            if self._closed:
+                raise RuntimeError("The worker pool is closed.")
+            if len(self._idle) > 0:
+                worker = self._idle.pop()
+            else:
+                worker = None
+                self._num_workers += 1
+        try:
+            if (worker is not None and
+                    not worker.is_healthy(self.health_timeout)):
+                worker.kill()
+                worker = None
+                self._count("replaced")
+            if worker is None:
+                worker = _Worker(self.command, self.start_timeout)
+                self._count("started")
+        except Exception:
+            self._release(None)
+            raise
+        return worker
+
+    def _release(self, worker):
+        # Puts the worker back in the pool or, if None, forgets it
+        retire = None
+        with self._condition:
+            if worker is not None and not self._closed and \
+                    self._num_workers <= self.size and \
+                    (self.max_jobs is None or worker.jobs < self.max_jobs):
+                self._idle.append(worker)
+            else:
+                self._num_workers -= 1
+                retire = worker
+            self._condition.notify()
+        if retire is not None:
+            if self.max_jobs is not None and retire.jobs >= self.max_jobs:
+                self._count("recycled")
+            retire.close()
+
+    def _count(self, stat):
+        with self._condition:
+            self.stats[stat] += 1
+
+    def run(self, mif_filename, outputs, threads=1, timeout=None):
+        """Run the problem in the given MIF file with the given number of
+        threads and save the outputs, given as a list of (output, filename),
+        e.g. ("Oxs_TimeDriver::Spin", "m.omf"). Wait at most 'timeout'
+        seconds (no limit if None) and raise OOMMFWorkerError if the problem
+        fails. A worker which dies or times out is discarded."""
+        mif_filename = os.path.abspath(mif_filename)
+        outputs = [(output, os.path.abspath(filename))
+                   for output, filename in outputs]
+        worker = self._acquire()
+        try:
+            worker.run(mif_filename, outputs, threads, timeout)
+        except OOMMFWorkerError:
+            # A problem which failed leaves the worker usable
+            if worker.broken:
+                worker.kill()
+                worker = None
+            raise
+        except BaseException:
+            # The reply may still come: the worker cannot be trusted
+            worker.kill()
+            worker = None
+            raise
+        finally:
+            self._release(worker)
+
+    def resize(self, size):
+        """Change the maximum number of workers. Workers in excess are
+        closed when they complete their problem."""
+        if size < 1:
+            raise ValueError("size must be at least 1.")
+        with self._condition:
+            self.size = size
+            excess = []
+            while self._idle and self._num_workers > size:
+                excess.append(self._idle.pop())
+                self._num_workers -= 1
+            self._condition.notify_all()
+        for worker in excess:
+            worker.close()
+
+    def close(self):
+        """Close the idle workers, and the others when they complete their
+        problem. No problem can be run afterwards."""
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._num_workers -= len(idle)
+            self._condition.notify_all()
+        for worker in idle:
+            worker.close()
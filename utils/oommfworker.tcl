@@ -0,0 +1,93 @@
+# oommf-python
+# Copyright (C) 2016 University of Southampton
+#
+# CONTACT: h.fangohr@soton.ac.uk
+#
+# A long-lived OOMMF worker for oommfpool.py. It is run by the Oxs shell in
+# place of boxsi.tcl (see oommfpool.oxs_worker_command), so that Tcl, Oxs
+# and its extensions are loaded once, and then runs the problems it is sent
+# on its standard input, one request (a Tcl list) per line:
+#
+#   run MIF THREADS OUTPUT FILE ...   ->  oommfworker: done
+#                                         oommfworker: error MESSAGE
+#   ping                              ->  oommfworker: pong
+#   exit
+#
+# Each problem is loaded with Oxs_ProbInit and run with Oxs_Run until it is
+# done. Then each output OUTPUT (e.g. Oxs_TimeDriver::Spin) is saved in the
+# file FILE, whatever the Schedule and Destination commands of the problem.
+# Any other line written on the standard output is ignored by the pool.
+
+package require Oc 1.1
+package require Oxs
+
+proc Reply {args} {
+    puts stdout "oommfworker: [string map [list "\n" " "] [join $args]]"
+    flush stdout
+}
+
+proc Run {mif threads outputs} {
+    if {[llength [info commands Oc_SetMaxThreadCount]]} {
+        Oc_SetMaxThreadCount $threads
+    }
+    # Relative file names in the problem are relative to its directory
+    set cwd [pwd]
+    set mif [file normalize $mif]
+    cd [file dirname $mif]
+    set code [catch {
+        Oxs_ProbInit $mif {}
+        while {![Oxs_IsRunDone]} {
+            Oxs_Run
+        }
+        set names [Oxs_OutputNames]
+        foreach {output filename} $outputs {
+            if {[lsearch -exact $names $output] < 0} {
+                error "Unknown output $output (available: [join $names {, }])"
+            }
+            Oxs_OutputGet $output [list file $filename]
+        }
+    } msg]
+    # Release the problem in any case, so that the next one starts afresh
+    catch {Oxs_ProbRelease}
+    cd $cwd
+    return -code $code $msg
+}
+
+foreach cmd {Oxs_ProbInit Oxs_Run Oxs_IsRunDone Oxs_ProbRelease
+             Oxs_OutputNames Oxs_OutputGet} {
+    if {![llength [info commands $cmd]]} {
+        Reply error "$cmd is not available: run this script with the Oxs shell"
+        exit 1
+    }
+}
+
+fconfigure stdout -buffering line
+Reply ready
+while {[gets stdin line] >= 0} {
+    if {[catch {lindex $line 0} request]} {
+        Reply error "Malformed request: $line"
+        continue
+    }
+    switch -exact -- $request {
+        run {
+            if {[catch {Run [lindex $line 1] [lindex $line 2] \
+                        [lrange $line 3 end]} msg]} {
+                Reply error $msg
+            } else {
+                Reply done
+            }
+        }
+        ping {
+            Reply pong
+        }
+        exit {
+            break
+        }
+        "" {
+        }
+        default {
+            Reply error "Unknown request $request"
+        }
+    }
+}
+exit 0
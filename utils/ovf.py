@@ -7,8 +7,8 @@
 from __future__ import unicode_literals
 from builtins import bytes, str
 from io import open
-import struct
-from numpy import array, ndarray
+from numpy import (array, ceil, dtype, empty, floor, fromstring, memmap,
+                   nditer)
 from lattice import FieldLattice
 import sys
 py_ver = sys.version_info[0]
@@ -85,6 +85,16 @@ EXAMPLE 2: creating a new OVF file
   The last line is indeed valid only for OVF 2.0 but fails for OVF 1.0.
   The former one, in contrast, works both for version 1.0 and 2.0.
 
+EXAMPLE 3: files with many segments (e.g. time series)
+
+    ovf = OVFFile()
+    ovf.new([fl0, fl1, fl2], version=OVF20, data_type="binary8")
+    ovf.write("series.ovf")
+
+    # Only read the headers and index the segments, then load segment 2
+    ovf_file = OVFFile("series.ovf", lazy=True)
+    fl2 = ovf_file.get_field(segment=2)
+
 NOTE: The OVF file defines fields over a grid of cubes while the FieldLattice
   defines fields over points (the centers of the cubes, actually).
   For example:
@@ -112,8 +122,15 @@ NOTE: The OVF file defines fields over a grid of cubes while the FieldLattice
   the spacing is, but is not used as a point in the mesh.
 """
 
-__all__ = ["OVF10", "OVF20", "OVFFile", "OVFValueUnits", "OVFValueLabels"]
+__all__ = ["OVF10", "OVF20", "OVFFile", "OVFValueUnits", "OVFValueLabels",
+           "scan_header", "check_cell_ranges"]
+
 
+# Number of values converted and written at once when writing data
+WRITE_CHUNK_SIZE = 1 << 18
+
+# Number of bytes read at once when parsing text data
+READ_CHUNK_SIZE = 1 << 22
 
 # Abbreviations for OVF versions
 OVF10 = (1, 0)
@@ -195,9 +212,12 @@ class OVFSectionNode(OVFNode):
         self.section_action = lvalue = value.lower()
         assert lvalue in ["begin", "end"], "lvalue is %s" % lvalue
         self.received = {}
+        self.parent = None
+        self.offset = None
 
     def read(self, stream, root=None):
         while True:
+            offset = stream.tell()
             node = read_node(stream)
             if node is None:
                 return
@@ -212,6 +232,8 @@ class OVFSectionNode(OVFNode):
             if isinstance(node, OVFSectionNode):
                 sa = node.section_action
                 if sa == "begin":
+                    node.parent = self
+                    node.offset = offset
                     node.read(stream, root=root)
                 elif sa == "end":
                     self._end_section(node_name)
@@ -333,7 +355,7 @@ def split_strings(s, delim='"'):
 class OVFValueUnits:
 
     def __init__(self, s):
-        self.units = s.split() if type(s) == str else s
+        self.units = s.split() if isinstance(s, str) else s
 
     def __str__(self):
         return " ".join(self.units)
@@ -342,7 +364,7 @@ class OVFValueUnits:
 class OVFValueLabels:
 
     def __init__(self, s):
-        self.labels = split_strings(s) if type(s) == str else s
+        self.labels = split_strings(s) if isinstance(s, str) else s
 
     def __str__(self):
         return " ".join(['"%s"' % l for l in self.labels])
@@ -415,16 +437,25 @@ class OVFHeaderSectionNode(OVFSectionNode):
 
 
 def _info_binary(oommf_version, data_size):
-    endianness = '!' if oommf_version == OVF10 else '<'
+    endianness = '>' if oommf_version == OVF10 else '<'
     if data_size == 8:
-        float_type = 'd'
+        float_type = 'f8'
         expected_tag = 123456789012345.0
 
     else:
         assert data_size == 4
-        float_type = 'f'
+        float_type = 'f4'
         expected_tag = 1234567.0
-    return endianness, float_type, expected_tag
+    return dtype(endianness + float_type), expected_tag
+
+
+def _to_native_byteorder(a):
+    """Swap the bytes of the array 'a' in place, if needed, so that its data
+    is stored with the native byte order. Returns a view of the result."""
+    if a.dtype.isnative:
+        return a
+    a.byteswap(True)
+    return a.view(a.dtype.newbyteorder('='))
 
 
 class OVFDataSectionNode(OVFSectionNode):
@@ -438,6 +469,8 @@ class OVFDataSectionNode(OVFSectionNode):
         self.num_stored_nodes = None
         self.floats_per_node = None
         self.field = None
+        self.filename = None
+        self.data_offset = None
 
     def _get_identity(self):
         return "data"
@@ -445,13 +478,15 @@ class OVFDataSectionNode(OVFSectionNode):
     identity = property(_get_identity)
 
     def _retrieve_info_from_root(self, root):
-        h = root.a_segment.a_header
+        # The data is described by the header of the segment containing it
+        segment = self.parent
+        h = segment.a_header
         xn, yn, zn = self.nodes = \
             (h.a_xnodes.value, h.a_ynodes.value, h.a_znodes.value)
         self.num_nodes = xn * yn * zn
 
-        field_dim = root.field_dim
-        self.mesh_type = root.mesh_type
+        field_dim = root._get_field_dim(segment)
+        self.mesh_type = root._get_mesh_type(segment)
         if self.mesh_type == "rectangular":
             self.floats_per_node = field_dim
             self.num_stored_nodes = self.num_nodes
@@ -466,15 +501,15 @@ class OVFDataSectionNode(OVFSectionNode):
     def read(self, stream, root=None):
         self._retrieve_info_from_root(root)
 
-        if self.data_type == 'databinary8':
-            self._read_binary(stream, root=root, data_size=8)
-        elif self.data_type == 'databinary4':
-            self._read_binary(stream, root=root, data_size=4)
-        elif self.data_type == 'datatext':
-            self._read_ascii(stream, root=root)
+        # Remember where the data is, so that it can be loaded later, if the
+        # stream is lazy (and seekable)
+        self.filename = stream.filename
+        self.data_offset = stream.tell()
+        if (stream.lazy and self.filename is not None and
+                self.data_offset is not None):
+            self._skip_data(stream)
         else:
-            raise OVFReadError("Unknown data type '%s' in OVF file."
-                               % self.name)
+            self.field = self._read_data(stream, root=root)
 
         # Get to end of section
         while True:
@@ -482,12 +517,59 @@ class OVFDataSectionNode(OVFSectionNode):
             if l.startswith("# End:"):
                 return
 
+    def _read_data(self, stream, root=None):
+        if self.data_type == 'databinary8':
+            return self._read_binary(stream, root=root, data_size=8)
+        elif self.data_type == 'databinary4':
+            return self._read_binary(stream, root=root, data_size=4)
+        elif self.data_type == 'datatext':
+            return self._read_ascii(stream, root=root)
+        else:
+            raise OVFReadError("Unknown data type '%s' in OVF file."
+                               % self.name)
+
+    def _skip_data(self, stream):
+        if self.data_type in ('databinary8', 'databinary4'):
+            data_size = 8 if self.data_type == 'databinary8' else 4
+            num_floats = self.num_stored_nodes * self.floats_per_node
+            stream.seek(self.data_offset + data_size * (1 + num_floats))
+        elif self.data_type == 'datatext':
+            stream.skip_text()
+        else:
+            raise OVFReadError("Unknown data type '%s' in OVF file."
+                               % self.name)
+
+    def load(self, root, mmap=False):
+        """Load the data, if it was skipped while reading the file lazily,
+        and return it."""
+        if self.field is None:
+            stream = OVFStream(self.filename, mmap=mmap)
+            stream.seek(self.data_offset)
+            self.field = self._read_data(stream, root=root)
+        return self.field
+
+    def load_subvolume(self, root, cells, mmap=False):
+        """Return a copy of the data of the cells in the given subvolume,
+        without loading the whole data. 'cells' is a list of (start, stop)
+        ranges of cell indices, one for each direction (x, y, z)."""
+        field = self.field
+        if field is None and self.data_type != 'datatext':
+            # Map the binary data: only the pages containing the subvolume
+            # are then read from disk, when the subvolume is copied
+            stream = OVFStream(self.filename, mmap=True)
+            stream.seek(self.data_offset)
+            field = self._read_data(stream, root=root)
+        elif field is None:
+            field = self.load(root, mmap=mmap)
+
+        (x0, x1), (y0, y1), (z0, z1) = cells
+        subvolume = array(field[:, x0:x1, y0:y1, z0:z1], order="F")
+        return _to_native_byteorder(subvolume)
+
     def _read_binary(self, stream, root=None, data_size=8):
-        endianness, float_type, expected_tag = \
+        file_dtype, expected_tag = \
             _info_binary(root.a_oommf.value.version, data_size)
-        fmt = endianness + float_type
-        verification_tag, = struct.unpack(
-            fmt, bytes(stream.read_bytes(data_size), 'ISO-8859-1'))
+        verification_tag, = stream.read_array(file_dtype, 1)
         if verification_tag != expected_tag:
             raise OVFReadError("Data carries wrong signature: got '%s' but "
                                "'%s' was expected. This usually means that "
@@ -495,66 +577,87 @@ class OVFDataSectionNode(OVFSectionNode):
                                "correctly."
                                % (verification_tag, expected_tag))
 
+        # Read the data directly into its final storage and fix the byte
+        # order in place, without going through any intermediate object.
+        # In mmap mode the data is not read at all: it is mapped read-only,
+        # keeping the byte order of the file.
         num_floats = self.num_stored_nodes * self.floats_per_node
-        fmt = endianness + float_type * num_floats
-        data = stream.read_bytes(num_floats * data_size)
-        big_float_tuple = struct.unpack(fmt, bytes(data, 'ISO-8859-1'))
+        if stream.mmap:
+            data = stream.memmap_array(file_dtype, num_floats)
+        else:
+            data = _to_native_byteorder(stream.read_array(file_dtype,
+                                                          num_floats))
 
-        # Reshape the data
+        # Reshape the data (no copy is made: the array is already flat)
         xn, yn, zn = self.nodes
         fn = self.floats_per_node
-        self.field = array(big_float_tuple).reshape((fn, xn, yn, zn),
-                                                    order="F")
+        return data.reshape((fn, xn, yn, zn), order="F")
 
     def _read_ascii(self, stream, root=None):
-        semiflat_array = ndarray(dtype='float', order="F",
-                                 shape=(self.floats_per_node, self.num_nodes))
-
-        for i in range(self.num_nodes):
-            l = stream.next_line()
-            v = [float(vi) for vi in l.split()]
-            semiflat_array[:, i] = v
+        num_floats = self.num_stored_nodes * self.floats_per_node
+        data = stream.read_text_array(num_floats)
 
-        # Reshape the data
+        # Reshape the data: the nodes are stored with x varying fastest
         xn, yn, zn = self.nodes
         fn = self.floats_per_node
-        self.field = semiflat_array.reshape((fn, xn, yn, zn))
+        return data.reshape((fn, xn, yn, zn), order="F")
 
     def write(self, stream, root=None):
         self._retrieve_info_from_root(root)
+        field = self.field
+        if field is None:
+            # Skipped while reading lazily: read it just for the write,
+            # without keeping it. Binary data is mapped, so that it is
+            # streamed from the file rather than loaded
+            source = OVFStream(self.filename,
+                               mmap=self.data_type != "datatext")
+            source.seek(self.data_offset)
+            field = self._read_data(source, root=root)
+            source.close()
 
         stream.write_line("# Begin: %s" % self.name)
         if self.data_type == "databinary8":
-            self._write_binary(stream, root=root, data_size=8)
+            self._write_binary(stream, field, root=root, data_size=8)
         elif self.data_type == "databinary4":
-            self._write_binary(stream, root=root, data_size=4)
+            self._write_binary(stream, field, root=root, data_size=4)
         elif self.data_type == "datatext":
-            self._write_ascii(stream, root=root)
+            self._write_ascii(stream, field, root=root)
         else:
             raise ValueError("Unrecognised data type '%s'"
                              % self.data_type)
         stream.write_line("# End: %s" % self.name)
 
-    def _write_binary(self, stream, root=None, data_size=8):
-        endianness, float_type, expected_tag = \
+    def _write_binary(self, stream, field, root=None, data_size=8):
+        file_dtype, expected_tag = \
             _info_binary(root.a_oommf.value.version, data_size)
 
-        fmt = endianness + float_type
-        out_data = struct.pack(fmt, expected_tag)
+        stream.write(array([expected_tag], dtype=file_dtype))
 
-        num_floats = self.num_stored_nodes * self.floats_per_node
-        fmt = endianness + float_type * num_floats
-        flat_array = self.field.ravel('F')
-        out_data += struct.pack(fmt, *flat_array)
-        out_data += bytes("\n", encoding='ISO-8859-1')
-        stream.write(out_data)
+        # Stream the data in Fortran order, converting it to the dtype (and
+        # endianness) of the file one chunk at a time. Data which is already
+        # Fortran-ordered with the right dtype is written without any copy.
+        chunks = nditer(field, order="F", op_dtypes=[file_dtype],
+                        flags=["external_loop", "buffered", "zerosize_ok"],
+                        casting="same_kind", buffersize=WRITE_CHUNK_SIZE)
+        for chunk in chunks:
+            stream.write(chunk)
+        stream.write(b"\n")
 
-    def _write_ascii(self, stream, root=None):
-        semiflat_array = \
-            self.field.reshape((self.floats_per_node, self.num_nodes))
-        for i in range(self.num_nodes):
-            v = semiflat_array[:, i]
-            stream.write_line(" ".join([repr(vi) for vi in v]))
+    def _write_ascii(self, stream, field, root=None):
+        fn = self.floats_per_node
+        precision = stream.precision
+        value_fmt = "%r" if precision is None else "%%.%dg" % precision
+        line_fmt = " ".join([value_fmt] * fn) + "\n"
+
+        # Format many lines at once, WRITE_CHUNK_SIZE values at a time
+        semiflat_array = field.reshape((fn, -1), order="F")
+        num_nodes = semiflat_array.shape[1]
+        lines_per_chunk = max(1, WRITE_CHUNK_SIZE // fn)
+        for i in range(0, num_nodes, lines_per_chunk):
+            chunk = semiflat_array[:, i:i + lines_per_chunk]
+            values = tuple(chunk.T.ravel().tolist())
+            text = line_fmt * chunk.shape[1] % values
+            stream.write(text.encode('ISO-8859-1'))
 
 
 def remove_comment(line, marker="##"):
@@ -644,48 +747,61 @@ class OVFRootNode(OVFSectionNode):
 
     ovf_version = property(_get_version, None, None, "Version of OVF file.")
 
-    def _get_mesh_type(self):
+    def _get_segments(self):
+        return [n for n in self._subnodes
+                if isinstance(n, OVFSegmentSectionNode)
+                and n.section_action == "begin"]
+
+    segments = property(_get_segments, None, None,
+                        "The list of the segments in the file.")
+
+    def _get_mesh_type(self, segment=None):
         v = self.ovf_version
         if v == OVF10:
             return self.a_oommf.value.mesh_type
         else:
-            return self.a_segment.a_header.a_meshtype.value
+            segment = segment or self.a_segment
+            return segment.a_header.a_meshtype.value
 
     mesh_type = property(_get_mesh_type, None, None,
                          "Mesh type of the OVF file "
                          "(a string = rectangular/irregular)")
 
-    def _get_field_dim(self):
+    def _get_field_dim(self, segment=None):
         if self.ovf_version == OVF10:
             return 3
         else:
-            return self.a_segment.a_header.a_valuedim.value
+            segment = segment or self.a_segment
+            return segment.a_header.a_valuedim.value
 
     field_dim = property(_get_field_dim, None, None, "The size of the field.")
 
-    def _get_valueunits(self):
+    def _get_valueunits(self, segment=None):
+        segment = segment or self.a_segment
         v = self.ovf_version
         if v == OVF10:
-            return self.a_segment.a_header.a_valueunit.value
+            return segment.a_header.a_valueunit.value
         else:
-            return self.a_segment.a_header.a_valueunits.value
+            return segment.a_header.a_valueunits.value
 
-    def _set_valueunits(self, units):
-        units = [units] if type(units) == str else units
+    def _set_valueunits(self, units, segment=None):
+        segment = segment or self.a_segment
+        units = [units] if isinstance(units, (str, bytes)) else units
         v = self.ovf_version
         if v == OVF10:
             units_are_all_the_same = units.count(units[0]) == len(units)
             assert units_are_all_the_same, \
                 ("OVF 1.0 does not support fields having components with "
                  "different units.")
-            self.a_segment.a_header.a_valueunit.value = str(units[0])
+            segment.a_header.a_valueunit.value = str(units[0])
         else:
             assert v == OVF20
 
             def unit_setter(idx):
                 return units[idx] if idx < len(units) else units[-1]
-            us = [unit_setter(idx) for idx in range(self.field_dim)]
-            self.a_segment.a_header.a_valueunits.value = OVFValueUnits(us)
+            field_dim = self._get_field_dim(segment)
+            us = [unit_setter(idx) for idx in range(field_dim)]
+            segment.a_header.a_valueunits.value = OVFValueUnits(us)
 
     valueunits = property(_get_valueunits, _set_valueunits, None,
                           "The units of the components of the field "
@@ -719,69 +835,252 @@ class OVFRootNode(OVFSectionNode):
             n.write(stream, root=root)
 
 
+def _header_axes(h):
+    """Return, for each direction, the minimum coordinate of the mesh, the
+    cell size and the number of cells, as given in the header 'h'."""
+    return [(h.a_xmin.value, h.a_xstepsize.value, h.a_xnodes.value),
+            (h.a_ymin.value, h.a_ystepsize.value, h.a_ynodes.value),
+            (h.a_zmin.value, h.a_zstepsize.value, h.a_znodes.value)]
+
+
+def _lattice_spec(h, cells=None):
+    """Return the lattice specification (see lattice.Lattice) of the cell
+    centres in the given subvolume of the mesh described by the header."""
+    spec = []
+    for i, (mn, step, num) in enumerate(_header_axes(h)):
+        start, stop = (0, num) if cells is None else cells[i]
+        first = mn + (start + 0.5) * step
+        n = stop - start
+        # A lattice with one point uses the second value to give the spacing
+        last = first + (n - 1 if n > 1 else 1) * step
+        spec.append((first, last, n))
+    return spec
+
+
+def check_cell_ranges(nums, cells):
+    """Check a subvolume of a mesh with nums[i] cells along each direction,
+    given as a list of (start, stop) ranges of cell indices, one for each
+    direction, where None (or cells=None) means all the cells. Return the
+    list of the ranges, raising ValueError if any is empty or out of the
+    mesh."""
+    if cells is None:
+        cells = [None] * len(nums)
+    checked_cells = []
+    for axis, (num, c) in enumerate(zip(nums, cells)):
+        start, stop = (0, num) if c is None else c
+        if not 0 <= start < stop <= num:
+            raise ValueError("Invalid range of cells %s along axis %d: "
+                             "expected 0 <= start < stop <= %d."
+                             % ((start, stop), axis, num))
+        checked_cells.append((start, stop))
+    return checked_cells
+
+
+def _check_cells(h, cells):
+    return check_cell_ranges([num for _, _, num in _header_axes(h)], cells)
+
+
+def _box_to_cells(h, box):
+    """Convert a box (a list of coordinate ranges) into the ranges of the
+    indices of the cells intersecting it. A range of zero width selects the
+    cell containing that coordinate (the cell after it, if it lies on the
+    boundary between two cells, or the last cell at the end of the mesh)."""
+    cells = []
+    for axis, ((mn, step, num), b) in enumerate(zip(_header_axes(h), box)):
+        if b is None:
+            cells.append((0, num))
+            continue
+        start = int(floor((b[0] - mn) / step))
+        stop = int(ceil((b[1] - mn) / step))
+        if b[0] == b[1] and start == stop:
+            # On a cell boundary
+            if start == num:
+                start -= 1
+            else:
+                stop += 1
+        start = max(0, start)
+        stop = min(num, stop)
+        if start >= stop:
+            raise ValueError("The box does not intersect the mesh along "
+                             "axis %d." % axis)
+        cells.append((start, stop))
+    return cells
+
+
+def _parse_text_values(text, a, n):
+    """Parse the floating point numbers in the byte string 'text' and store
+    them in the array 'a' from position 'n'. Return the next position."""
+    text = text.strip()
+    if len(text) == 0:
+        return n
+    values = fromstring(text, sep=" ")
+    if n + len(values) > len(a):
+        raise OVFReadError("Too many values in text data: expected %d."
+                           % len(a))
+    a[n:n + len(values)] = values
+    return n + len(values)
+
+
 class OVFStream(object):
 
-    def __init__(self, filename, mode="r"):
-        print(type(filename))
-        if py_ver == 2:
-            if type(filename) == unicode or type(filename) == str:
-                self.filename = filename
-                self.f = open(filename, mode, encoding='ISO-8859-1')
-        elif py_ver >= 3:
-            if type(filename) == str:
-                self.filename = filename
-                self.f = open(filename, mode, encoding='ISO-8859-1')
+    def __init__(self, filename, mode="r", mmap=False, precision=None,
+                 keep_lines=False, lazy=False):
+        # The file is always opened in binary mode: lines are decoded
+        # explicitly, while binary data is read straight into numpy arrays
+        # (or memory mapped, if mmap=True). If lazy=True, data sections are
+        # skipped and only their position in the file is recorded.
+        # 'precision' is the number of significant digits used when writing
+        # text data (None for all).
+        # Lines are not retained once read (the parser never goes back), unless
+        # keep_lines=True, in which case they are all stored in self.lines.
+        if isinstance(filename, (str, bytes)):
+            self.filename = filename
+            self.f = open(filename, mode + "b")
         else:
             self.filename = None
             self.f = filename
+        self.mmap = mmap
+        self.lazy = lazy
+        self.precision = precision
         self.no_line = 0
-        self.lines = []
+        self.lines = [] if keep_lines else None
 
     def __del__(self):
-        self.f.close()
+        f = getattr(self, "f", None)
+        if f is not None and self.filename is not None:
+            f.close()
+
+    def close(self):
+        """Close the file, if it was opened by the stream."""
+        if self.filename is not None:
+            self.f.close()
+
+    def tell(self):
+        """Return the current position in the stream, or None if the stream
+        does not support random access."""
+        try:
+            return self.f.tell()
+        except (AttributeError, IOError, OSError, ValueError):
+            return None
 
-    def next_line(self):
-        if self.no_line < len(self.lines):
-            l = self.lines[self.no_line]
+    def seek(self, offset):
+        self.f.seek(offset)
 
-        else:
-            n = self.no_line - len(self.lines)
-            for _ in range(n + 1):
-                l = self.f.readline()
-                if len(l) == 0:
-                    return None
-                l = l[:-1]
-                self.lines.append(l)
+    def next_line(self):
+        l = self.f.readline()
+        if len(l) == 0:
+            return None
+        l = l.decode('ISO-8859-1').rstrip("\r\n")
 
+        if self.lines is not None:
+            self.lines.append(l)
         self.no_line += 1
         return l
 
     def read_bytes(self, num_bytes):
         l = self.f.read(num_bytes)
-        self.lines.append(l)
-        self.no_line = len(self.lines)
+        if self.lines is not None:
+            self.lines.append(l)
+        self.no_line += 1
         return l
 
-    def read_lines_ahead(self):
-        self.lines += self.f.readlines()
+    def read_array(self, data_type, count):
+        """Read 'count' values of the given numpy data type from the current
+        position of the stream. The data is read directly into the returned
+        array, which is thus the only copy of the data in memory."""
+        a = empty((count,), dtype=data_type)
+        num_bytes = a.nbytes
+        if num_bytes > 0 and self.f.readinto(a) != num_bytes:
+            raise OVFReadError("Unexpected end of file while reading %d "
+                               "bytes of binary data." % num_bytes)
+        return a
+
+    def memmap_array(self, data_type, count):
+        """Similar to read_array, but rather than reading the data, return a
+        read-only numpy.memmap over it and move past it in the stream.
+        Falls back to read_array if the stream is not backed by a file."""
+        if self.filename is None:
+            return self.read_array(data_type, count)
+        offset = self.f.tell()
+        try:
+            a = memmap(self.filename, dtype=data_type, mode="r",
+                       offset=offset, shape=(count,))
+        except ValueError:
+            raise OVFReadError("Unexpected end of file while mapping %d "
+                               "values of binary data." % count)
+        self.f.seek(offset + a.nbytes)
+        return a
+
+    def _read_chunks_until(self, end_marker):
+        """Read the stream in chunks, stopping right before the next
+        occurrence of 'end_marker'. Return an iterator over the chunks."""
+        while True:
+            chunk = self.f.read(READ_CHUNK_SIZE)
+            if len(chunk) == 0:
+                return
+            i = chunk.find(end_marker)
+            if i >= 0:
+                # Go back, so that the end marker is read with the next line
+                self.f.seek(i - len(chunk), 1)
+                yield chunk[:i]
+                return
+            yield chunk
+
+    def skip_text(self, end_marker=b"#"):
+        """Move to the next occurrence of 'end_marker' in the stream."""
+        for _ in self._read_chunks_until(end_marker):
+            pass
+
+    def read_text_array(self, count, end_marker=b"#"):
+        """Parse 'count' whitespace separated floating point numbers from the
+        stream, stopping right before the next occurrence of 'end_marker'.
+        The text is read and converted in large chunks."""
+        a = empty((count,), dtype=float)
+        n = 0
+        tail = b""
+        for chunk in self._read_chunks_until(end_marker):
+            # Only parse up to the last whitespace: the final number in the
+            # chunk may be truncated and is parsed together with the next one
+            text = tail + chunk
+            cut = max(text.rfind(c) for c in (b" ", b"\t", b"\n", b"\r"))
+            text, tail = text[:cut + 1], text[cut + 1:]
+            n = _parse_text_values(text, a, n)
+        n = _parse_text_values(tail, a, n)
+
+        if n != count:
+            raise OVFReadError("Error reading text data: expected %d values, "
+                               "but got %d." % (count, n))
+        return a
 
     def write(self, data):
-        self.f.write(str(data, encoding='ISO-8859-1'))
+        self.f.write(data)
 
     def write_line(self, line):
-        self.f.write(line + "\n")
+        self.f.write((line + "\n").encode('ISO-8859-1'))
 
 
 class OVFFile:
 
-    def __init__(self, filename=None):
+    def __init__(self, filename=None, mmap=False, lazy=False):
+        """Create an OVF file object and read its content from 'filename',
+        if given. If mmap=True, only the header is parsed: binary data is
+        exposed as a read-only numpy.memmap over the file and is loaded from
+        disk only when (and where) it is accessed. Text data is always read.
+        If lazy=True, the data of all the segments is skipped: only the
+        headers are parsed and the position of each segment is recorded, so
+        that get_field can later load the data of any segment directly.
+        """
         self.content = OVFRootNode()
+        self.mmap = mmap
 
         if filename is not None:
-            self.read(filename)
+            self.read(filename, mmap=mmap, lazy=lazy)
 
     def new(self, fieldlattice, version=OVF10, mesh_type="rectangular",
             data_type="binary8"):
+        """Create a new OVF file containing the given FieldLattice. A list of
+        FieldLattice objects can be given to create a file with one segment
+        for each of them."""
 
         available_data_types = {"text": "Data Text",
                                 "binary4": "Data Binary 4",
@@ -797,11 +1096,17 @@ class OVFFile:
         assert mesh_type == "rectangular", "Irregular meshes are not " \
                                            "supported, yet!"
 
-        assert fieldlattice.lattice.order == "F", \
-            "FieldLattice should have Fortran ordering!"
+        fieldlattices = (list(fieldlattice)
+                         if isinstance(fieldlattice, (list, tuple))
+                         else [fieldlattice])
+        assert len(fieldlattices) > 0, "No FieldLattice was given."
 
-        assert fieldlattice.lattice.dim == 3, \
-            "The FieldLattice should be defined over a 3D mesh."
+        for fl in fieldlattices:
+            assert fl.lattice.order == "F", \
+                "FieldLattice should have Fortran ordering!"
+
+            assert fl.lattice.dim == 3, \
+                "The FieldLattice should be defined over a 3D mesh."
 
         # Generate the root node
         root_node = OVFRootNode()
@@ -809,22 +1114,38 @@ class OVFFile:
         # Append version info
         if version == OVF10:
             t = OVFType("OOMMF: %s mesh v1.0" % mesh_type)
-            assert fieldlattice.field_dim == 3, \
-                ("OVF 1.0 only supports fields with dimension 3 (such as "
-                 "the magnetisation, for example)")
+            for fl in fieldlattices:
+                assert fl.field_dim == 3, \
+                    ("OVF 1.0 only supports fields with dimension 3 (such as "
+                     "the magnetisation, for example)")
         else:
             t = OVFType("OOMMF OVF 2.0")
-            assert fieldlattice.field_dim >= 1, \
-                ("You are trying to write a field with dimension 0.")
+            for fl in fieldlattices:
+                assert fl.field_dim >= 1, \
+                    ("You are trying to write a field with dimension 0.")
         root_node._subnodes.append(OVFVersionNode(data=("OOMMF", t)))
 
-        # Append segment count and segment section
-        root_node._subnodes.append(OVFValueNode(data=("Segment count", "1")))
-        segment_node = OVFSectionNode(data=("Segment", "Begin"))
-        root_node._subnodes.append(segment_node)
+        # Append segment count and segment sections
+        root_node._subnodes.append(
+            OVFValueNode(data=("Segment count", str(len(fieldlattices)))))
+        for fl in fieldlattices:
+            segment_node = self._new_segment(fl, version, mesh_type, data_type)
+            segment_node.parent = root_node
+            root_node._subnodes.append(segment_node)
+
+        # Add subnodes as attributes for better accessibility
+        root_node._add_as_attr()
+        root_node.a_segment = root_node.segments[0]
+
+        # Finally replace self.content
+        self.content = root_node
+
+    def _new_segment(self, fieldlattice, version, mesh_type, data_type):
+        segment_node = OVFSegmentSectionNode(data=("Segment", "Begin"))
 
         # Generate the header
-        header_node = OVFSectionNode(data=("Header", "Begin"))
+        header_node = OVFHeaderSectionNode(data=("Header", "Begin"))
+        header_node.parent = segment_node
         segment_node._subnodes.append(header_node)
         for known_v in known_values_list:
             v_name = known_v[0]
@@ -841,6 +1162,7 @@ class OVFFile:
         fl = fieldlattice
         l = fieldlattice.lattice
         data_node = OVFDataSectionNode(data=(data_type, "Begin"))
+        data_node.parent = segment_node
         segment_node._subnodes.append(data_node)
         data_node._subnodes.append(OVFSectionNode(data=(data_type, "End")))
         data_node.field = fl.field_data
@@ -848,17 +1170,18 @@ class OVFFile:
         segment_node._subnodes.append(OVFSectionNode(data=("Segment", "End")))
 
         # Add subnodes as attributes for better accessibility
-        root_node._add_as_attr()
+        segment_node._add_as_attr()
 
         # Now write proper values in the header fields
-        h = root_node.a_segment.a_header
+        h = segment_node.a_header
         h.a_xnodes.value, h.a_ynodes.value, h.a_znodes.value = l.nodes
         ss = l.stepsizes
         hss = [0.5 * ssi for ssi in ss]
         h.a_xstepsize.value, h.a_ystepsize.value, h.a_zstepsize.value = ss
-        h.a_xbase.value, h.a_ybase.value, h.a_zbase.value = hss
+        h.a_xbase.value, h.a_ybase.value, h.a_zbase.value = l.min_node_pos
         min_mesh_pos = [nmn - d for nmn, d in zip(l.min_node_pos, hss)]
-        max_mesh_pos = [nmx + d for nmx, d in zip(l.max_node_pos, hss)]
+        max_mesh_pos = [mn + n * ssi
+                        for mn, n, ssi in zip(min_mesh_pos, l.nodes, ss)]
         h.a_xmin.value, h.a_ymin.value, h.a_zmin.value = min_mesh_pos
         h.a_xmax.value, h.a_ymax.value, h.a_zmax.value = max_mesh_pos
 
@@ -869,45 +1192,144 @@ class OVFFile:
         if version == OVF10:
             h.a_valueunit.value = "1.0"
             h.a_valuemultiplier.value = 1.0
-            h.a_valuerangeminmag.value = min(fl.field_data.flat)
-            h.a_valuerangemaxmag.value = max(fl.field_data.flat)
+            h.a_valuerangeminmag.value = float(fl.field_data.min())
+            h.a_valuerangemaxmag.value = float(fl.field_data.max())
 
         else:
             h.a_valuedim.value = fl.field_dim
             h.a_valueunits.value = OVFValueUnits(" 1.0" * fl.field_dim)
             h.a_valuelabels.value = OVFValueLabels(' "1.0"' * fl.field_dim)
 
-        # Finally replace self.content
-        self.content = root_node
-
-    def get_field(self):
+        return segment_node
+
+    def _get_segment_offsets(self):
+        return [segment.offset for segment in self.content.segments]
+
+    segment_offsets = property(_get_segment_offsets, None, None,
+                               "Index of the byte offsets of the segments in "
+                               "the file (None for new files).")
+
+    def get_num_segments(self):
+        """Return the number of segments in the file."""
+        return len(self.content.segments)
+
+    def get_field(self, segment=0, cells=None, box=None):
+        """Return the field stored in the given segment of the file as a
+        FieldLattice. If the file was read lazily, only the data of this
+        segment is loaded, seeking directly to it. If the file was read with
+        mmap=True, the field data is a read-only view of the memory mapped
+        file.
+
+        Only a subvolume of the field can be obtained by giving either
+        'cells', a list of (start, stop) ranges of cell indices, or 'box', a
+        list of (min, max) coordinate ranges (in the units of the file),
+        one for each direction (x, y, z). In the latter case, all the cells
+        intersecting the box are returned. Use None for a whole direction.
+        For binary data which was not loaded (lazy or mmap mode), only the
+        parts of the file containing the subvolume are read.
+        """
         root_node = self.content
-        segment_node = root_node.a_segment
+        segment_node = root_node.segments[segment]
         h = segment_node.a_header
-        ss = [h.a_xstepsize, h.a_ystepsize, h.a_zstepsize]
-        dx, dy, dz = [0.5 * ssi.value for ssi in ss]
-
-        min_max_ndim = \
-            [(h.a_xmin.value - dx, h.a_xmax.value + dx, h.a_xnodes.value),
-             (h.a_ymin.value - dy, h.a_ymax.value + dy, h.a_ynodes.value),
-                (h.a_zmin.value - dz, h.a_zmax.value + dz, h.a_znodes.value)]
-
-        field_data = segment_node.a_data.field
-        field_dim = root_node.field_dim
-        return FieldLattice(min_max_ndim, dim=field_dim,
+        if box is not None:
+            cells = _box_to_cells(h, box)
+        elif cells is not None:
+            cells = _check_cells(h, cells)
+
+        data_node = segment_node.a_data
+        if cells is None:
+            field_data = data_node.load(root_node, mmap=self.mmap)
+        else:
+            field_data = data_node.load_subvolume(root_node, cells,
+                                                  mmap=self.mmap)
+        field_dim = root_node._get_field_dim(segment_node)
+        return FieldLattice(_lattice_spec(h, cells), dim=field_dim,
                             data=field_data, order='F')
 
-    def read(self, stream):
+    def read(self, stream, mmap=False, lazy=False):
         if not isinstance(stream, OVFStream):
-            stream = OVFStream(stream)
+            stream = OVFStream(stream, mmap=mmap, lazy=lazy)
+        self.mmap = stream.mmap
         self.content.read(stream, root=self.content)
         self.content._end_section("main")
 
-    def write(self, stream):
+        segments = self.content.segments
+        num_segments = self.content.a_segmentcount.value
+        if num_segments != len(segments):
+            raise OVFReadError("The file declares %d segments, but contains "
+                               "%d." % (num_segments, len(segments)))
+        if segments:
+            self.content.a_segment = segments[0]
+
+    def write(self, stream, precision=None):
+        """Write the OVF file to the given stream or file name. 'precision'
+        is the number of significant digits used for text data (by default
+        all the digits needed to represent each value exactly are used)."""
         if not isinstance(stream, OVFStream):
-            stream = OVFStream(stream, mode="w")
+            stream = OVFStream(stream, mode="w", precision=precision)
         self.content.write(stream, root=self.content)
 
+
+def scan_header(filename):
+    """Read the header of the first segment of an OVF file, stopping at the
+    beginning of its data, and return a dictionary with the main properties
+    of the file: version, title, data_type ("text", "binary4" or
+    "binary8"), data_offset (the position of the data in the file), nodes,
+    stepsizes, min and max (for x, y and z), valuedim, valueunits (one for
+    each component), num_segments and desc (the list of "Desc" lines, where
+    OOMMF stores iteration, stage and simulation time).
+    """
+    stream = OVFStream(filename)
+    values = {}
+    desc = []
+    version = None
+    try:
+        while True:
+            node = read_node(stream)
+            if node is None:
+                raise OVFReadError("No data section found in '%s'."
+                                   % filename)
+
+            identity = node.identity
+            if isinstance(node, OVFVersionNode):
+                version = node.value.version
+            elif isinstance(node, OVFSectionNode):
+                if node.section_action == "begin" and identity == "data":
+                    # "datatext" -> "text", "databinary8" -> "binary8", ...
+                    data_type = name_normalise(node.name)[4:]
+                    break
+            elif identity == "desc":
+                desc.append(node.value)
+            else:
+                values[identity] = node.value
+        data_offset = stream.tell()
+    finally:
+        stream.close()
+
+    def xyz(name):
+        return [values[axis + name] for axis in "xyz"]
+
+    if version == OVF10:
+        valuedim = 3
+        valueunits = [values.get("valueunit")] * valuedim
+    else:
+        valuedim = values["valuedim"]
+        valueunits = values["valueunits"].units
+
+    return {"version": "%d.%d" % version,
+            "title": values.get("title"),
+            "num_segments": values["segmentcount"],
+            "data_type": data_type,
+            "data_offset": data_offset,
+            "nodes": xyz("nodes"),
+            "stepsizes": xyz("stepsize"),
+            "min": xyz("min"),
+            "max": xyz("max"),
+            "valuedim": valuedim,
+            "valueunits": list(valueunits),
+            "desc": desc}
+
+
 if __name__ == "__main__no":
     import sys
     print("Reading")
@@ -0,0 +1,212 @@
+# oommf-python
+# Copyright (C) 2016 University of Southampton
+#
+# CONTACT: h.fangohr@soton.ac.uk
+
+'''
+Batch processing of many OVF files over a pool of processes. Two operations
+are provided, both as functions and from the command line:
+
+ - conversion between data types (text, binary4, binary8) and OVF versions:
+
+     python ovfbatch.py convert -o converted/ -t binary4 -v 2.0 "runs/*.omf"
+
+ - reductions (average, per-component minimum and maximum and statistics of
+   the norm of the field), collected in a single .npz file:
+
+     python ovfbatch.py reduce -o stats.npz "runs/*.omf"
+
+   Every segment of every file gives one row in the arrays of the output.
+'''
+
+from __future__ import print_function, unicode_literals
+import argparse
+import glob
+import multiprocessing
+import os
+import sys
+
+import numpy
+
+from ovf import OVFFile, OVF10, OVF20
+
+__all__ = ["expand_patterns", "convert", "reduce_files", "main"]
+
+OVF_VERSIONS = {"1.0": OVF10, "2.0": OVF20}
+
+# Names of the arrays computed by reduce_files, in addition to 'files' and
+# 'segments'
+REDUCTIONS = ["mean", "min", "max",
+              "norm_mean", "norm_min", "norm_max", "norm_std"]
+
+
+def expand_patterns(patterns):
+    """Expand the given glob patterns and return the sorted list of the
+    matching files (without duplicates)."""
+    filenames = set()
+    for pattern in patterns:
+        filenames.update(glob.glob(pattern))
+    return sorted(filenames)
+
+
+def _map(fn, args, processes):
+    """Apply 'fn' to each entry of 'args' over a pool of 'processes'
+    processes (all available processors if None). With processes=1 no pool
+    is created."""
+    if processes == 1 or len(args) <= 1:
+        return [fn(arg) for arg in args]
+    processes = processes or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes)
+    try:
+        chunksize = max(1, len(args) // (4 * processes))
+        return pool.map(fn, args, chunksize=chunksize)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _get_field(ovf_file, segment):
+    """Return the field in the given segment of 'ovf_file', multiplied by
+    the value multiplier of the segment (OVF 1.0), if any."""
+    field = ovf_file.get_field(segment=segment)
+    h = ovf_file.content.segments[segment].a_header
+    multiplier = getattr(getattr(h, "a_valuemultiplier", None), "value", None)
+    if multiplier is not None and float(multiplier) != 1.0:
+        field.field_data = field.field_data * float(multiplier)
+    return field
+
+
+def _convert_file(args):
+    in_path, out_path, version, data_type, precision = args
+    # The data is mapped, not read: it is converted while being written
+    # (unless it has to be multiplied by the value multiplier first)
+    src = OVFFile(in_path, lazy=True, mmap=True)
+    fields = [_get_field(src, i) for i in range(src.get_num_segments())]
+
+    dst = OVFFile()
+    dst.new(fields, version=version, data_type=data_type)
+    # Keep the metadata which is common to all versions
+    for src_segment, dst_segment in zip(src.content.segments,
+                                        dst.content.segments):
+        src_h = src_segment.a_header
+        dst_h = dst_segment.a_header
+        dst_h.a_title.value = src_h.a_title.value
+        dst_h.a_meshunit.value = src_h.a_meshunit.value
+        units = src.content._get_valueunits(src_segment)
+        dst.content._set_valueunits(getattr(units, "units", units),
+                                    segment=dst_segment)
+    dst.write(out_path, precision=precision)
+    return out_path
+
+
+def convert(filenames, output_dir, version=OVF20, data_type="binary8",
+            precision=None, processes=None):
+    """Convert the given OVF files to the given OVF version and data type
+    ("text", "binary4" or "binary8"), saving them with the same name in
+    'output_dir'. 'precision' is the number of significant digits used for
+    text data. The data of OVF 1.0 files is multiplied by their value
+    multiplier, so that the converted files need none. Return the list of
+    the written files. Files with the same name (from different
+    directories) are not accepted."""
+    args = []
+    sources = {}
+    for filename in filenames:
+        out_path = os.path.join(output_dir, os.path.basename(filename))
+        if out_path in sources:
+            raise ValueError("Both '%s' and '%s' would be converted to '%s'."
+                             % (sources[out_path], filename, out_path))
+        sources[out_path] = filename
+        if os.path.exists(out_path) and os.path.samefile(filename, out_path):
+            raise ValueError("Refusing to overwrite the input file '%s'."
+                             % filename)
+        args.append((filename, out_path, version, data_type, precision))
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    return _map(_convert_file, args, processes)
+
+
+def _reduce_file(filename):
+    ovf_file = OVFFile(filename, lazy=True, mmap=True)
+    rows = []
+    for i in range(ovf_file.get_num_segments()):
+        data = _get_field(ovf_file, i).field_data
+        # Reduce over the nodes, keeping the components
+        semiflat = data.reshape((data.shape[0], -1), order="F")
+        norm = numpy.sqrt(numpy.sum(numpy.square(semiflat, dtype=float),
+                                    axis=0))
+        rows.append((semiflat.mean(axis=1, dtype=float),
+                     semiflat.min(axis=1), semiflat.max(axis=1),
+                     norm.mean(), norm.min(), norm.max(), norm.std()))
+    return rows
+
+
+def reduce_files(filenames, output=None, processes=None):
+    """Compute reductions of the fields in the given OVF files and return
+    them as a dictionary of arrays with one row for each segment of each
+    file: 'files' and 'segments' identify the segment, 'mean', 'min' and
+    'max' have one column per component, while 'norm_mean', 'norm_min',
+    'norm_max' and 'norm_std' are statistics of the norm of the field.
+    If 'output' is given, the arrays are also saved there (numpy .npz)."""
+    filenames = list(filenames)
+    results = _map(_reduce_file, filenames, processes)
+    files = []
+    segments = []
+    columns = [[] for _ in REDUCTIONS]
+    for filename, rows in zip(filenames, results):
+        for i, row in enumerate(rows):
+            files.append(filename)
+            segments.append(i)
+            for column, value in zip(columns, row):
+                column.append(value)
+
+    reductions = {"files": numpy.array(files),
+                  "segments": numpy.array(segments, dtype=int)}
+    for name, column in zip(REDUCTIONS, columns):
+        reductions[name] = numpy.array(column, dtype=float)
+    if output is not None:
+        numpy.savez(output, **reductions)
+    return reductions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Convert or reduce many OVF files in parallel.")
+    parser.add_argument("-j", "--processes", type=int, default=None,
+                        help="number of processes (default: all processors)")
+    subparsers = parser.add_subparsers(dest="command")
+
+    p = subparsers.add_parser("convert", help="convert OVF files")
+    p.add_argument("patterns", nargs="+", help="input files or glob patterns")
+    p.add_argument("-o", "--output-dir", required=True,
+                   help="directory where the converted files are saved")
+    p.add_argument("-t", "--data-type", default="binary8",
+                   choices=["text", "binary4", "binary8"])
+    p.add_argument("-v", "--version", default="2.0",
+                   choices=sorted(OVF_VERSIONS))
+    p.add_argument("-p", "--precision", type=int, default=None,
+                   help="significant digits for text data (default: all)")
+
+    p = subparsers.add_parser("reduce", help="compute averages, minima, "
+                              "maxima and norm statistics of OVF files")
+    p.add_argument("patterns", nargs="+", help="input files or glob patterns")
+    p.add_argument("-o", "--output", required=True,
+                   help="output file (numpy .npz)")
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.error("a command is required")
+    filenames = expand_patterns(args.patterns)
+    if args.command == "convert":
+        written = convert(filenames, args.output_dir,
+                          version=OVF_VERSIONS[args.version],
+                          data_type=args.data_type, precision=args.precision,
+                          processes=args.processes)
+        print("Converted %d files." % len(written))
+    else:
+        reduce_files(filenames, output=args.output, processes=args.processes)
+        print("Reduced %d files into %s." % (len(filenames), args.output))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+# oommf-python
+# Copyright (C) 2016 University of Southampton
+#
+# CONTACT: h.fangohr@soton.ac.uk
+
+'''
+This module provides the OVFCatalogue class, a persistent index of the
+headers of the OVF files (.omf, .ohf, ...) contained in a directory.
+Example:
+
+  from ovfcatalogue import OVFCatalogue
+  catalogue = OVFCatalogue("runs/hysteresis")
+  for filename in catalogue.sorted(key="mtime"):
+      print(filename, catalogue[filename]["nodes"])
+
+The catalogue is saved in the directory itself and, when refreshed, only the
+files which were added or modified since the last refresh are scanned.
+'''
+
+from __future__ import unicode_literals
+import fnmatch
+import json
+import os
+
+from ovf import scan_header
+
+__all__ = ["OVFCatalogue", "save_json"]
+
+
+def save_json(obj, path):
+    """Save 'obj' as JSON in the file 'path', which is replaced atomically,
+    so that it is never seen half written."""
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp_path, "w") as f:
+        json.dump(obj, f)
+    os.rename(tmp_path, path)
+
+
+class OVFCatalogue(object):
+
+    """Index of the OVF files in a directory. For each file, the catalogue
+    stores the dictionary returned by ovf.scan_header, plus the entries
+    'mtime' and 'size' of the file. The files which could not be read (e.g.
+    because they are still being written) are left out of the catalogue and
+    the errors of the last refresh are given in 'errors', by file name."""
+
+    def __init__(self, directory, pattern="*.o[hmv]f",
+                 index_name=".ovf_catalogue.json", refresh=True):
+        self.directory = directory
+        self.pattern = pattern
+        self.index_path = os.path.join(directory, index_name)
+        self.entries = {}
+        self.errors = {}
+        self.load()
+        if refresh:
+            self.refresh()
+
+    def load(self):
+        """Load the catalogue from disk, if it exists."""
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.entries = json.load(f)
+
+    def save(self):
+        """Save the catalogue to disk (see save_json)."""
+        save_json(self.entries, self.index_path)
+
+    def refresh(self):
+        """Scan the headers of the files which are new or whose modification
+        time or size changed, forget the files which were removed and save
+        the catalogue, if anything changed. Return the number of scanned
+        files."""
+        found = {}
+        self.errors = {}
+        for filename in os.listdir(self.directory):
+            if fnmatch.fnmatch(filename, self.pattern):
+                try:
+                    st = os.stat(os.path.join(self.directory, filename))
+                except OSError:
+                    # Removed in the meantime
+                    continue
+                found[filename] = (st.st_mtime, st.st_size)
+
+        num_scanned = 0
+        removed = [fn for fn in self.entries if fn not in found]
+        for filename in removed:
+            del self.entries[filename]
+
+        for filename, (mtime, size) in found.items():
+            entry = self.entries.get(filename)
+            if (entry is not None and entry["mtime"] == mtime and
+                    entry["size"] == size):
+                continue
+            try:
+                entry = scan_header(os.path.join(self.directory, filename))
+            except Exception as ex:
+                # Scanned again at the next refresh
+                self.errors[filename] = "%s: %s" % (type(ex).__name__, ex)
+                if self.entries.pop(filename, None) is not None:
+                    removed.append(filename)
+                continue
+            entry["mtime"] = mtime
+            entry["size"] = size
+            self.entries[filename] = entry
+            num_scanned += 1
+
+        if num_scanned > 0 or len(removed) > 0:
+            self.save()
+        return num_scanned
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(sorted(self.entries))
+
+    def __contains__(self, filename):
+        return filename in self.entries
+
+    def __getitem__(self, filename):
+        return self.entries[filename]
+
+    def sorted(self, key="mtime"):
+        """Return the names of the files in the catalogue, sorted by the given
+        entry (or by the result of the given function, which receives the
+        entry)."""
+        fn = key if callable(key) else (lambda entry: entry[key])
+        return sorted(self.entries,
+                      key=lambda filename: (fn(self.entries[filename]),
+                                            filename))
+
+    def newest(self):
+        """Return the name of the most recently modified file, or None if the
+        catalogue is empty."""
+        files = self.sorted(key="mtime")
+        return files[-1] if files else None
+
+    def path(self, filename):
+        """Return the full path of a file in the catalogue."""
+        return os.path.join(self.directory, filename)
@@ -0,0 +1,328 @@
+# oommf-python
+# Copyright (C) 2016 University of Southampton
+#
+# CONTACT: h.fangohr@soton.ac.uk
+
+'''
+This module provides ResultCache, a directory of cached results, each made
+of a few named numpy arrays and identified by a key (e.g. a checksum of the
+inputs of a calculation), and MemoCache, a bounded in-memory cache with the
+same interface to put in front of it. Example:
+
+  cache = ResultCache("~/.oommf_calculator", max_bytes=1 << 30)
+  arrays = cache.get(key)
+  if arrays is None:
+      arrays = {"field": compute()}
+      cache.put(key, arrays)
+
+The arrays are saved as .npy files and are loaded memory mapped (copy on
+write), which makes reading a result nearly free. An index records the size
+of each result and the modification time of its directory records the last
+access: when the total size exceeds 'max_bytes' the least recently used
+results are removed. The index is updated under a file lock, only when
+results are added or removed, and results are written to a temporary
+directory which is then renamed, so that several processes can share the
+cache.
+
+MemoCache keeps the most recently used results of the current process,
+limited by number of results and/or by size. Its arrays are made read-only,
+so that the results can be shared by all the callers without copies.
+'''
+
+from __future__ import unicode_literals
+import collections
+import json
+import os
+import shutil
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+import numpy
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+__all__ = ["ResultCache", "MemoCache", "hash_array"]
+
+# Number of bytes hashed at a time by hash_array
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def hash_array(h, a, fast=False, chunk_size=HASH_CHUNK_SIZE):
+    """Update the hash object 'h' (e.g. from hashlib) with the data type,
+    the shape and the content of the array 'a'. The raw memory of the array
+    is hashed in chunks, without copying it (unless 'a' is not contiguous).
+    With fast=True, a CRC-32 and an Adler-32 checksum of each chunk are
+    hashed instead of the chunk itself: this is faster, but not a
+    cryptographic hash, and is only meant for cache keys."""
+    a = numpy.ascontiguousarray(a)
+    h.update(("%s|%s|" % (a.dtype.str, a.shape)).encode("ascii"))
+    raw = a.reshape(-1).view(numpy.uint8)
+    for start in range(0, len(raw), chunk_size):
+        chunk = raw[start:start + chunk_size]
+        if fast:
+            h.update(struct.pack(str("<II"), zlib.crc32(chunk) & 0xffffffff,
+                                 zlib.adler32(chunk) & 0xffffffff))
+        else:
+            h.update(chunk)
+
+
+class ResultCache(object):
+
+    index_name = "index.json"
+    lock_name = "index.lock"
+    names_name = "names.json"
+
+    def __init__(self, directory, max_bytes=None):
+        self.directory = os.path.expanduser(directory)
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(self.directory, self.index_name)
+        self.lock_path = os.path.join(self.directory, self.lock_name)
+        self.stats = {"hits": 0, "misses": 0, "puts": 0, "evictions": 0}
+        self._stats_lock = threading.Lock()
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                if not os.path.isdir(self.directory):
+                    raise
+
+    def _count(self, stat, n=1):
+        with self._stats_lock:
+            self.stats[stat] += n
+
+    @contextmanager
+    def _locked(self):
+        """Hold the lock of the index (if the platform supports it) and
+        provide the index, which is saved at exit."""
+        with open(self.lock_path, "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                index = self._load_index()
+                yield index
+                self._save_index(index)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load_index(self):
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                return json.load(f)
+        return {}
+
+    def _save_index(self, index):
+        tmp_path = "%s.%d.%d.tmp" % (self.index_path, os.getpid(),
+                                     threading.current_thread().ident)
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.rename(tmp_path, self.index_path)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.directory, key)
+
+    def _atime(self, key):
+        # The last access time is the modification time of the directory of
+        # the result, see get
+        try:
+            return os.stat(self._entry_dir(key)).st_mtime
+        except OSError:
+            return 0
+
+    def __contains__(self, key):
+        return os.path.isdir(self._entry_dir(key))
+
+    def __len__(self):
+        return len(self._load_index())
+
+    def _get_total_bytes(self):
+        return sum(e["bytes"] for e in self._load_index().values())
+
+    total_bytes = property(_get_total_bytes, None, None,
+                           "Total size of the cached arrays in bytes.")
+
+    def get(self, key):
+        """Return the dictionary of the arrays saved with the given key (as
+        copy-on-write memory maps), or None if the key is not in the cache.
+        """
+        # Neither the lock nor the index are needed: the directory of a
+        # result only exists when it is complete (see put and remove)
+        arrays = self._load(key)
+        if arrays is None and key in self:
+            # Damaged behind our back. Check again holding the lock, since
+            # another process may have just replaced it with a valid result,
+            # and only remove it if it is still damaged
+            with self._locked() as index:
+                arrays = self._load(key)
+                if arrays is None:
+                    index.pop(key, None)
+                    self._remove_dir(key)
+        if arrays is None:
+            self._count("misses")
+            return None
+        try:
+            os.utime(self._entry_dir(key), None)
+        except OSError:
+            pass
+        self._count("hits")
+        return arrays
+
+    def _load(self, key):
+        # Returns the arrays of the result, or None if it is missing or
+        # damaged
+        entry_dir = self._entry_dir(key)
+        try:
+            with open(os.path.join(entry_dir, self.names_name)) as f:
+                names = json.load(f)
+            return dict((name, numpy.load(os.path.join(entry_dir,
+                                                       name + ".npy"),
+                                          mmap_mode="c"))
+                        for name in names)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def put(self, key, arrays):
+        """Save the given dictionary of arrays with the given key, replacing
+        any previous result, and evict the least recently used results if
+        the cache exceeds its budget. Results larger than the whole budget
+        are not saved."""
+        num_bytes = sum(numpy.asarray(a).nbytes for a in arrays.values())
+        if self.max_bytes is not None and num_bytes > self.max_bytes:
+            return
+
+        # Write the arrays outside the lock, in a private directory
+        tmp_dir = self._tmp_dir(key, "tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for name, a in arrays.items():
+            numpy.save(os.path.join(tmp_dir, name + ".npy"), a)
+        with open(os.path.join(tmp_dir, self.names_name), "w") as f:
+            json.dump(sorted(arrays), f)
+
+        with self._locked() as index:
+            self._remove_dir(key)
+            os.rename(tmp_dir, self._entry_dir(key))
+            index[key] = {"bytes": num_bytes}
+            self._evict(index, keep=key)
+        self._count("puts")
+
+    def _tmp_dir(self, key, suffix):
+        return "%s.%d.%d.%s" % (self._entry_dir(key), os.getpid(),
+                                threading.current_thread().ident, suffix)
+
+    def _remove_dir(self, key):
+        # Renamed first, so that get never sees a partly removed result
+        entry_dir = self._entry_dir(key)
+        if os.path.exists(entry_dir):
+            tmp_dir = self._tmp_dir(key, "removed")
+            os.rename(entry_dir, tmp_dir)
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _evict(self, index, keep=None):
+        if self.max_bytes is None:
+            return
+        total = sum(e["bytes"] for e in index.values())
+        if total <= self.max_bytes:
+            return
+        atimes = dict((key, self._atime(key)) for key in index)
+        for key in sorted(index, key=atimes.get):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= index[key]["bytes"]
+            del index[key]
+            self._remove_dir(key)
+            self._count("evictions")
+
+    def remove(self, key):
+        """Remove the result with the given key, if present."""
+        with self._locked() as index:
+            index.pop(key, None)
+            self._remove_dir(key)
+
+    def clear(self):
+        """Remove all the results."""
+        with self._locked() as index:
+            for key in list(index):
+                del index[key]
+                self._remove_dir(key)
+
+
+class MemoCache(object):
+
+    """In-memory cache of results (dictionaries of arrays) with the same
+    interface as ResultCache, keeping at most 'max_entries' results and
+    'max_bytes' bytes (no limit if None) and evicting the least recently
+    used results first. It can be used from several threads."""
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "puts": 0, "evictions": 0}
+        self._entries = collections.OrderedDict()
+        self._lock = threading.RLock()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the dictionary of the (read-only) arrays saved with the
+        given key, or None if the key is not in the cache."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries[key] = entry
+            self.stats["hits"] += 1
+            return dict(entry[0])
+
+    def put(self, key, arrays):
+        """Save the given dictionary of arrays with the given key and return
+        the saved arrays, which are read-only views of the given ones. The
+        arrays are not copied: they must not be modified afterwards."""
+        saved = {}
+        for name, a in arrays.items():
+            a = numpy.asarray(a).view()
+            a.flags.writeable = False
+            saved[name] = a
+        num_bytes = sum(a.nbytes for a in saved.values())
+        with self._lock:
+            self.remove(key)
+            if self.max_bytes is not None and num_bytes > self.max_bytes:
+                return saved
+            self._entries[key] = (saved, num_bytes)
+            self.total_bytes += num_bytes
+            self.stats["puts"] += 1
+            while ((self.max_entries is not None and
+                    len(self._entries) > self.max_entries) or
+                   (self.max_bytes is not None and
+                    self.total_bytes > self.max_bytes)):
+                _, (_, n) = self._entries.popitem(last=False)
+                self.total_bytes -= n
+                self.stats["evictions"] += 1
+        return saved
+
+    def remove(self, key):
+        """Remove the result with the given key, if present."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.total_bytes -= entry[1]
+
+    def clear(self):
+        """Remove all the results."""
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
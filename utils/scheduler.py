@@ -0,0 +1,200 @@
+# oommf-python
+# Copyright (C) 2016 University of Southampton
+#
+# CONTACT: h.fangohr@soton.ac.uk
+
+'''
+This module provides Scheduler, which runs functions on a fixed number of
+worker threads and returns a Future for each of them. It is meant for jobs
+spending their time in external processes (e.g. OOMMF), which run
+concurrently while the threads wait for them. Example:
+
+  scheduler = Scheduler(max_workers=8)
+  futures = [scheduler.submit(key, run, args) for key, args in jobs]
+  results = [f.result() for f in futures]
+
+Jobs can be submitted with a key identifying their result: while a job is
+queued or running, submitting another job with the same key returns the
+Future of the first one instead of running it again.
+'''
+
+from __future__ import unicode_literals
+import collections
+import threading
+
+__all__ = ["Future", "Scheduler", "FutureTimeout"]
+
+
+class FutureTimeout(Exception):
+    pass
+
+
+class Future(object):
+
+    """The result of a job which may not have completed yet."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def done(self):
+        """Return True if the job has completed (successfully or not)."""
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        """Wait for the job to complete (at most 'timeout' seconds) and return
+        its result, or raise the exception raised by the job."""
+        if not self._event.wait(timeout):
+            raise FutureTimeout("The job has not completed in %s s."
+                                % timeout)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        """Wait for the job to complete (see result) and return the exception
+        raised by the job, or None."""
+        if not self._event.wait(timeout):
+            raise FutureTimeout("The job has not completed in %s s."
+                                % timeout)
+        return self._exception
+
+    def add_done_callback(self, fn):
+        """Call fn(future) when the job completes (immediately if it already
+        has)."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def set_result(self, result):
+        self._set(result, None)
+
+    def set_exception(self, exception):
+        self._set(None, exception)
+
+    def _set(self, result, exception):
+        with self._lock:
+            self._result = result
+            self._exception = exception
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            fn(self)
+
+
+class Scheduler(object):
+
+    """Runs the submitted jobs, in order, on at most 'max_workers' threads,
+    which are started when needed."""
+
+    def __init__(self, max_workers):
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1.")
+        self.max_workers = max_workers
+        self._condition = threading.Condition()
+        self._queue = collections.deque()
+        self._pending = {}
+        self._workers = []
+        self._idle = 0
+        self._shutdown = False
+
+    def submit(self, key, fn, *args, **kwargs):
+        """Schedule fn(*args, **kwargs) and return its Future. If a job with
+        the same key (unless None) is queued or running, return its Future
+        instead."""
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("Cannot submit jobs after shutdown.")
+            if key is not None and key in self._pending:
+                return self._pending[key]
+            future = Future()
+            if key is not None:
+                self._pending[key] = future
+            self._queue.append((key, future, fn, args, kwargs))
+            if not self._start_workers():
+                self._condition.notify()
+        return future
+
+    def _start_workers(self):
+        # Starts the workers needed for the queued jobs, within the limit.
+        # Returns True if any was started. Called holding the lock
+        started = False
+        while (len(self._queue) > self._idle and
+               len(self._workers) < self.max_workers):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            self._workers.append(worker)
+            worker.start()
+            # Counted as idle until it takes a job
+            self._idle += 1
+            started = True
+        return started
+
+    def resize(self, max_workers):
+        """Change the maximum number of workers. The jobs in progress and
+        their keys are kept: submitting a job identical to one of them still
+        returns its Future."""
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1.")
+        with self._condition:
+            self.max_workers = max_workers
+            self._start_workers()
+            # The workers in excess stop when they are idle
+            self._condition.notify_all()
+
+    def get_pending(self, key):
+        """Return the Future of the queued or running job with the given
+        key, or None."""
+        with self._condition:
+            return self._pending.get(key)
+
+    def _work(self):
+        this = threading.current_thread()
+        while True:
+            with self._condition:
+                while (len(self._queue) == 0 and not self._shutdown and
+                       len(self._workers) <= self.max_workers):
+                    self._condition.wait()
+                if (len(self._queue) == 0 or
+                        len(self._workers) > self.max_workers):
+                    self._idle -= 1
+                    self._workers.remove(this)
+                    # Pass on the wake up, in case it was meant for a job
+                    self._condition.notify()
+                    return
+                self._idle -= 1
+                key, future, fn, args, kwargs = self._queue.popleft()
+            result, exception = None, None
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as ex:
+                # Including e.g. KeyboardInterrupt and SystemExit, which are
+                # raised again by Future.result in the waiting threads
+                exception = ex
+            finally:
+                # Forget the key first, so that the jobs submitted from now
+                # on are run again
+                with self._condition:
+                    if key is not None:
+                        del self._pending[key]
+                    self._idle += 1
+                if exception is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(exception)
+
+    def shutdown(self, wait=True):
+        """Stop accepting jobs. The queued jobs are still run; with wait=True,
+        wait for them to complete."""
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+            workers = list(self._workers)
+        if wait:
+            for worker in workers:
+                worker.join()
@@ -0,0 +1,297 @@
+# oommf-python
+# Copyright (C) 2016 University of Southampton
+#
+# CONTACT: h.fangohr@soton.ac.uk
+
+'''
+This module provides SnapshotStore, a container for a sequence of snapshots
+of a field (e.g. the magnetisation saved at each step of a simulation) as an
+alternative to one OVF file per snapshot.
+
+The store is a directory containing a JSON index and the data, split in
+chunks of 'chunk_steps' consecutive snapshots and 'chunk_shape' nodes. Each
+chunk is saved compressed (numpy .npz), which is very effective for the
+mostly uniform fields typical of micromagnetics. Reading a time or space
+slice only decompresses the chunks which intersect it. The default chunks
+(16 snapshots of up to 256 x 256 x 4 nodes) keep a whole thin film in one
+file for every 16 snapshots, while reading a single snapshot decompresses
+at most 16 x 3 x 256 x 256 x 4 values (100 MB with float64 data). Use
+smaller chunks for faster random access to single snapshots or small
+subvolumes, and larger ones for fewer files.
+
+The index is written by flush and close: snapshots appended since the last
+call are not part of the store if the process stops before. Example:
+
+  store = SnapshotStore("run.snapshots")
+  for filename in omf_files:
+      store.append(OVFFile(filename).get_field(), time=...)
+  store.close()
+
+  mz = SnapshotStore("run.snapshots").read(steps=slice(0, 100),
+                                           cells=[(10, 20), None, None])[:, 2]
+
+The functions ovf_to_store and SnapshotStore.to_ovf convert from and to OVF.
+'''
+
+from __future__ import division, unicode_literals
+import json
+import numbers
+import os
+import re
+
+import numpy
+
+from lattice import FieldLattice, Lattice
+from ovf import OVFFile, OVF20, check_cell_ranges, scan_header
+from ovfcatalogue import save_json
+
+__all__ = ["SnapshotStore", "ovf_to_store"]
+
+
+class SnapshotStore(object):
+
+    """Sequence of snapshots of a field defined over a fixed 3D lattice,
+    saved in compressed chunks in a directory."""
+
+    index_name = "index.json"
+
+    def __init__(self, directory, chunk_steps=16, chunk_shape=(256, 256, 4),
+                 dtype=None):
+        """Open the store in the given directory, creating it if it does not
+        exist. The other arguments are only used for new stores: the number
+        of snapshots and the number of nodes along x, y and z in each chunk
+        and the data type of the stored values (by default the data type of
+        the first snapshot)."""
+        self.directory = directory
+        self.index_path = os.path.join(directory, self.index_name)
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+        else:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self.index = {"chunk_steps": int(chunk_steps),
+                          "chunk_shape": [int(n) for n in chunk_shape],
+                          "dtype": (None if dtype is None
+                                    else numpy.dtype(dtype).str),
+                          "lattice": None, "field_dim": None,
+                          "num_snapshots": 0, "times": []}
+
+        # Snapshots appended, but not saved yet. They always belong to the
+        # last time chunk, whose saved snapshots are loaded back on append.
+        self._buffer = []
+        self._buffer_start = self.index["num_snapshots"]
+
+    def _get_num_snapshots(self):
+        return self._buffer_start + len(self._buffer)
+
+    num_snapshots = property(_get_num_snapshots, None, None,
+                             "Number of snapshots in the store.")
+
+    def __len__(self):
+        return self.num_snapshots
+
+    def _get_times(self):
+        return list(self.index["times"])
+
+    times = property(_get_times, None, None,
+                     "The time of each snapshot (None if not given).")
+
+    def _get_lattice(self):
+        spec = self.index["lattice"]
+        return None if spec is None else Lattice(spec)
+
+    lattice = property(_get_lattice, None, None,
+                       "The Lattice of the snapshots.")
+
+    def append(self, field, time=None):
+        """Append a snapshot, given as a FieldLattice defined over a 3D
+        lattice. All the snapshots must be defined over the same lattice."""
+        data = field.field_data
+        idx = self.index
+        if idx["lattice"] is None:
+            idx["lattice"] = [list(mmn) for mmn in
+                              field.lattice.min_max_num_list]
+            idx["field_dim"] = field.field_dim
+            if idx["dtype"] is None:
+                idx["dtype"] = data.dtype.newbyteorder("=").str
+        shape = (idx["field_dim"],) + tuple(n for _, _, n in idx["lattice"])
+        if tuple(data.shape) != shape:
+            raise ValueError("Expected a snapshot with shape %s, but got %s."
+                             % (shape, data.shape))
+
+        # Reload the saved part of an incomplete chunk, so that it is
+        # rewritten as a whole
+        chunk_steps = idx["chunk_steps"]
+        if len(self._buffer) == 0 and self._buffer_start % chunk_steps != 0:
+            first = self._buffer_start - self._buffer_start % chunk_steps
+            saved = self.read(steps=slice(first, self._buffer_start))
+            self._buffer = list(saved)
+            self._buffer_start = first
+
+        self._buffer.append(numpy.array(data, dtype=idx["dtype"]))
+        idx["times"].append(time)
+        if len(self._buffer) == chunk_steps:
+            self._save_buffer()
+
+    def flush(self):
+        """Save the appended snapshots and the index to disk."""
+        self._save_buffer()
+        self.index["num_snapshots"] = self.num_snapshots
+        save_json(self.index, self.index_path)
+
+    close = flush
+
+    def _save_buffer(self):
+        # Saves the chunks of the appended snapshots, but not the index,
+        # which is only written by flush
+        if len(self._buffer) > 0:
+            time_chunk = self._buffer_start // self.index["chunk_steps"]
+            block = numpy.array(self._buffer)
+            for chunk, cells in self._spatial_chunks():
+                (x0, x1), (y0, y1), (z0, z1) = cells
+                self._save_chunk(time_chunk, chunk,
+                                 block[:, :, x0:x1, y0:y1, z0:z1])
+            num_snapshots = self._buffer_start + len(self._buffer)
+            if num_snapshots % self.index["chunk_steps"] == 0:
+                self._buffer = []
+                self._buffer_start = num_snapshots
+
+    def _chunk_path(self, time_chunk, chunk):
+        return os.path.join(self.directory, "t%d_x%d_y%d_z%d.npz"
+                            % ((time_chunk,) + tuple(chunk)))
+
+    def _save_chunk(self, time_chunk, chunk, data):
+        path = self._chunk_path(time_chunk, chunk)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            numpy.savez_compressed(f, data=data)
+        os.rename(tmp_path, path)
+
+    def _load_chunk(self, time_chunk, chunk):
+        with numpy.load(self._chunk_path(time_chunk, chunk)) as f:
+            return f["data"]
+
+    def _spatial_chunks(self, cells=None):
+        """Return the list of (chunk, cells) for the spatial chunks
+        intersecting the given subvolume, where 'chunk' is the index of the
+        chunk and 'cells' are the ranges of cells it covers."""
+        ranges = []
+        for i, (_, _, n) in enumerate(self.index["lattice"]):
+            cs = self.index["chunk_shape"][i]
+            start, stop = (0, n) if cells is None or cells[i] is None \
+                else cells[i]
+            ranges.append([(c, (c * cs, min(n, (c + 1) * cs)))
+                           for c in range(start // cs, (stop - 1) // cs + 1)])
+        return [((cx, cy, cz), (rx, ry, rz))
+                for cz, rz in ranges[2]
+                for cy, ry in ranges[1]
+                for cx, rx in ranges[0]]
+
+    def _check_cells(self, cells):
+        return check_cell_ranges([n for _, _, n in self.index["lattice"]],
+                                 cells)
+
+    def read(self, steps=None, cells=None):
+        """Return the snapshots with the given indices (an integer, a slice
+        or a list, all the snapshots if None) restricted to the given cells
+        (a list of (start, stop) ranges of node indices, one for each
+        direction x, y, z, where None means all the nodes). The result has
+        shape (number of steps, field_dim, nx, ny, nz), without the first
+        axis if 'steps' is an integer. Only the chunks which intersect the
+        selection are read."""
+        n = self.num_snapshots
+        if isinstance(steps, numbers.Integral):
+            return self.read(steps=[steps], cells=cells)[0]
+        if steps is None:
+            steps = list(range(n))
+        elif isinstance(steps, slice):
+            steps = list(range(n))[steps]
+        else:
+            steps = [s + n if s < 0 else s for s in steps]
+        if any(not 0 <= s < n for s in steps):
+            raise IndexError("Snapshot index out of range.")
+        cells = self._check_cells(cells)
+        (x0, x1), (y0, y1), (z0, z1) = cells
+
+        out = numpy.empty((len(steps), self.index["field_dim"],
+                           x1 - x0, y1 - y0, z1 - z0),
+                          dtype=self.index["dtype"])
+
+        # Group the requested steps by time chunk
+        chunk_steps = self.index["chunk_steps"]
+        by_time_chunk = {}
+        for i, s in enumerate(steps):
+            by_time_chunk.setdefault(s // chunk_steps, []).append((i, s))
+
+        for time_chunk, items in by_time_chunk.items():
+            first = time_chunk * chunk_steps
+            for i, s in items:
+                if s >= self._buffer_start:
+                    out[i] = self._buffer[s - self._buffer_start][
+                        :, x0:x1, y0:y1, z0:z1]
+            saved = [(i, s - first) for i, s in items
+                     if s < self._buffer_start]
+            if len(saved) == 0:
+                continue
+            for chunk, chunk_cells in self._spatial_chunks(cells):
+                block = self._load_chunk(time_chunk, chunk)
+                # Intersection of the chunk and the requested cells, in the
+                # coordinates of the chunk and of the output
+                src, dst = [], []
+                for (c0, c1), (s0, s1) in zip(chunk_cells, cells):
+                    lo, hi = max(c0, s0), min(c1, s1)
+                    src.append(slice(lo - c0, hi - c0))
+                    dst.append(slice(lo - s0, hi - s0))
+                for i, s in saved:
+                    out[(i, slice(None)) + tuple(dst)] = \
+                        block[(s, slice(None)) + tuple(src)]
+        return out
+
+    def get_field(self, step, cells=None):
+        """Return the given snapshot (or a subvolume of it, see read) as a
+        FieldLattice."""
+        cells = self._check_cells(cells)
+        data = self.read(steps=step, cells=cells)
+        spec = []
+        for (mn, mx, n), (start, stop) in zip(self.index["lattice"], cells):
+            delta = (mx - mn) / (n - 1) if n > 1 else (mx - mn)
+            first = mn + start * delta
+            num = stop - start
+            spec.append((first, first + (num - 1 if num > 1 else 1) * delta,
+                         num))
+        return FieldLattice(spec, dim=self.index["field_dim"],
+                            data=numpy.asfortranarray(data), order="F")
+
+    def to_ovf(self, step, filename, version=OVF20, data_type="binary8"):
+        """Save the given snapshot as an OVF file."""
+        ovf_file = OVFFile()
+        ovf_file.new(self.get_field(step), version=version,
+                     data_type=data_type)
+        ovf_file.write(filename)
+
+
+def _ovf_time(filename):
+    """Return the simulation time in the Desc lines of the OVF file written
+    by OOMMF, or None."""
+    for desc in scan_header(filename)["desc"]:
+        m = re.match(r"\s*Total simulation time:\s*(\S+)", desc)
+        if m:
+            return float(m.group(1))
+    return None
+
+
+def ovf_to_store(filenames, directory, **kwargs):
+    """Append the fields in the given OVF files (all their segments) to the
+    SnapshotStore in 'directory', which is created if needed. The time of
+    each snapshot is taken from the "Total simulation time" written by OOMMF
+    in the header, if available. The other keyword arguments are passed to
+    SnapshotStore. Return the store."""
+    store = SnapshotStore(directory, **kwargs)
+    for filename in filenames:
+        time = _ovf_time(filename)
+        ovf_file = OVFFile(filename, lazy=True, mmap=True)
+        for i in range(ovf_file.get_num_segments()):
+            store.append(ovf_file.get_field(segment=i), time=time)
+    store.close()
+    return store
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+import demag
+from demag import Demag, MU0
+from mesh import Mesh
+from resultcache import MemoCache, ResultCache
+
+
+def direct_demag(m, Ms):
+    """Demag field by direct summation over all the pairs of cells."""
+    mesh = m.mesh
+    ranges = [np.arange(-n + 1, n) for n in mesh.mesh_size]
+    tensor = demag._tensor_for_offsets(ranges, mesh.cell_size)
+    full = np.empty((3, 3) + tensor.shape[1:])
+    for c, (i, j) in enumerate([(0, 0), (1, 1), (2, 2),
+                                (0, 1), (0, 2), (1, 2)]):
+        full[i, j] = full[j, i] = tensor[c]
+    m_xyz = m.to_xyz_array()
+    h = np.zeros(m_xyz.shape)
+    nx, ny, nz = mesh.mesh_size
+    for i in range(nx):
+        for j in range(ny):
+            for k in range(nz):
+                n = full[:, :, nx - 1 + i::-1, ny - 1 + j::-1,
+                         nz - 1 + k::-1][:, :, :nx, :ny, :nz]
+                h[:, i, j, k] = -Ms * np.einsum("abxyz,bxyz->a", n, m_xyz)
+    return h
+
+
+@pytest.mark.parametrize("order", [Mesh.ZYX, Mesh.XYZ])
+@pytest.mark.parametrize("size", [(3, 2, 5), (4, 3, 1)])
+def test_demag_convolution(order, size):
+    mesh = Mesh(size, cellsize=(2e-9, 3e-9, 1e-9), array_order=order)
+    m = np.random.RandomState(1).uniform(-1, 1, (3, mesh.n))
+    m /= np.sqrt(np.sum(m * m, axis=0))
+    m = mesh.field_from_array(m)
+    h = Demag(mesh, cache_dir=None).field(m, 8e5)
+    assert np.allclose(h.to_xyz_array(), direct_demag(m, 8e5))
+
+
+def test_demag_cube():
+    mesh = Mesh((4, 4, 4), cellsize=(1e-9, 1e-9, 1e-9))
+    m = mesh.new_field(3)
+    m.flat[0] = 1
+    h, e = demag.demag(m, 1e6, energy=True, cache_dir=None)
+    assert np.allclose(np.mean(h.flat, axis=1), [-1e6 / 3, 0, 0])
+    assert np.allclose(np.mean(e.flat), MU0 / 6 * 1e12)
+
+
+def test_demag_periodic_film():
+    mesh = Mesh((4, 4, 1), cellsize=(2e-9, 2e-9, 1e-9))
+    m = mesh.new_field(3)
+    m.flat[2] = 1
+    h = Demag(mesh, periodic=(True, True, False), cache_dir=None).field(m, 1)
+    assert np.allclose(h.flat[2], h.flat[2, 0])
+    assert -1 < h.flat[2, 0] < -0.95
+    assert np.allclose(h.flat[:2], 0)
+
+
+def test_demag_cache(tmpdir, monkeypatch):
+    cache_dir = str(tmpdir)
+    mesh = Mesh((3, 2, 1), cellsize=(1e-9, 1e-9, 1e-9))
+    m = mesh.new_field(3)
+    m.flat[1] = 1
+    h = Demag(mesh, cache_dir=cache_dir).field(m, 1)
+    assert len(ResultCache(cache_dir)) == 1
+
+    # Both the memory and the disk cache avoid recomputing the tensor
+    def fail(*args):
+        raise AssertionError("The tensor should not be recomputed.")
+    monkeypatch.setattr(demag, "demag_tensor", fail)
+    assert np.array_equal(Demag(mesh, cache_dir=cache_dir).field(m, 1).flat,
+                          h.flat)
+    demag._memory_cache.clear()
+    assert np.allclose(Demag(mesh, cache_dir=cache_dir).field(m, 1).flat,
+                       h.flat)
+
+    # Tensors larger than the memory budget are only cached on disk
+    monkeypatch.setattr(demag, "_memory_cache", MemoCache(max_bytes=100))
+    Demag(mesh, cache_dir=cache_dir).field(m, 1)
+    assert len(demag._memory_cache) == 0
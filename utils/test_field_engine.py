@@ -0,0 +1,81 @@
+import numpy as np
+
+import field_engine
+from field_engine import MU0
+from mesh import Mesh
+
+
+def random_magnetisation(mesh, seed=0):
+    m = np.random.RandomState(seed).uniform(-1, 1, (3, mesh.n))
+    m /= np.sqrt(np.sum(m * m, axis=0))
+    return mesh.field_from_array(m)
+
+
+def test_zeeman_and_dmdt():
+    mesh = Mesh((3, 2, 1), cellsize=(1e-9, 1e-9, 1e-9))
+    m = random_magnetisation(mesh)
+    H = [1e5, -2e5, 3e4]
+    field, e = field_engine.fixed_zeeman(m, 8e5, H, energy=True)
+    assert np.allclose(field.flat, np.reshape(H, (3, 1)))
+    assert np.allclose(e.flat[0], -MU0 * 8e5 * np.dot(H, m.flat))
+
+    s = mesh.new_field(3)
+    s.flat[0] = 1
+    d = field_engine.dmdt(s, 8e5, 1e-11, (0, 0, 1e5), 0.0, 2.21e5)
+    assert np.allclose(d.flat.T, [0, 2.21e5 * 1e5, 0])
+    d = field_engine.dmdt(m, 8e5, 1e-11, H, 0.5, 2.21e5)
+    assert np.allclose(np.sum(d.flat * m.flat, axis=0) / 1e10, 0)
+
+
+def test_exchange():
+    mesh = Mesh((20, 2, 1), cellsize=(2e-9, 1e-9, 1e-9))
+    x = mesh.get_coords(layout="ao").reshape((3, -1))[0]
+    k = 2 * np.pi / 40e-9
+    m = mesh.field_from_array(np.array([np.cos(k * x), np.sin(k * x),
+                                        0 * x]))
+    A, Ms, h = 1.3e-11, 8.6e5, 2e-9
+    field, e = field_engine.uniform_exchange(m, Ms, A, boundary="periodic",
+                                             energy=True)
+    factor = (2 * np.cos(k * h) - 2) / h ** 2
+    assert np.allclose(field.flat, 2 * A / (MU0 * Ms) * factor * m.flat)
+    assert np.allclose(e.flat, -A * factor)
+
+    # A uniform magnetisation has no exchange field
+    m.flat[:] = [[0.6], [0], [0.8]]
+    assert np.allclose(field_engine.uniform_exchange(m, Ms, A).flat, 0)
+
+
+def test_uniaxial_anisotropy():
+    mesh = Mesh((2, 2, 2), cellsize=(1e-9, 1e-9, 1e-9))
+    m = random_magnetisation(mesh)
+    axis = np.array([0, 0.6, 0.8])
+    field, e = field_engine.uniaxial_anisotropy(m, 8e5, 5e4, axis * 2,
+                                                energy=True)
+    mu = np.dot(axis, m.flat)
+    assert np.allclose(field.flat, 2 * 5e4 / (MU0 * 8e5) * np.outer(axis, mu))
+    assert np.allclose(e.flat[0], 5e4 * (1 - mu * mu))
+    _, e = field_engine.uniaxial_anisotropy(m, 8e5, -5e4, axis, energy=True)
+    assert np.allclose(e.flat[0], 5e4 * mu * mu)
+
+
+def test_cubic_anisotropy():
+    mesh = Mesh((2, 2, 1), cellsize=(1e-9, 1e-9, 1e-9))
+    m = random_magnetisation(mesh)
+    u1, u2 = (1, 1, 0), (-1, 1, 0)
+    Ms, K = 8e5, (4.8e4, -1e4, 2e3)
+    field, e = field_engine.cubic_anisotropy(m, Ms, u1, u2, *K, energy=True)
+
+    # The field is minus the gradient of the energy with respect to m
+    eps = 1e-7
+    for i in range(3):
+        mp = m.copy()
+        mp.flat[i] += eps
+        _, ep = field_engine.cubic_anisotropy(mp, Ms, u1, u2, *K,
+                                              energy=True)
+        assert np.allclose(field.flat[i], -(ep.flat - e.flat)[0] /
+                           (eps * MU0 * Ms), rtol=1e-4, atol=1e-3)
+
+    # No field along the easy axes
+    m.flat[:] = np.reshape(u1, (3, 1)) / np.sqrt(2)
+    assert np.allclose(field_engine.cubic_anisotropy(m, Ms, u1, u2,
+                                                     *K).flat, 0)
@@ -322,3 +322,133 @@ def test_field_lattice_set():
     # check that the strides are different (check help(numpy.ndarray))
     assert flc.field_data.strides != flf.field_data.strides
 
+
+@pytest.mark.parametrize("order", ["C", "F"])
+def test_field_lattice_set_vectorized(order):
+    spec = [[0, 5, 6], [-2, -1, 2], [3, 3, 1]]
+
+    def point_setter(pos):
+        x, y, z = pos
+        return [x * y, y + z, 1.0]
+
+    expected = lattice.FieldLattice(lattice.Lattice(spec, order=order))
+    expected.set(point_setter)
+
+    fl = lattice.FieldLattice(lattice.Lattice(spec, order=order))
+    fl.set(lambda x, y, z: [x * y, y + z, 1.0], mode="axes")
+    assert np.allclose(fl.field_data, expected.field_data)
+
+    fl = lattice.FieldLattice(lattice.Lattice(spec, order=order))
+    fl.set(lambda pos: [pos[0] * pos[1], pos[1] + pos[2], 1.0], mode="grid")
+    assert np.allclose(fl.field_data, expected.field_data)
+
+    with pytest.raises(ValueError):
+        fl.set(lambda x, y, z: [x, y], mode="axes")
+    with pytest.raises(ValueError):
+        fl.set(point_setter, mode="points")
+
+
+def test_lattice_coordinates():
+    l = lattice.Lattice([[0, 10, 6], [0.25, 0.25, 1], [-1, 1, 3]])
+    x, y, z = l.get_coordinates()
+    assert x.shape == y.shape == z.shape == (6, 1, 3)
+    assert x.strides[1:] == (0, 0)
+    assert np.allclose(x[:, 0, 0], np.linspace(0, 10, 6))
+    assert np.all(y == 0.25)
+    assert np.allclose(z[2, 0, :], [-1, 0, 1])
+
+    # A single node gives a single position
+    assert np.allclose(l.get_positions()[:, :, 0, 1], 0.25)
+    flat = l.get_positions(flat=True)
+    assert flat.shape == (18, 3)
+    assert np.allclose(flat[:3], [[0, 0.25, -1], [0, 0.25, 0], [0, 0.25, 1]])
+
+
+@pytest.mark.parametrize("order", ["C", "F"])
+def test_lattice_iter_positions(order):
+    l = lattice.Lattice([[0, 5, 6], [-2, -1, 2], [3, 4, 2]], order=order)
+    visited = []
+    l.foreach(lambda idx, pos: visited.append(list(pos)))
+    chunks = list(l.iter_positions(chunk_size=5))
+    assert [(start, stop) for start, stop, _ in chunks] == \
+        [(0, 5), (5, 10), (10, 15), (15, 20), (20, 24)]
+    assert np.allclose(np.concatenate([ps for _, _, ps in chunks]), visited)
+
+
+@pytest.mark.parametrize("order", ["C", "F"])
+def test_lattice_batched_queries(order):
+    l = lattice.Lattice([[0, 10, 6], [-3, 1, 2], [0.5, 0.5, 1]], order=order)
+    positions = np.array([[0.1, -3, 7], [3.9, 0.8, 0.5], [-4, 5, 0.5],
+                          [10.9, -1.2, 0.5]])
+    idx, inside = l.get_closest_array(positions, return_mask=True)
+    assert np.array_equal(idx, [[0, 0, 0], [2, 1, 0], [0, 1, 0], [5, 0, 0]])
+    assert list(inside) == [True, True, False, True]
+    for p, i in zip(positions[inside], idx[inside]):
+        assert l.get_closest(p) == list(i)
+    assert np.array_equal(l.get_closest_array(positions, clamp=False)[2],
+                          [-2, 2, 0])
+
+    # Arbitrary leading shapes are preserved
+    lines = positions.reshape((2, 2, 3))
+    assert l.get_closest_array(lines).shape == (2, 2, 3)
+
+    pos = l.get_pos_from_idx_array(idx)
+    for p, i in zip(pos, idx):
+        assert np.allclose(p, l.get_pos_from_idx(list(i)))
+
+    flat = l.get_flat_idx(idx)
+    assert np.array_equal(flat, [np.ravel_multi_index(tuple(i), (6, 2, 1),
+                                                      order=order)
+                                 for i in idx])
+    assert np.array_equal(l.get_idx_from_flat(flat), idx)
+    with pytest.raises(ValueError):
+        l.get_flat_idx([[6, 0, 0]])
+    with pytest.raises(ValueError):
+        l.get_closest_array([[1, 2]])
+
+
+@pytest.mark.parametrize("order", ["C", "F"])
+def test_field_lattice_interpolate(order):
+    spec = [[0, 5, 6], [-2, 2, 5], [1, 2, 3]]
+    fl = lattice.FieldLattice(lattice.Lattice(spec, order=order))
+    fl.set(lambda x, y, z: [x + 2 * y - z, x * x + y * y, 3 + 0 * x],
+           mode="axes")
+
+    points = np.array([[0.3, -1.7, 1.2], [4.5, 1.9, 1.75], [2.5, 0.25, 1.5]])
+    value = fl.interpolate(points, order="linear")
+    assert value.shape == (3, 3)
+    x, y, z = points.T
+    assert np.allclose(value[:, 0], x + 2 * y - z)
+    assert np.allclose(value[:, 2], 3)
+
+    # Catmull-Rom splines are exact for quadratics away from the boundary
+    value = fl.interpolate(points[2:], order="cubic")
+    assert np.allclose(value[:, 1], 2.5 ** 2 + 0.25 ** 2)
+    assert np.allclose(value[:, 0], 2.5 + 0.5 - 1.5)
+
+    idx = fl.lattice.get_closest_array(points)
+    nearest = fl.interpolate(points.reshape((1, 3, 3)), order="nearest")
+    assert nearest.shape == (1, 3, 3)
+    for i, value in zip(idx, nearest[0]):
+        expected = (fl.field_data[:, i[0], i[1], i[2]] if order == "F"
+                    else fl.field_data[i[0], i[1], i[2]])
+        assert np.allclose(value, expected)
+
+    # Points outside the lattice are clamped to the boundary
+    assert np.allclose(fl.interpolate([[-1, -3, 0]]),
+                       fl.interpolate([[0, -2, 1]]))
+    with pytest.raises(ValueError):
+        fl.interpolate(points, order="quadratic")
+
+
+@pytest.mark.parametrize("order", ["nearest", "linear", "cubic"])
+def test_field_lattice_resample(order):
+    fl = lattice.FieldLattice("0,5,6/-2,2,5/1,2,3")
+    fl.set(lambda x, y, z: [x * y, y - z, x * x], mode="axes")
+    fine = lattice.Lattice("0,5,11/-2,2,9/0.5,2.5,5", order="C")
+    resampled = fl.resample(fine, order=order)
+    assert resampled.field_data.shape == (11, 9, 5, 3)
+    assert resampled.field_data.flags["C_CONTIGUOUS"]
+    points = np.stack(fine.get_coordinates(), axis=-1)
+    assert np.allclose(resampled.field_data,
+                       fl.interpolate(points, order=order))
@@ -1,3 +1,4 @@
+import io
 import unittest
 import numpy as np
 import mesh
@@ -45,3 +46,116 @@ class TestIterCoords(unittest.TestCase):
         coords = [r for r in m.iter_coords()]
         expected = [[0.5, 0.5, 0.5], [1.5, 0.5, 0.5], [2.5, 0.5, 0.5]]
         assert np.array_equal(expected, coords)
+
+
+class TestDifferentialOperators(unittest.TestCase):
+
+    orders = [mesh.Mesh.ZYX, mesh.Mesh.XYZ, mesh.Mesh.ZXY]
+
+    def test_neighbours(self):
+        m = mesh.Mesh((3, 2, 1), cellsize=(1, 1, 1))
+        # ZYX order: the flat index is x + 3 * y
+        assert np.array_equal(m.get_neighbours(0, 1), [1, 2, 2, 4, 5, 5])
+        assert np.array_equal(m.get_neighbours(0, -1, "periodic"),
+                              [2, 0, 1, 5, 3, 4])
+        assert np.array_equal(m.get_neighbours(1, 1), [3, 4, 5, 3, 4, 5])
+        assert np.array_equal(m.get_neighbours(2, 1), np.arange(6))
+        assert m.get_neighbours(0, 1) is m.get_neighbours(0, 1)
+
+        assert np.array_equal(m.get_boundary_mask(0, -1),
+                              [1, 0, 0, 1, 0, 0])
+        assert np.array_equal(m.get_boundary_mask(0), [1, 0, 1, 1, 0, 1])
+        assert m.get_boundary_mask(2).all()
+
+    def test_periodic(self):
+        for order in self.orders:
+            m = mesh.Mesh((16, 4, 2), cellsize=(0.5, 1, 1), array_order=order)
+            x = m.get_coords()[0]
+            k = 2 * np.pi / 8.0
+            h = m.cell_size[0]
+            f = m.field_from_xyz_array(np.array([np.sin(k * x)]))
+
+            lap = f.laplacian(boundary="periodic").to_xyz_array()[0]
+            assert np.allclose(lap, (2 * np.cos(k * h) - 2) / h ** 2 *
+                               np.sin(k * x))
+            grad = f.gradient(boundary="periodic").to_xyz_array()
+            assert grad.shape == (3, 1, 16, 4, 2)
+            assert np.allclose(grad[0, 0], np.sin(k * h) / h * np.cos(k * x))
+            assert np.allclose(grad[1:], 0)
+
+    def test_neumann(self):
+        for order in self.orders:
+            m = mesh.Mesh((5, 4, 3), cellsize=(1, 2, 3), array_order=order)
+            xyz = m.get_coords()
+            f = m.field_from_xyz_array(xyz)
+            interior = ~m.get_boundary_mask()
+
+            div = f.divergence()
+            assert div.dims == (1,)
+            assert np.allclose(div.flat[0, interior], 3)
+            # Zero normal derivative at the boundary
+            assert np.allclose(div.flat[0, m.get_boundary_mask()].max(), 2.5)
+
+            lap = f.laplacian()
+            assert np.allclose(lap.flat[:, interior], 0)
+            lower_x = m.get_boundary_mask(0, -1)
+            assert np.allclose(lap.flat[0, lower_x], 1)
+
+
+class TestCoordArrays(unittest.TestCase):
+
+    def test_layouts(self):
+        for order in [mesh.Mesh.ZYX, mesh.Mesh.XYZ, mesh.Mesh.ZXY]:
+            m = mesh.Mesh((3, 2, 4), cellsize=(1, 2, 0.5),
+                          origin=(-1, 0, 1), array_order=order)
+            coords = m.get_coords(layout="ao")
+            assert coords.shape == (3,) + tuple(m.mesh_size_ao)
+            assert np.array_equal(coords.reshape((3, -1)).T,
+                                  list(m.iter_coords()))
+            assert np.array_equal(m.get_coords_int("ao").reshape((3, -1)).T,
+                                  list(m.iter_coords_int()))
+
+            # The xyz layout is the one of MeshField.to_xyz_array
+            xyz = m.get_coords()
+            assert xyz.shape == (3, 3, 2, 4)
+            assert np.array_equal(
+                m.field_from_array(coords).to_xyz_array(), xyz)
+            assert np.array_equal(xyz[:, 2, 1, 3], [1.5, 3, 2.75])
+
+            chunks = list(m.iter_coords_chunks(chunk_size=5))
+            assert [c.shape[1] for _, _, c in chunks] == [5] * 4 + [4]
+            assert np.array_equal(np.hstack([c for _, _, c in chunks]),
+                                  coords.reshape((3, -1)))
+
+
+class TestFieldLatticeAdapter(unittest.TestCase):
+
+    def test_zero_copy(self):
+        for order in [mesh.Mesh.ZYX, mesh.Mesh.XYZ, mesh.Mesh.ZXY]:
+            m = mesh.Mesh((4, 3, 1), cellsize=(1, 2, 3), origin=(0, 1, 2),
+                          array_order=order)
+            f = m.field_from_array(m.get_coords(layout="ao"))
+            fl = f.to_field_lattice()
+            assert np.may_share_memory(fl.field_data, f.flat)
+            assert np.array_equal(fl.field_data, m.get_coords())
+            assert fl.lattice.min_max_num_list == [(0.5, 3.5, 4),
+                                                   (2, 6, 3), (3.5, 6.5, 1)]
+
+            g = m.field_from_field_lattice(fl)
+            assert np.may_share_memory(g.flat, f.flat)
+            assert np.array_equal(g.flat, f.flat)
+
+    def test_ovf_round_trip(self):
+        import ovf
+        for order in [mesh.Mesh.ZYX, mesh.Mesh.XYZ, mesh.Mesh.ZXY]:
+            m = mesh.Mesh((4, 3, 2), cellsize=(1, 2, 3), array_order=order)
+            f = m.field_from_array(m.get_coords(layout="ao"))
+            ovf_file = ovf.OVFFile()
+            ovf_file.new(f.to_field_lattice(), version=ovf.OVF10)
+            stream = io.BytesIO()
+            ovf_file.write(ovf.OVFStream(stream, mode="w"))
+            stream.seek(0)
+            fl = ovf.OVFFile(ovf.OVFStream(stream)).get_field()
+            assert np.allclose(fl.lattice.min_max_num_list,
+                               m.get_lattice_spec())
+            assert np.array_equal(m.field_from_field_lattice(fl).flat, f.flat)
@@ -0,0 +1,212 @@
+import os
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+if sys.version_info[0] > 2:
+    pytest.skip("oommf_calculator requires Python 2", allow_module_level=True)
+
+import oommf_calculator as oc
+from mesh import Mesh
+from resultcache import MemoCache, ResultCache
+from scheduler import Scheduler
+
+FAKE_OOMMF = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "fakeoommf.py")
+FIELDS = ["Oxs_TimeDriver::Spin", "Oxs_Demag::Field"]
+
+
+class FakeOOMMF(object):
+
+    """Runs the calculator with fakeoommf.py, counting the runs."""
+
+    def __init__(self, tmpdir, monkeypatch):
+        self.log = tmpdir.join("runs.log")
+        self.tmpdir = tmpdir
+        self.monkeypatch = monkeypatch
+        self.set_command()
+        monkeypatch.setattr(oc, "RUN_DIR", str(tmpdir.mkdir("run")))
+        monkeypatch.setattr(oc, "CACHE", ResultCache(str(tmpdir.join("c"))))
+        monkeypatch.setattr(oc, "MEMO", MemoCache(max_entries=16))
+        monkeypatch.setattr(oc, "SCHEDULER", Scheduler(1))
+        monkeypatch.setattr(oc, "PROCESSES", 1)
+        monkeypatch.setattr(oc, "THREADS", 1)
+
+    def set_command(self, delay=0, fail=False):
+        script = self.tmpdir.join("oommf")
+        script.write("#!/bin/sh\n"
+                     "echo \"$@\" >> %s\n"
+                     "sleep %s\n"
+                     "%s\n"
+                     "exec %s %s \"$@\"\n"
+                     % (self.log, delay, "exit 1" if fail else "",
+                        sys.executable, FAKE_OOMMF))
+        script.chmod(0o755)
+        self.monkeypatch.setattr(oc, "OOMMF_COMMAND", str(script))
+
+    def runs(self):
+        return len(self.log.readlines()) if self.log.exists() else 0
+
+
+@pytest.fixture
+def fake(tmpdir, monkeypatch):
+    return FakeOOMMF(tmpdir, monkeypatch)
+
+
+def states(n):
+    mesh = Mesh((3, 2, 1), cellsize=(1e-9, 1e-9, 1e-9))
+    res = []
+    for i in range(n):
+        s0 = mesh.new_field(3)
+        s0.flat[0] = 1
+        s0.flat[1, 0] = i
+        res.append(s0)
+    return res
+
+
+def check(fields, s0):
+    assert np.array_equal(fields["Oxs_TimeDriver-Spin"].flat, s0.flat)
+    assert not fields["Oxs_Demag-Field"].flat.any()
+
+
+def test_calculate_cached(fake):
+    s0, = states(1)
+    fields = oc.calculate_oommf_fields("t", s0, 8e5, "spec", fields=FIELDS)
+    check(fields, s0)
+    assert fake.runs() == 1
+
+    # From memory: the same read-only arrays
+    again = oc.calculate_oommf_fields("t", s0, 8e5, "spec", fields=FIELDS)
+    check(again, s0)
+    assert np.may_share_memory(again["Oxs_TimeDriver-Spin"].flat,
+                               fields["Oxs_TimeDriver-Spin"].flat)
+    assert not again["Oxs_TimeDriver-Spin"].flat.flags.writeable
+
+    # From disk
+    oc.MEMO.clear()
+    check(oc.calculate_oommf_fields("t", s0, 8e5, "spec", fields=FIELDS),
+          s0)
+    assert oc.CACHE.stats["hits"] == 1
+    assert fake.runs() == 1
+
+    # Any change of the parameters is a different calculation
+    oc.calculate_oommf_fields("t", s0, 8e5, "spec", alpha=0.5, fields=FIELDS)
+    assert fake.runs() == 2
+    # The run directories are removed
+    assert os.listdir(oc.RUN_DIR) == []
+
+
+def test_batch(fake):
+    a, b, c = states(3)
+    batch = [a, b, a.copy(), c, b]
+    results = oc.calculate_oommf_fields_batch("t", batch, 8e5, "spec",
+                                              fields=FIELDS)
+    assert len(results) == 5
+    for fields, s0 in zip(results, batch):
+        check(fields, s0)
+    # Identical states are calculated once and share their fields
+    assert fake.runs() == 3
+    assert results[0]["Oxs_TimeDriver-Spin"] is \
+        results[2]["Oxs_TimeDriver-Spin"]
+
+    d, = states(4)[3:]
+    results = oc.calculate_oommf_fields_batch("t", [d, a], 8e5, "spec",
+                                              fields=FIELDS)
+    check(results[0], d)
+    check(results[1], a)
+    assert fake.runs() == 4
+
+
+def test_submit_parallel(fake):
+    fake.set_command(delay=0.3)
+    oc.set_parallelism(4, threads=2)
+    assert oc.SCHEDULER.max_workers == 4 and oc.THREADS == 2
+    batch = states(4)
+    futures = [oc.submit_oommf_fields("t", s0, 8e5, "spec", fields=FIELDS)
+               for s0 in batch]
+    # Identical calculations in progress are not repeated, also when
+    # calculated synchronously
+    assert oc.submit_oommf_fields("t", batch[0], 8e5, "spec",
+                                  fields=FIELDS) is futures[0]
+    results = []
+    thread = threading.Thread(target=lambda: results.append(
+        oc.calculate_oommf_fields("t", batch[1], 8e5, "spec",
+                                  fields=FIELDS)))
+    thread.start()
+    # s0 is copied at submission
+    batch[2].flat[2] = 1
+    for future, s0 in zip(futures, states(4)):
+        check(future.result(timeout=10), s0)
+    thread.join()
+    check(results[0], batch[1])
+    assert fake.runs() == 4
+    assert all("-threads 2" in line for line in fake.log.readlines())
+
+    with pytest.raises(ValueError):
+        oc.set_parallelism(0)
+
+
+def test_failure(fake):
+    s0, = states(1)
+    fake.set_command(fail=True)
+    with pytest.raises(Exception) as info:
+        oc.calculate_oommf_fields("t", s0, 8e5, "spec", fields=FIELDS)
+    assert "OOMMF invocation failed" in str(info.value)
+    assert len(oc.CACHE) == 0 and len(oc.MEMO) == 0
+
+    # Nothing is left pending: the calculation is run again
+    fake.set_command()
+    check(oc.calculate_oommf_fields("t", s0, 8e5, "spec", fields=FIELDS),
+          s0)
+    assert fake.runs() == 2
+
+
+def test_workers(fake, tmpdir, monkeypatch):
+    log = tmpdir.join("workers.log")
+    monkeypatch.setenv("FAKEOOMMF_LOG", str(log))
+    monkeypatch.setenv("OOMMF_WORKER_COMMAND",
+                       "'%s' '%s' worker" % (sys.executable, FAKE_OOMMF))
+    monkeypatch.setattr(oc, "WORKERS", False)
+    monkeypatch.setattr(oc, "WORKER_MAX_JOBS", 100)
+    monkeypatch.setattr(oc, "POOL", None)
+    oc.use_workers(max_jobs=2)
+    try:
+        batch = states(3)
+        results = oc.calculate_oommf_fields_batch("t", batch, 8e5, "spec",
+                                                  fields=FIELDS)
+        for fields, s0 in zip(results, batch):
+            check(fields, s0)
+        # Run by the workers, each replaced after two calculations
+        assert fake.runs() == 0
+        assert [line.split()[0] for line in log.readlines()] == \
+            ["worker"] * 3
+        assert oc.POOL.stats == {"started": 2, "recycled": 1, "replaced": 0}
+        oc.set_parallelism(2, threads=1)
+        assert oc.POOL.size == 2
+
+        s0, = states(1)
+        s0.flat[2] = 1
+        with pytest.raises(Exception) as info:
+            oc.calculate_oommf_fields("t", s0, 8e5, "# fakeoommf: fail",
+                                      fields=FIELDS)
+        assert "Failed as requested" in str(info.value)
+    finally:
+        oc.use_workers(False)
+    assert oc.POOL is None
+
+
+def test_remove_old_results(tmpdir, monkeypatch):
+    monkeypatch.setattr(oc, "CACHE_DIR", str(tmpdir))
+    old = tmpdir.mkdir("t_0123456789abcdef0123456789abcdef")
+    old.join("t.omf").write("")
+    tmpdir.join("index.json").write("{}")
+    tmpdir.mkdir("results")
+    tmpdir.join("notes").write("")
+    expected = [str(old), str(tmpdir.join("index.json"))]
+    # Nothing is removed with dry_run
+    assert oc.remove_old_results(dry_run=True) == sorted(expected)
+    assert old.check()
+    assert oc.remove_old_results() == sorted(expected)
+    assert sorted(os.listdir(str(tmpdir))) == ["notes", "results"]
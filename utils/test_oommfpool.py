@@ -0,0 +1,155 @@
+import os
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+from lattice import FieldLattice
+from oommfpool import (OOMMFWorkerError, WorkerPool, WORKER_SCRIPT,
+                       oxs_worker_command)
+from ovf import OVFFile
+
+FAKE_WORKER = [sys.executable,
+               os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "fakeoommf.py"),
+               "worker", WORKER_SCRIPT]
+
+
+@pytest.fixture
+def log(tmpdir, monkeypatch):
+    path = tmpdir.join("runs.log")
+    monkeypatch.setenv("FAKEOOMMF_LOG", str(path))
+    return path
+
+
+def problem(directory, name, extra=""):
+    # A problem for fakeoommf, with its initial magnetisation
+    directory = str(directory)
+    field = FieldLattice("0.5,1.5,2/0.5,0.5,1/0.5,0.5,1",
+                         data=np.arange(6.).reshape((3, 2, 1, 1)))
+    ovf = OVFFile()
+    ovf.new(field, data_type="binary8")
+    ovf.write(os.path.join(directory, name + "-start.omf"))
+    mif = os.path.join(directory, name + ".mif")
+    with open(mif, "w") as f:
+        f.write("# MIF 2.1\n%s\nfile %s-start.omf\n" % (extra, name))
+    outputs = [("Oxs_TimeDriver::Spin", os.path.join(directory,
+                                                     name + "-m.omf")),
+               ("Oxs_Demag::Field", os.path.join(directory, name + "-h.ohf"))]
+    return mif, outputs
+
+
+def check_outputs(outputs):
+    m = OVFFile(outputs[0][1]).get_field().field_data
+    h = OVFFile(outputs[1][1]).get_field().field_data
+    assert np.array_equal(m.ravel(), np.arange(6.))
+    assert not h.any()
+
+
+def test_run(tmpdir, log):
+    # Names with spaces and Tcl special characters
+    directory = tmpdir.mkdir("a dir {with} [special] $chars")
+    pool = WorkerPool(FAKE_WORKER)
+    for name in ["a", "b", "c"]:
+        mif, outputs = problem(directory, name)
+        pool.run(mif, outputs, threads=2)
+        check_outputs(outputs)
+    # The same worker runs all the problems
+    assert pool.stats == {"started": 1, "recycled": 0, "replaced": 0}
+    assert [line.split()[:2] for line in log.readlines()] == \
+        [["worker", "2"]] * 3
+    pool.close()
+    with pytest.raises(RuntimeError):
+        pool.run(mif, outputs)
+
+
+def test_recycling(tmpdir, log):
+    pool = WorkerPool(FAKE_WORKER, max_jobs=2)
+    for i in range(5):
+        mif, outputs = problem(tmpdir, "p%d" % i)
+        pool.run(mif, outputs)
+    assert pool.stats == {"started": 3, "recycled": 2, "replaced": 0}
+    pool.close()
+
+
+def test_failures(tmpdir, log):
+    pool = WorkerPool(FAKE_WORKER)
+    mif, outputs = problem(tmpdir, "ok")
+
+    # A failed problem leaves the worker usable
+    with pytest.raises(OOMMFWorkerError) as info:
+        pool.run(*problem(tmpdir, "fail", "fakeoommf: fail"))
+    assert "Failed as requested" in str(info.value)
+    pool.run(mif, outputs)
+    assert pool.stats["started"] == 1
+
+    # A worker which exits or does not complete in time is replaced
+    with pytest.raises(OOMMFWorkerError) as info:
+        pool.run(*problem(tmpdir, "crash", "fakeoommf: crash"))
+    assert "exited (return code 3)" in str(info.value)
+    assert "Fake Oxs shell" in str(info.value)
+    with pytest.raises(OOMMFWorkerError) as info:
+        pool.run(*problem(tmpdir, "hang", "fakeoommf: hang"), timeout=0.5)
+    assert "did not answer" in str(info.value)
+    pool.run(mif, outputs)
+    check_outputs(outputs)
+    assert pool.stats["started"] == 3
+    pool.close()
+
+    with pytest.raises(OOMMFWorkerError):
+        WorkerPool([str(tmpdir.join("missing"))]).run(mif, outputs)
+
+
+def test_health_check(tmpdir, log):
+    pool = WorkerPool(FAKE_WORKER)
+    mif, outputs = problem(tmpdir, "a")
+    pool.run(mif, outputs)
+    # An idle worker which died is replaced before the next problem
+    pool._idle[0].process.kill()
+    pool.run(mif, outputs)
+    assert pool.stats == {"started": 2, "recycled": 0, "replaced": 1}
+    pool.close()
+
+
+def test_concurrency(tmpdir, log):
+    pool = WorkerPool(FAKE_WORKER, size=2)
+    problems = [problem(tmpdir, "p%d" % i) for i in range(6)]
+    errors = []
+
+    def run(mif, outputs):
+        try:
+            pool.run(mif, outputs)
+        except Exception as ex:
+            errors.append(ex)
+
+    threads = [threading.Thread(target=run, args=p) for p in problems]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    for _, outputs in problems:
+        check_outputs(outputs)
+    assert pool.stats["started"] <= 2
+    assert len(log.readlines()) == 6
+
+    pool.resize(1)
+    assert pool._num_workers <= 1
+    with pytest.raises(ValueError):
+        pool.resize(0)
+    pool.close()
+
+
+def test_oxs_worker_command(tmpdir):
+    oommf = tmpdir.join("oommf")
+    oommf.write("#!/bin/sh\n"
+                "echo '/opt/oommf/app/oxs/linux/oxs "
+                "\"/opt/oommf dir/app/oxs/boxsi.tcl\"'\n")
+    oommf.chmod(0o755)
+    assert oxs_worker_command(str(oommf)) == \
+        ["/opt/oommf/app/oxs/linux/oxs", WORKER_SCRIPT]
+
+    oommf.write("#!/bin/sh\necho 'Unknown option'\nexit 1\n")
+    with pytest.raises(OOMMFWorkerError):
+        oxs_worker_command(str(oommf))
@@ -91,3 +91,314 @@ def test_example_docstring_read_ovf_file_ovf2():
     # fl is a FieldLattice object, see module lattice.py
     # fl.lattice is a Lattice object, describing the mesh (lattice.py)
     #  fl.field_data is the numpy array containing the data
+
+
+@pytest.fixture
+def field2():
+    from lattice import FieldLattice
+
+    # A field with different values in each node, so that the ordering of
+    # the data in the file is tested as well
+    data = np.arange(3 * 4 * 3 * 2, dtype=float).reshape((3, 4, 3, 2),
+                                                         order="F")
+    return FieldLattice("0.5, 3.5, 4/0.5, 2.5, 3/0.5, 1.5, 2", data=data)
+
+
+@pytest.mark.parametrize("version", [(1, 0), (2, 0)])
+@pytest.mark.parametrize("data_type", ["binary4", "binary8"])
+def test_read_binary_into_numpy_array(tmpdir, field2, version, data_type):
+    from ovf import OVFFile
+    path = os.path.join(str(tmpdir), "binary.ovf")
+    ovf = OVFFile()
+    ovf.new(field2, version=version, data_type=data_type)
+    ovf.write(path)
+
+    fl = OVFFile(path).get_field()
+    data = fl.field_data
+    assert data.shape == (3, 4, 3, 2)
+    assert data.dtype == (np.float32 if data_type == "binary4"
+                          else np.float64)
+    assert data.dtype.isnative
+    assert np.array_equal(data, field2.field_data)
+
+
+def test_read_binary_with_newline_bytes_in_data(tmpdir, field2):
+    from ovf import OVFFile, OVF20
+    # 0x0d0a ("\r\n") in the payload must not be altered while reading
+    data = np.frombuffer(b"\r\n" * 4 * 72, dtype="<f8").copy()
+    field2.field_data = data.reshape((3, 4, 3, 2), order="F")
+    path = os.path.join(str(tmpdir), "newlines.ovf")
+    ovf = OVFFile()
+    ovf.new(field2, version=OVF20, data_type="binary8")
+    ovf.write(path)
+
+    fl = OVFFile(path).get_field()
+    assert fl.field_data.tobytes(order="F") == b"\r\n" * 4 * 72
+
+
+@pytest.mark.parametrize("version", [(1, 0), (2, 0)])
+def test_read_binary_mmap(tmpdir, field2, version):
+    from ovf import OVFFile
+    path = os.path.join(str(tmpdir), "mmap.ovf")
+    ovf = OVFFile()
+    ovf.new(field2, version=version, data_type="binary8")
+    ovf.write(path)
+
+    ovf_file = OVFFile(path, mmap=True)
+    fl = ovf_file.get_field()
+    data = fl.field_data
+    assert isinstance(data.base, np.memmap)
+    assert not data.flags.writeable
+    assert data.shape == (3, 4, 3, 2)
+    assert np.array_equal(data, field2.field_data)
+    assert np.array_equal(data[:, 1:3, 2, 1], field2.field_data[:, 1:3, 2, 1])
+
+    # The header is fully available, as when reading the whole file
+    assert ovf_file.content.a_segment.a_header.a_xnodes.value == 4
+
+
+def test_read_text_mmap_falls_back_to_reading(tmpdir, field2):
+    from ovf import OVFFile, OVF20
+    path = os.path.join(str(tmpdir), "mmap.ovf")
+    ovf = OVFFile()
+    ovf.new(field2, version=OVF20, data_type="text")
+    ovf.write(path)
+
+    fl = OVFFile(path, mmap=True).get_field()
+    assert np.array_equal(fl.field_data, field2.field_data)
+
+
+@pytest.mark.parametrize("data_type", ["binary4", "binary8"])
+def test_write_binary_in_chunks(tmpdir, field2, monkeypatch, data_type):
+    import ovf
+    from lattice import FieldLattice
+    monkeypatch.setattr(ovf, "WRITE_CHUNK_SIZE", 5)
+
+    # The same data, Fortran-ordered and as a C-ordered (3, n) array (as
+    # stored in a mesh.MeshField)
+    data_f = field2.field_data
+    data_c = np.ascontiguousarray(data_f.reshape((3, -1), order="F"))
+    fields = [field2, FieldLattice(field2.lattice, data=data_c)]
+    for i, fl in enumerate(fields):
+        path = os.path.join(str(tmpdir), "chunks%d.ovf" % i)
+        ovf_file = ovf.OVFFile()
+        ovf_file.new(fl, version=ovf.OVF10, data_type=data_type)
+        ovf_file.write(path)
+
+        data = ovf.OVFFile(path).get_field().field_data
+        assert np.array_equal(data, data_f)
+
+    assert (open(os.path.join(str(tmpdir), "chunks0.ovf"), "rb").read() ==
+            open(os.path.join(str(tmpdir), "chunks1.ovf"), "rb").read())
+
+
+@pytest.mark.parametrize("version", [(1, 0), (2, 0)])
+def test_text_data_ordering_matches_binary(tmpdir, field2, version):
+    from ovf import OVFFile
+    for data_type in ["text", "binary8"]:
+        path = os.path.join(str(tmpdir), data_type + ".ovf")
+        ovf = OVFFile()
+        ovf.new(field2, version=version, data_type=data_type)
+        ovf.write(path)
+        fl = OVFFile(path).get_field()
+        assert np.array_equal(fl.field_data, field2.field_data)
+
+    # Nodes are stored with x varying fastest, one node per line
+    lines = open(os.path.join(str(tmpdir), "text.ovf"),
+                 encoding='ISO-8859-1').read().splitlines()
+    first = lines.index("# Begin: Data Text") + 1
+    assert [float(v) for v in lines[first].split()] == [0., 1., 2.]
+    assert [float(v) for v in lines[first + 1].split()] == [3., 4., 5.]
+    assert lines[first + 24] == "# End: Data Text"
+
+
+def test_text_data_in_chunks(tmpdir, field2, monkeypatch):
+    import ovf
+    # Chunks smaller than a line, so that numbers are split across chunks
+    monkeypatch.setattr(ovf, "READ_CHUNK_SIZE", 7)
+    monkeypatch.setattr(ovf, "WRITE_CHUNK_SIZE", 5)
+    field2.field_data = field2.field_data * np.pi
+    path = os.path.join(str(tmpdir), "text.ovf")
+    ovf_file = ovf.OVFFile()
+    ovf_file.new(field2, version=ovf.OVF20, data_type="text")
+    ovf_file.write(path)
+    fl = ovf.OVFFile(path).get_field()
+    assert np.array_equal(fl.field_data, field2.field_data)
+
+
+def test_text_data_precision(tmpdir, field2):
+    from ovf import OVFFile, OVF20
+    field2.field_data = field2.field_data + 1.0 / 3.0
+    path = os.path.join(str(tmpdir), "text.ovf")
+    ovf = OVFFile()
+    ovf.new(field2, version=OVF20, data_type="text")
+    ovf.write(path, precision=4)
+    assert "0.3333 1.333 2.333\n" in open(path, encoding='ISO-8859-1').read()
+    fl = OVFFile(path).get_field()
+    assert np.allclose(fl.field_data, field2.field_data, rtol=1e-3)
+
+
+def test_text_data_wrong_number_of_values(tmpdir, field2):
+    from ovf import OVFFile, OVF20, OVFReadError
+    path = os.path.join(str(tmpdir), "text.ovf")
+    ovf = OVFFile()
+    ovf.new(field2, version=OVF20, data_type="text")
+    ovf.write(path)
+    content = open(path, encoding='ISO-8859-1').read()
+    with open(path, "w", encoding='ISO-8859-1') as f:
+        f.write(content.replace("0.0 1.0 2.0\n", ""))
+    with pytest.raises(OVFReadError):
+        OVFFile(path)
+
+
+def test_stream_does_not_retain_lines(tmpdir, field2):
+    import io
+    from ovf import OVFFile, OVFStream, OVF20
+    path = os.path.join(str(tmpdir), "stream.ovf")
+    ovf = OVFFile()
+    ovf.new(field2, version=OVF20, data_type="text")
+    ovf.write(path)
+
+    stream = OVFStream(path)
+    OVFFile().read(stream)
+    assert stream.lines is None
+    assert stream.no_line > 0
+
+    stream = OVFStream(path, keep_lines=True)
+    OVFFile().read(stream)
+    assert stream.lines[0] == "# OOMMF OVF 2.0"
+    assert stream.lines[-1] == "# End: Segment"
+
+    # Streams can also wrap file objects opened in binary mode
+    stream = OVFStream(io.BytesIO(open(path, "rb").read()))
+    ovf = OVFFile()
+    ovf.read(stream)
+    assert np.array_equal(ovf.get_field().field_data, field2.field_data)
+
+
+@pytest.fixture
+def fields3(field2):
+    from lattice import FieldLattice
+    return [FieldLattice(field2.lattice, data=field2.field_data + 100.0 * i)
+            for i in range(3)]
+
+
+@pytest.mark.parametrize("data_type", ["text", "binary4", "binary8"])
+@pytest.mark.parametrize("lazy", [False, True])
+def test_multiple_segments(tmpdir, fields3, data_type, lazy):
+    from ovf import OVFFile, OVF20
+    path = os.path.join(str(tmpdir), "segments.ovf")
+    ovf = OVFFile()
+    ovf.new(fields3, version=OVF20, data_type=data_type)
+    ovf.write(path)
+    content = open(path, "rb").read()
+    assert b"# Segment count: 3\n" in content
+    assert content.count(b"# Begin: Segment") == 3
+
+    ovf_file = OVFFile(path, lazy=lazy)
+    assert ovf_file.get_num_segments() == 3
+    offsets = ovf_file.segment_offsets
+    assert len(offsets) == 3
+    for offset in offsets:
+        assert content[offset:].startswith(b"# Begin: Segment\n")
+
+    data_nodes = [s.a_data for s in ovf_file.content.segments]
+    assert all((node.field is None) == lazy for node in data_nodes)
+
+    # Random access to the segments: only the requested one is loaded
+    for i in [2, 0, 1]:
+        fl = ovf_file.get_field(segment=i)
+        assert np.array_equal(fl.field_data, fields3[i].field_data)
+        assert data_nodes[i].field is not None
+    assert ovf_file.content.a_segment is ovf_file.content.segments[0]
+
+
+@pytest.mark.parametrize("data_type", ["text", "binary8"])
+def test_lazy_read_then_write(tmpdir, fields3, data_type):
+    from ovf import OVFFile, OVF10
+    path = os.path.join(str(tmpdir), "segments.ovf")
+    ovf = OVFFile()
+    ovf.new(fields3, version=OVF10, data_type=data_type)
+    ovf.write(path)
+
+    copy_path = os.path.join(str(tmpdir), "copy.ovf")
+    lazy_file = OVFFile(path, lazy=True)
+    lazy_file.write(copy_path)
+    assert open(path, "rb").read() == open(copy_path, "rb").read()
+    # The segments are streamed to the output, not kept in memory
+    assert all(s.a_data.field is None for s in lazy_file.content.segments)
+
+
+def test_wrong_segment_count(tmpdir, fields3):
+    from ovf import OVFFile, OVF20, OVFReadError
+    path = os.path.join(str(tmpdir), "segments.ovf")
+    ovf = OVFFile()
+    ovf.new(fields3, version=OVF20, data_type="binary8")
+    ovf.content.a_segmentcount.value = 2
+    ovf.write(path)
+    with pytest.raises(OVFReadError):
+        OVFFile(path, lazy=True)
+
+
+def test_get_field_lattice_matches_written_lattice(tmpdir, field2):
+    from ovf import OVFFile, OVF20
+    path = os.path.join(str(tmpdir), "lattice.ovf")
+    ovf = OVFFile()
+    ovf.new(field2, version=OVF20, data_type="binary8")
+    ovf.write(path)
+
+    h = OVFFile(path).content.a_segment.a_header
+    assert (h.a_xmin.value, h.a_xmax.value, h.a_xbase.value) == (0., 4., .5)
+    assert (h.a_zmin.value, h.a_zmax.value, h.a_zbase.value) == (0., 2., .5)
+
+    fl = OVFFile(path).get_field()
+    assert np.allclose(fl.lattice.min_max_num_list,
+                       field2.lattice.min_max_num_list)
+
+
+@pytest.mark.parametrize("data_type", ["text", "binary4", "binary8"])
+@pytest.mark.parametrize("mode", ["", "lazy", "mmap"])
+def test_get_field_subvolume(tmpdir, fields3, data_type, mode):
+    from ovf import OVFFile, OVF10
+    path = os.path.join(str(tmpdir), "subvolume.ovf")
+    ovf = OVFFile()
+    ovf.new(fields3, version=OVF10, data_type=data_type)
+    ovf.write(path)
+
+    ovf_file = OVFFile(path, lazy=(mode == "lazy"), mmap=(mode == "mmap"))
+    fl = ovf_file.get_field(segment=1, cells=[(1, 3), None, (1, 2)])
+    expected = fields3[1].field_data[:, 1:3, :, 1:2]
+    assert fl.field_data.shape == (3, 2, 3, 1)
+    assert fl.field_data.dtype.isnative
+    assert np.array_equal(fl.field_data, expected)
+    assert np.allclose(fl.lattice.min_max_num_list,
+                       [(1.5, 2.5, 2), (0.5, 2.5, 3), (1.5, 2.5, 1)])
+    if mode == "lazy" and data_type != "text":
+        # Text data must be read whole, but binary data is only mapped
+        assert ovf_file.content.segments[1].a_data.field is None
+
+    # The cells intersecting the box [1.2, 2.9] x [0, 3] x [1.9, 2.0]
+    fl = ovf_file.get_field(segment=1, box=[(1.2, 2.9), (0, 3), (1.9, 2.0)])
+    assert np.array_equal(fl.field_data, expected)
+
+    # Boxes of zero width on the boundaries of the cells and of the mesh
+    fl = ovf_file.get_field(segment=1, box=[(1., 1.), (0, 0), (2., 2.)])
+    assert np.array_equal(fl.field_data,
+                          fields3[1].field_data[:, 1:2, 0:1, 1:2])
+
+
+def test_get_field_invalid_subvolume(tmpdir, field2):
+    from ovf import OVFFile, OVF20
+    path = os.path.join(str(tmpdir), "subvolume.ovf")
+    ovf = OVFFile()
+    ovf.new(field2, version=OVF20, data_type="binary8")
+    ovf.write(path)
+    ovf_file = OVFFile(path)
+    with pytest.raises(ValueError):
+        ovf_file.get_field(cells=[(2, 5), None, None])
+    with pytest.raises(ValueError):
+        ovf_file.get_field(cells=[(2, 2), None, None])
+    with pytest.raises(ValueError):
+        ovf_file.get_field(box=[(5, 6), None, None])
+    with pytest.raises(ValueError):
+        ovf_file.get_field(box=[(5, 5), None, None])
@@ -0,0 +1,109 @@
+import os
+
+import numpy as np
+import pytest
+
+import ovfbatch
+from lattice import FieldLattice
+from ovf import OVFFile, OVF10, OVF20
+
+
+@pytest.fixture
+def ovf_files(tmpdir):
+    paths = []
+    for i in range(3):
+        data = np.random.RandomState(i).uniform(-1, 1, (3, 4, 3, 2))
+        fls = [FieldLattice("0.5,3.5,4/0.5,2.5,3/0.5,1.5,2",
+                            data=np.asfortranarray(data * (j + 1)))
+               for j in range(2)]
+        ovf = OVFFile()
+        ovf.new(fls, version=OVF10, data_type="text")
+        ovf.content.valueunits = "A/m"
+        path = os.path.join(str(tmpdir), "m%d.omf" % i)
+        ovf.write(path)
+        paths.append(path)
+    return paths
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_convert(tmpdir, ovf_files, processes):
+    out_dir = os.path.join(str(tmpdir), "out")
+    written = ovfbatch.convert(ovf_files, out_dir, version=OVF20,
+                               data_type="binary4", processes=processes)
+    assert written == [os.path.join(out_dir, os.path.basename(path))
+                       for path in ovf_files]
+    for path, out_path in zip(ovf_files, written):
+        src, dst = OVFFile(path), OVFFile(out_path)
+        assert dst.content.ovf_version == OVF20
+        assert dst.content.a_segment.a_data.name == "Data Binary 4"
+        assert dst.content.valueunits.units == ["A/m"] * 3
+        assert dst.get_num_segments() == 2
+        for i in range(2):
+            assert np.allclose(dst.get_field(segment=i).field_data,
+                               src.get_field(segment=i).field_data)
+
+    with pytest.raises(ValueError):
+        ovfbatch.convert(ovf_files, str(tmpdir))
+
+    # Files with the same name would overwrite each other
+    with pytest.raises(ValueError):
+        ovfbatch.convert([ovf_files[0], written[0]],
+                         os.path.join(str(tmpdir), "out2"))
+    assert not os.path.exists(os.path.join(str(tmpdir), "out2"))
+
+
+def test_reduce_files(tmpdir, ovf_files):
+    output = os.path.join(str(tmpdir), "stats.npz")
+    ovfbatch.main(["-j", "2", "reduce", "-o", output,
+                   os.path.join(str(tmpdir), "*.omf")])
+    stats = np.load(output)
+    assert list(stats["files"]) == [p for p in ovf_files for _ in range(2)]
+    assert list(stats["segments"]) == [0, 1] * 3
+
+    for row, (path, segment) in enumerate(zip(stats["files"],
+                                              stats["segments"])):
+        data = OVFFile(str(path)).get_field(segment=segment).field_data
+        norm = np.sqrt(np.sum(data ** 2, axis=0))
+        assert np.allclose(stats["mean"][row], data.mean(axis=(1, 2, 3)))
+        assert np.allclose(stats["min"][row], data.min(axis=(1, 2, 3)))
+        assert np.allclose(stats["max"][row], data.max(axis=(1, 2, 3)))
+        assert np.isclose(stats["norm_mean"][row], norm.mean())
+        assert np.isclose(stats["norm_min"][row], norm.min())
+        assert np.isclose(stats["norm_max"][row], norm.max())
+        assert np.isclose(stats["norm_std"][row], norm.std())
+
+    # Any iterable of file names
+    reductions = ovfbatch.reduce_files(iter(ovf_files), processes=1)
+    assert list(reductions["files"]) == list(stats["files"])
+
+
+def test_value_multiplier(tmpdir, ovf_files):
+    # OVF 1.0 data is scaled by the value multiplier
+    ovf = OVFFile(ovf_files[0])
+    for segment in ovf.content.segments:
+        segment.a_header.a_valuemultiplier.value = 8e5
+    path = os.path.join(str(tmpdir), "scaled", "m.omf")
+    os.makedirs(os.path.dirname(path))
+    ovf.write(path)
+    expected = [8e5 * ovf.get_field(segment=i).field_data for i in range(2)]
+
+    for n, version in enumerate((OVF10, OVF20)):
+        out_dir = os.path.join(str(tmpdir), "out%d" % n)
+        out_path, = ovfbatch.convert([path], out_dir, version=version,
+                                     processes=1)
+        dst = OVFFile(out_path)
+        if version == OVF10:
+            assert dst.content.a_segment.a_header.a_valuemultiplier.value \
+                == 1.0
+        for i in range(2):
+            assert np.allclose(dst.get_field(segment=i).field_data,
+                               expected[i])
+
+    reductions = ovfbatch.reduce_files([path], processes=1)
+    for i in range(2):
+        assert np.allclose(reductions["mean"][i],
+                           expected[i].mean(axis=(1, 2, 3)))
+        assert np.allclose(reductions["max"][i],
+                           expected[i].max(axis=(1, 2, 3)))
+        assert np.isclose(reductions["norm_max"][i],
+                          np.sqrt(np.sum(expected[i] ** 2, axis=0)).max())
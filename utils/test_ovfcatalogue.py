@@ -0,0 +1,94 @@
+import os
+
+import numpy as np
+import pytest
+
+from lattice import FieldLattice
+from ovf import OVFFile, OVF10, OVF20, scan_header
+from ovfcatalogue import OVFCatalogue
+
+
+def write_ovf(path, nodes=(4, 3, 2), version=OVF20, data_type="binary8"):
+    spec = "/".join("0.5,%g,%d" % (n - 0.5, n) for n in nodes)
+    fl = FieldLattice(spec, data=np.zeros((3,) + nodes, order="F"))
+    ovf = OVFFile()
+    ovf.new(fl, version=version, data_type=data_type)
+    ovf.write(path)
+    return path
+
+
+@pytest.mark.parametrize("version", [OVF10, OVF20])
+@pytest.mark.parametrize("data_type", ["text", "binary4", "binary8"])
+def test_scan_header(tmpdir, version, data_type):
+    path = write_ovf(os.path.join(str(tmpdir), "m.omf"), version=version,
+                     data_type=data_type)
+    info = scan_header(path)
+    assert info["version"] == "%d.%d" % version
+    assert info["data_type"] == data_type
+    assert info["num_segments"] == 1
+    assert info["nodes"] == [4, 3, 2]
+    assert info["stepsizes"] == [1., 1., 1.]
+    assert info["min"] == [0., 0., 0.]
+    assert info["max"] == [4., 3., 2.]
+    assert info["valuedim"] == 3
+    assert info["valueunits"] == ["1.0", "1.0", "1.0"]
+
+    # The data offset points right after the "Begin: Data" line
+    content = open(path, "rb").read()
+    header_lines = content[:info["data_offset"]].splitlines(True)
+    assert header_lines[-1].startswith(b"# Begin: Data")
+    assert header_lines[-1].endswith(b"\n")
+
+
+def test_catalogue_refresh(tmpdir):
+    directory = str(tmpdir)
+    write_ovf(os.path.join(directory, "a.omf"))
+    write_ovf(os.path.join(directory, "b.ohf"), nodes=(2, 2, 1))
+    open(os.path.join(directory, "notes.txt"), "w").close()
+
+    catalogue = OVFCatalogue(directory)
+    assert list(catalogue) == ["a.omf", "b.ohf"]
+    assert catalogue["b.ohf"]["nodes"] == [2, 2, 1]
+    assert os.path.exists(catalogue.index_path)
+
+    # A new catalogue object reads the index and scans nothing
+    catalogue = OVFCatalogue(directory)
+    assert catalogue.refresh() == 0
+    assert len(catalogue) == 2
+
+    # Only modified and new files are scanned, removed ones are dropped
+    path = write_ovf(os.path.join(directory, "a.omf"), nodes=(5, 1, 1))
+    st = os.stat(path)
+    os.utime(path, (st.st_atime, st.st_mtime + 10))
+    write_ovf(os.path.join(directory, "c.omf"))
+    os.remove(os.path.join(directory, "b.ohf"))
+    assert catalogue.refresh() == 2
+    assert list(catalogue) == ["a.omf", "c.omf"]
+    assert catalogue["a.omf"]["nodes"] == [5, 1, 1]
+    assert catalogue.newest() == "a.omf"
+
+    catalogue = OVFCatalogue(directory, refresh=False)
+    assert list(catalogue) == ["a.omf", "c.omf"]
+    assert catalogue.sorted(key=lambda e: e["nodes"][0]) == ["c.omf", "a.omf"]
+
+
+def test_catalogue_unreadable_files(tmpdir):
+    directory = str(tmpdir)
+    write_ovf(os.path.join(directory, "a.omf"))
+    path = write_ovf(os.path.join(directory, "b.omf"))
+    # Half written
+    with open(path, "rb") as f:
+        head = f.read(100)
+    with open(path, "wb") as f:
+        f.write(head)
+
+    catalogue = OVFCatalogue(directory)
+    assert list(catalogue) == ["a.omf"]
+    assert list(catalogue.errors) == ["b.omf"]
+
+    write_ovf(path)
+    st = os.stat(path)
+    os.utime(path, (st.st_atime, st.st_mtime + 10))
+    assert catalogue.refresh() == 1
+    assert list(catalogue) == ["a.omf", "b.omf"]
+    assert catalogue.errors == {}
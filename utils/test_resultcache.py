@@ -0,0 +1,137 @@
+import os
+
+import numpy as np
+
+from resultcache import ResultCache, MemoCache
+
+
+def test_put_get(tmpdir):
+    cache = ResultCache(str(tmpdir))
+    assert cache.get("a") is None
+    cache.put("a", {"x": np.arange(10.), "y": np.ones((3, 4))})
+    assert "a" in cache and len(cache) == 1
+    assert cache.total_bytes == 10 * 8 + 12 * 8
+
+    arrays = ResultCache(str(tmpdir)).get("a")
+    assert sorted(arrays) == ["x", "y"]
+    assert np.array_equal(arrays["x"], np.arange(10.))
+    assert isinstance(arrays["y"], np.memmap)
+    # Modifying a result does not change the cache
+    arrays["x"][0] = 42
+    assert cache.get("a")["x"][0] == 0
+    assert cache.stats == {"hits": 1, "misses": 1, "puts": 1,
+                           "evictions": 0}
+
+    # Reading does not rewrite the index
+    old = int(os.stat(cache.index_path).st_mtime) - 10
+    os.utime(cache.index_path, (old, old))
+    cache.get("a")
+    assert os.stat(cache.index_path).st_mtime == old
+
+    # Replacing a result
+    cache.put("a", {"z": np.zeros(2)})
+    assert sorted(cache.get("a")) == ["z"]
+    assert sorted(os.listdir(str(tmpdir))) == ["a", "index.json",
+                                               "index.lock"]
+    cache.put("a", {"x": np.arange(10.), "y": np.ones((3, 4))})
+
+    # Results removed behind the back of the cache are forgotten
+    os.remove(os.path.join(str(tmpdir), "a", "x.npy"))
+    assert cache.get("a") is None
+    assert "a" not in cache
+
+
+def test_get_replaced_while_damaged(tmpdir):
+    cache = ResultCache(str(tmpdir))
+    cache.put("a", {"x": np.arange(3.)})
+    os.remove(os.path.join(str(tmpdir), "a", "x.npy"))
+    load = cache._load
+
+    def replaced_load(key):
+        # Another process replaces the damaged result after the first read
+        arrays = load(key)
+        if arrays is None and cache._load is replaced_load:
+            cache._load = load
+            ResultCache(str(tmpdir)).put("a", {"x": np.ones(3)})
+        return arrays
+
+    cache._load = replaced_load
+    # The valid result is returned and kept
+    assert np.array_equal(cache.get("a")["x"], np.ones(3))
+    assert "a" in cache and len(cache) == 1
+    assert cache.stats["hits"] == 1
+
+
+def test_lru_eviction(tmpdir):
+    cache = ResultCache(str(tmpdir), max_bytes=3 * 800)
+    for key in "abc":
+        cache.put(key, {"x": np.zeros(100)})
+    assert len(cache) == 3
+
+    # "a" becomes the most recently used and "b" is evicted
+    assert cache.get("a") is not None
+    cache.put("d", {"x": np.zeros(100)})
+    assert sorted(ResultCache(str(tmpdir))._load_index()) == ["a", "c", "d"]
+    assert not os.path.exists(os.path.join(str(tmpdir), "b"))
+    assert cache.stats["evictions"] == 1
+
+    # Results larger than the budget are not saved
+    cache.put("e", {"x": np.zeros(1000)})
+    assert "e" not in cache
+
+    cache.clear()
+    assert len(cache) == 0 and cache.total_bytes == 0
+
+
+def test_hash_array():
+    import hashlib
+    from resultcache import hash_array
+
+    a = np.arange(1000.).reshape((10, 100))
+
+    def digest(a, **kwargs):
+        h = hashlib.md5()
+        hash_array(h, a, **kwargs)
+        return h.hexdigest()
+
+    expected = hashlib.md5(b"<f8|(10, 100)|" + a.tobytes()).hexdigest()
+    assert digest(a, chunk_size=333) == expected
+    assert digest(np.asfortranarray(a)) == expected
+    assert digest(a.reshape((100, 10))) != expected
+    for fast in [False, True]:
+        b = a.copy()
+        b[9, 99] += 1
+        assert digest(a, fast=fast) != digest(b, fast=fast)
+        assert digest(a, fast=fast, chunk_size=64) == \
+            digest(a.copy(), fast=fast, chunk_size=64)
+
+
+def test_memo_cache():
+    cache = MemoCache(max_entries=2, max_bytes=3 * 800)
+    assert cache.get("a") is None
+    x = np.zeros(100)
+    saved = cache.put("a", {"x": x})
+    # The arrays are shared, but read-only
+    assert np.may_share_memory(saved["x"], x)
+    arrays = cache.get("a")
+    assert np.may_share_memory(arrays["x"], x)
+    assert not arrays["x"].flags.writeable
+    assert cache.total_bytes == 800
+
+    # Limited number of entries: "a" is the most recently used
+    cache.put("b", {"x": np.zeros(100)})
+    assert cache.get("a") is not None
+    cache.put("c", {"x": np.zeros(100)})
+    assert "a" in cache and "b" not in cache and "c" in cache
+
+    # Limited size
+    cache.put("d", {"x": np.zeros(200)})
+    assert "a" not in cache and "c" in cache and "d" in cache
+    assert cache.total_bytes == 2400
+    cache.put("e", {"x": np.zeros(1000)})
+    assert "e" not in cache and len(cache) == 2
+    assert cache.stats == {"hits": 2, "misses": 1, "puts": 4,
+                           "evictions": 2}
+
+    cache.clear()
+    assert len(cache) == 0 and cache.total_bytes == 0
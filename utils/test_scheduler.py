@@ -0,0 +1,116 @@
+import threading
+import time
+
+import pytest
+
+from scheduler import Future, FutureTimeout, Scheduler
+
+
+def test_future():
+    future = Future()
+    assert not future.done()
+    with pytest.raises(FutureTimeout):
+        future.result(timeout=0.01)
+    calls = []
+    future.add_done_callback(calls.append)
+    future.set_result(42)
+    assert future.done() and future.result() == 42
+    assert future.exception() is None
+    future.add_done_callback(calls.append)
+    assert calls == [future, future]
+
+    future = Future()
+    future.set_exception(ValueError("failed"))
+    assert isinstance(future.exception(), ValueError)
+    with pytest.raises(ValueError):
+        future.result()
+
+
+def test_scheduler_concurrency():
+    scheduler = Scheduler(max_workers=3)
+    lock = threading.Lock()
+    running = [0, 0]
+
+    def job(i):
+        with lock:
+            running[0] += 1
+            running[1] = max(running[1], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        return i * i
+
+    futures = [scheduler.submit(None, job, i) for i in range(9)]
+    assert [f.result(timeout=5) for f in futures] == [i * i for i in range(9)]
+    # Never more than max_workers jobs at the same time
+    assert running[1] == 3
+    assert len(scheduler._workers) == 3
+    scheduler.shutdown()
+    with pytest.raises(RuntimeError):
+        scheduler.submit(None, job, 0)
+
+
+def test_scheduler_deduplication():
+    scheduler = Scheduler(max_workers=2)
+    release = threading.Event()
+    calls = []
+
+    def job(key):
+        calls.append(key)
+        release.wait(5)
+        if key == "bad":
+            raise ValueError(key)
+        return key
+
+    a = scheduler.submit("a", job, "a")
+    assert scheduler.submit("a", job, "a") is a
+    assert scheduler.get_pending("a") is a
+    bad = scheduler.submit("bad", job, "bad")
+    release.set()
+    assert a.result(timeout=5) == "a"
+    assert isinstance(bad.exception(timeout=5), ValueError)
+    assert sorted(calls) == ["a", "bad"]
+
+    # Completed jobs are run again
+    assert scheduler.get_pending("a") is None
+    assert scheduler.submit("a", job, "a").result(timeout=5) == "a"
+    assert calls.count("a") == 2
+    scheduler.shutdown()
+
+
+def test_scheduler_base_exception():
+    scheduler = Scheduler(max_workers=1)
+
+    def job():
+        raise SystemExit(3)
+
+    future = scheduler.submit("a", job)
+    assert isinstance(future.exception(timeout=5), SystemExit)
+    # The key is released and the worker runs the next jobs
+    assert scheduler.get_pending("a") is None
+    assert scheduler.submit("a", lambda: 42).result(timeout=5) == 42
+    scheduler.shutdown()
+
+
+def test_scheduler_resize():
+    scheduler = Scheduler(max_workers=1)
+    release = threading.Event()
+    a = scheduler.submit("a", release.wait, 5)
+    b = scheduler.submit("b", release.wait, 5)
+    # The pending jobs are still deduplicated after resizing
+    scheduler.resize(2)
+    assert scheduler.submit("a", release.wait, 5) is a
+    assert len(scheduler._workers) == 2
+    release.set()
+    assert a.result(timeout=5) and b.result(timeout=5)
+
+    scheduler.resize(1)
+    for _ in range(100):
+        if len(scheduler._workers) == 1:
+            break
+        time.sleep(0.01)
+    assert len(scheduler._workers) == 1
+    assert scheduler.submit(None, lambda: 1).result(timeout=5) == 1
+    with pytest.raises(ValueError):
+        scheduler.resize(0)
+    scheduler.shutdown()
@@ -0,0 +1,101 @@
+import os
+
+import numpy as np
+import pytest
+
+from lattice import FieldLattice
+from ovf import OVFFile
+from snapshotstore import SnapshotStore, ovf_to_store
+
+
+def snapshot(i, nodes=(5, 4, 3)):
+    spec = "/".join("0.5,%g,%d" % (n - 0.5, n) for n in nodes)
+    data = np.arange(3 * np.prod(nodes), dtype=float).reshape((3,) + nodes)
+    return FieldLattice(spec, data=data + 1000 * i)
+
+
+def test_append_and_read(tmpdir):
+    directory = os.path.join(str(tmpdir), "store")
+    store = SnapshotStore(directory, chunk_steps=3, chunk_shape=(2, 3, 2))
+    for i in range(7):
+        store.append(snapshot(i), time=i * 1e-12)
+    assert len(store) == 7
+
+    # Unsaved snapshots can be read as well
+    expected = np.array([snapshot(i).field_data for i in range(7)])
+    assert np.array_equal(store.read(), expected)
+    store.close()
+
+    store = SnapshotStore(directory)
+    assert len(store) == 7
+    assert store.times == [i * 1e-12 for i in range(7)]
+    assert np.array_equal(store.read(), expected)
+    assert np.array_equal(store.read(4), expected[4])
+    assert np.array_equal(store.read(np.arange(7)[4]), expected[4])
+    assert np.array_equal(store.read(steps=slice(2, 7, 2)), expected[2:7:2])
+    cells = [(1, 4), None, (2, 3)]
+    assert np.array_equal(store.read(steps=[-1, 0], cells=cells),
+                          expected[[-1, 0], :, 1:4, :, 2:3])
+
+    # Appending after reopening completes the last chunk
+    store.append(snapshot(7))
+    store.close()
+    store = SnapshotStore(directory)
+    assert len(store) == 8
+    assert np.array_equal(store.read(steps=[6, 7]),
+                          [snapshot(6).field_data, snapshot(7).field_data])
+
+    with pytest.raises(IndexError):
+        store.read(8)
+    with pytest.raises(ValueError):
+        store.read(cells=[(3, 3), None, None])
+    with pytest.raises(ValueError):
+        store.append(snapshot(0, nodes=(2, 2, 2)))
+
+
+def test_default_chunks(tmpdir, monkeypatch):
+    import snapshotstore
+    saves = []
+    save_json = snapshotstore.save_json
+    monkeypatch.setattr(snapshotstore, "save_json",
+                        lambda *args: saves.append(save_json(*args)))
+
+    # A thin film is saved in one file for every 16 snapshots
+    directory = str(tmpdir.join("store"))
+    store = SnapshotStore(directory)
+    for i in range(17):
+        store.append(snapshot(i, nodes=(256, 256, 1)))
+    assert sorted(os.listdir(directory)) == ["t0_x0_y0_z0.npz"]
+    # The index is only written when closing
+    assert saves == []
+    store.close()
+    assert len(saves) == 1
+    assert sorted(os.listdir(directory)) == ["index.json", "t0_x0_y0_z0.npz",
+                                             "t1_x0_y0_z0.npz"]
+    assert np.array_equal(SnapshotStore(directory).read(16),
+                          snapshot(16, nodes=(256, 256, 1)).field_data)
+
+
+def test_ovf_conversion(tmpdir):
+    directory = str(tmpdir)
+    filenames = []
+    for i in range(3):
+        filename = os.path.join(directory, "m%d.omf" % i)
+        ovf = OVFFile()
+        ovf.new(snapshot(i))
+        ovf.write(filename)
+        filenames.append(filename)
+
+    store = ovf_to_store(filenames, os.path.join(directory, "store"),
+                         chunk_steps=2)
+    assert len(store) == 3
+
+    store.to_ovf(2, os.path.join(directory, "out.omf"))
+    field = OVFFile(os.path.join(directory, "out.omf")).get_field()
+    assert np.array_equal(field.field_data, snapshot(2).field_data)
+    assert np.allclose(field.lattice.min_max_num_list,
+                       snapshot(2).lattice.min_max_num_list)
+
+    sub = store.get_field(1, cells=[(1, 3), None, (2, 3)])
+    assert sub.lattice.min_max_num_list == [(1.5, 2.5, 2), (0.5, 3.5, 4),
+                                            (2.5, 3.5, 1)]